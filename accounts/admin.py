@@ -1,6 +1,19 @@
 from django.contrib import admin
+from core import search
+from core.admin import IndexedSearchMixin, ShardedAdminMixin
 from .models import UserBankAccount, UserAddress
 # Register your models here.
 
-admin.site.register(UserBankAccount)
-admin.site.register(UserAddress)
\ No newline at end of file
+@admin.register(UserBankAccount)
+class UserBankAccountAdmin(ShardedAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
+    list_display = ['account_no', 'user', 'account_type', 'balance']
+    list_select_related = ['user']
+    search_fields = ['account_no', 'user__first_name', 'user__last_name', 'user__email']
+    search_kind = search.ACCOUNT
+
+
+@admin.register(UserAddress)
+class UserAddressAdmin(admin.ModelAdmin):
+    list_display = ['user', 'city', 'country']
+    list_select_related = ['user']
+    search_fields = ['user__username', 'city']
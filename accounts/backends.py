@@ -0,0 +1,24 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from core import sharding
+
+
+class AccountModelBackend(ModelBackend):
+    """``ModelBackend`` that loads the session user together with the bank account.
+
+    The navbar shows ``request.user.account.balance`` on every page, so the
+    account is joined into the user query instead of costing one more.  A
+    sharded ledger keeps accounts on other databases; they are then loaded
+    on first use as before.
+    """
+
+    def get_user(self, user_id):
+        if sharding.is_sharded():
+            return super().get_user(user_id)
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related('account').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
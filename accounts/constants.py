@@ -5,4 +5,19 @@ ACCOUNT_TYPE =(
 GENDER_TYPE=(
     ('Male', 'Male'),
     ('Female', 'Female')
-)
\ No newline at end of file
+)
+CURRENCY = (
+    ('USD', 'USD'),
+    ('BDT', 'BDT'),
+    ('EUR', 'EUR'),
+    ('GBP', 'GBP'),
+    ('INR', 'INR'),
+)
+
+INSTANT = 'instant'
+DIGEST = 'digest'
+
+NOTIFICATION_PREFERENCE = (
+    (INSTANT, 'An email for every transaction'),
+    (DIGEST, 'One daily digest email'),
+)
@@ -1,13 +1,16 @@
 from django.contrib.auth.forms import UserCreationForm
 from django import forms
-from .constants import ACCOUNT_TYPE, GENDER_TYPE
+from .constants import ACCOUNT_TYPE, GENDER_TYPE, CURRENCY, NOTIFICATION_PREFERENCE
 from django.contrib.auth.models import User
-from .models import UserBankAccount, UserAddress
+from .models import UserBankAccount, UserAddress, AccountNumberSequence
+from core import sharding
+from transactions import fx
 
 class UserRegistrationForm(UserCreationForm):
     birth_date = forms.DateField(widget=forms.DateInput(attrs={'type':'date'}))
     gender = forms.ChoiceField(choices=GENDER_TYPE)
     account_type = forms.ChoiceField(choices=ACCOUNT_TYPE)
+    currency = forms.ChoiceField(choices=CURRENCY)
     street_address = forms.CharField(max_length=100)
     city = forms.CharField(max_length= 100)
     postal_code = forms.IntegerField()
@@ -24,6 +27,7 @@ class UserRegistrationForm(UserCreationForm):
             'birth_date', 
             'gender', 
             'account_type', 
+            'currency',
             'city', 
             'street_address',
             'country', 
@@ -36,6 +40,7 @@ class UserRegistrationForm(UserCreationForm):
         if commit == True:
             our_user.save() # user model e data save korlam
             account_type = self.cleaned_data.get('account_type')
+            currency = self.cleaned_data.get('currency')
             gender = self.cleaned_data.get('gender')
             postal_code = self.cleaned_data.get('postal_code')
             country = self.cleaned_data.get('country')
@@ -50,17 +55,21 @@ class UserRegistrationForm(UserCreationForm):
                 city = city,
                 street_address = street_address
             )
-            UserBankAccount.objects.create(
+            account_no = AccountNumberSequence.reserve()[0]
+            UserBankAccount.objects.using(sharding.shard_for_account_no(account_no)).create(
                 user = our_user,
                 account_type  = account_type,
+                currency = currency,
                 gender = gender,
                 birth_date =birth_date,
-                account_no = 100000+ our_user.id
+                account_no = account_no
             )
         return our_user
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # only currencies with an exchange rate can take part in transfers
+        self.fields['currency'].choices = fx.currency_choices(CURRENCY)
         
         for field in self.fields:
             self.fields[field].widget.attrs.update({
@@ -80,6 +89,7 @@ class UserUpdateForm(forms.ModelForm):
     birth_date = forms.DateField(widget=forms.DateInput(attrs={'type':'date'}))
     gender = forms.ChoiceField(choices=GENDER_TYPE)
     account_type = forms.ChoiceField(choices=ACCOUNT_TYPE)
+    notifications = forms.ChoiceField(choices=NOTIFICATION_PREFERENCE, label='Email notifications')
     street_address = forms.CharField(max_length=100)
     city = forms.CharField(max_length= 100)
     postal_code = forms.IntegerField()
@@ -113,6 +123,7 @@ class UserUpdateForm(forms.ModelForm):
                 self.fields['account_type'].initial = user_account.account_type
                 self.fields['gender'].initial = user_account.gender
                 self.fields['birth_date'].initial = user_account.birth_date
+                self.fields['notifications'].initial = user_account.notifications
                 self.fields['street_address'].initial = user_address.street_address
                 self.fields['city'].initial = user_address.city
                 self.fields['postal_code'].initial = user_address.postal_code
@@ -123,12 +134,13 @@ class UserUpdateForm(forms.ModelForm):
         if commit:
             user.save()
 
-            user_account, created = UserBankAccount.objects.get_or_create(user=user) # jodi account thake taile seta jabe user_account ar jodi account na thake taile create hobe ar seta created er moddhe jabe
+            user_account, created = UserBankAccount.objects.using(sharding.database_for_user(user.pk)).get_or_create(user=user) # jodi account thake taile seta jabe user_account ar jodi account na thake taile create hobe ar seta created er moddhe jabe
             user_address, created = UserAddress.objects.get_or_create(user=user) 
 
             user_account.account_type = self.cleaned_data['account_type']
             user_account.gender = self.cleaned_data['gender']
             user_account.birth_date = self.cleaned_data['birth_date']
+            user_account.notifications = self.cleaned_data['notifications']
             user_account.save()
 
             user_address.street_address = self.cleaned_data['street_address']
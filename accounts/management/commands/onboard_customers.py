@@ -0,0 +1,202 @@
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from accounts.constants import ACCOUNT_TYPE, CURRENCY, GENDER_TYPE
+from accounts.models import AccountNumberSequence, UserAddress, UserBankAccount
+from core import search, sharding
+from transactions import fx
+
+CSV_FIELDS = (
+    'username', 'first_name', 'last_name', 'email', 'password', 'birth_date',
+    'gender', 'account_type', 'street_address', 'city', 'postal_code', 'country',
+)
+GENDERS = {value for value, _ in GENDER_TYPE}
+ACCOUNT_TYPES = {value for value, _ in ACCOUNT_TYPE}
+
+
+def _setup_worker():
+    # spawned workers start without an app registry
+    django.setup()
+
+
+def _valid_email(email):
+    try:
+        validate_email(email)
+    except ValidationError:
+        return False
+    return True
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Create users, addresses and bank accounts from a CSV file with the columns: '
+        + ', '.join(CSV_FIELDS) + ' and optionally currency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.created = 0
+        self.skipped = 0
+        self.seen_usernames = set()
+        self.currencies = {value for value, _ in fx.currency_choices(CURRENCY)}
+        started = time.perf_counter()
+
+        with open(options['csv_file'], newline='', encoding='utf-8') as csv_file:
+            reader = csv.DictReader(csv_file)
+            missing = set(CSV_FIELDS) - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f"Missing CSV columns: {', '.join(sorted(missing))}")
+
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_setup_worker) as pool:
+                for chunk_index, chunk in enumerate(_chunks(reader, batch_size)):
+                    rows = self.clean_rows(chunk, first_line=2 + chunk_index * batch_size)
+                    if not rows:
+                        continue
+                    passwords = pool.map(
+                        make_password, [row['password'] for row in rows],
+                        chunksize=max(1, len(rows) // (options['workers'] * 4)),
+                    )
+                    self.write_customers(rows, list(passwords))
+
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f'{self.created} customers onboarded ({self.created / elapsed:.0f}/s)'
+                    )
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Onboarded {self.created} customers in {elapsed:.1f}s '
+            f'({self.created / max(elapsed, 1e-9):.0f}/s), skipped {self.skipped}'
+        ))
+
+    def clean_rows(self, chunk, first_line):
+        existing = set(
+            User.objects.filter(username__in=[row['username'] for row in chunk])
+            .values_list('username', flat=True)
+        )
+        rows = []
+        for line, row in enumerate(chunk, start=first_line):
+            username = row['username'].strip()
+            error = None
+            if not username or not row['password']:
+                error = 'username and password are required'
+            elif username in existing or username in self.seen_usernames:
+                error = f'username {username} already exists'
+            elif not _valid_email(row['email']):
+                error = f"invalid email {row['email']}"
+            elif row['gender'] not in GENDERS:
+                error = f"unknown gender {row['gender']}"
+            elif row['account_type'] not in ACCOUNT_TYPES:
+                error = f"unknown account type {row['account_type']}"
+            elif row.get('currency') and row['currency'] not in self.currencies:
+                error = f"unsupported currency {row['currency']}"
+            else:
+                try:
+                    row['birth_date'] = date.fromisoformat(row['birth_date']) if row['birth_date'] else None
+                except ValueError:
+                    error = f"invalid birth date {row['birth_date']}"
+
+            if error:
+                self.skipped += 1
+                self.stderr.write(f'Line {line}: {error}')
+                continue
+            row['username'] = username
+            self.seen_usernames.add(username)
+            rows.append(row)
+        return rows
+
+    def write_customers(self, rows, passwords):
+        account_numbers = AccountNumberSequence.reserve(len(rows))
+        accounts = []
+        try:
+            with transaction.atomic():
+                users = self.create_users(rows, passwords)
+                by_shard = {}
+                for user, row, account_no in zip(users, rows, account_numbers):
+                    by_shard.setdefault(sharding.shard_for_account_no(account_no), []).append(UserBankAccount(
+                        user=user,
+                        account_type=row['account_type'],
+                        currency=row.get('currency') or UserBankAccount._meta.get_field('currency').default,
+                        gender=row['gender'],
+                        birth_date=row['birth_date'],
+                        account_no=account_no,
+                    ))
+                for database, shard_accounts in by_shard.items():
+                    with transaction.atomic(using=database):
+                        accounts.extend(UserBankAccount.objects.using(database).bulk_create(shard_accounts))
+                # bulk_create sends no post_save, record and index the accounts here
+                sharding.record_locations(accounts)
+                search.index_accounts(accounts)
+        except Exception:
+            # the other shards committed before default failed; their
+            # accounts would belong to users that were rolled back
+            self.discard_accounts(accounts)
+            raise
+        self.created += len(users)
+
+    def create_users(self, rows, passwords):
+        users = User.objects.bulk_create([
+            User(
+                username=row['username'],
+                first_name=row['first_name'],
+                last_name=row['last_name'],
+                email=row['email'],
+                password=password,
+            )
+            for row, password in zip(rows, passwords)
+        ])
+        if users and users[0].pk is None:
+            # backends without RETURNING support
+            user_ids = dict(
+                User.objects.filter(username__in=[user.username for user in users])
+                .values_list('username', 'pk')
+            )
+            for user in users:
+                user.pk = user_ids[user.username]
+
+        UserAddress.objects.bulk_create([
+            UserAddress(
+                user=user,
+                street_address=row['street_address'],
+                city=row['city'],
+                postal_code=row['postal_code'],
+                country=row['country'],
+            )
+            for user, row in zip(users, rows)
+        ])
+        return users
+
+    def discard_accounts(self, accounts):
+        by_shard = {}
+        for account in accounts:
+            if account._state.db != DEFAULT_DB_ALIAS:
+                by_shard.setdefault(account._state.db, []).append(account.account_no)
+        for database, account_numbers in by_shard.items():
+            UserBankAccount.objects.using(database).filter(account_no__in=account_numbers).delete()
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountNumberSequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('next_value', models.PositiveBigIntegerField()),
+            ],
+        ),
+    ]
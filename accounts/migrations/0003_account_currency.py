@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_account_number_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='currency',
+            field=models.CharField(choices=[('USD', 'USD'), ('BDT', 'BDT'), ('EUR', 'EUR'), ('GBP', 'GBP'), ('INR', 'INR')], default='USD', max_length=3),
+        ),
+    ]
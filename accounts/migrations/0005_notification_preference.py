@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_unconstrained_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='notifications',
+            field=models.CharField(choices=[('instant', 'An email for every transaction'), ('digest', 'One daily digest email')], default='instant', max_length=10),
+        ),
+    ]
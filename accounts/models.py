@@ -1,16 +1,22 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Max
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
-from .constants import ACCOUNT_TYPE, GENDER_TYPE
+from core.sharding import ledger_databases
+from .constants import ACCOUNT_TYPE, GENDER_TYPE, CURRENCY, NOTIFICATION_PREFERENCE, INSTANT
 
 class UserBankAccount(models.Model):
-    user = models.OneToOneField(User, related_name='account', on_delete=models.CASCADE)
+    # users stay on the default database when accounts are sharded
+    user = models.OneToOneField(User, related_name='account', on_delete=models.CASCADE, db_constraint=False)
     account_type = models.CharField(max_length=10, choices=ACCOUNT_TYPE)
     account_no = models.CharField(max_length=20, unique=True)  # Changed to CharField
     
     gender = models.CharField(max_length=10, choices=GENDER_TYPE)
     initial_deposit_date = models.DateField(auto_now_add=True)  # Fixed typo
     balance = models.DecimalField(default=0, max_digits=12, decimal_places=2)
+    currency = models.CharField(max_length=3, choices=CURRENCY, default='USD')
     birth_date = models.DateField(null=True, blank=True)
+    notifications = models.CharField(max_length=10, choices=NOTIFICATION_PREFERENCE, default=INSTANT)
     def __str__(self):
         return str(self.account_no)
 
@@ -24,3 +30,43 @@ class UserAddress(models.Model):
     
     def __str__(self):
         return str(self.user)
+
+
+
+class AccountNumberSequence(models.Model):
+    """Hands out account numbers in pre-reserved blocks.
+
+    One row per sequence; reserving a block is a single locked increment,
+    so bulk imports can number thousands of accounts with one round trip.
+    """
+    FIRST_ACCOUNT_NO = 100001
+
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.PositiveBigIntegerField()
+
+    def __str__(self):
+        return f'{self.name} ({self.next_value})'
+
+    @classmethod
+    def reserve(cls, count=1, name='account_no'):
+        with transaction.atomic():
+            sequence, created = cls.objects.select_for_update().get_or_create(
+                name=name, defaults={'next_value': cls._first_free_account_no()}
+            )
+            start = sequence.next_value
+            sequence.next_value = start + count
+            sequence.save(update_fields=['next_value'])
+        return range(start, start + count)
+
+    @classmethod
+    def _first_free_account_no(cls):
+        highest = max(
+            (
+                UserBankAccount.objects.using(database).aggregate(
+                    highest=Max(Cast('account_no', models.BigIntegerField()))
+                )['highest'] or 0
+                for database in ledger_databases()
+            ),
+            default=0,
+        )
+        return max(cls.FIRST_ACCOUNT_NO, highest + 1)
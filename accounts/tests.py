@@ -1,3 +1,135 @@
+import csv
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from core.models import AccountLocation
+from mamar_bank.querybudget import QueryBudgetTestCase
+from . import urls
+from .management.commands.onboard_customers import CSV_FIELDS
+from .models import UserBankAccount
+
+PROFILE = {
+    'first_name': 'Rahim', 'last_name': 'Uddin', 'email': 'rahim@example.com',
+    'birth_date': '1990-01-01', 'gender': 'Male', 'account_type': 'savings', 'notifications': 'instant',
+    'street_address': '1 Main Road', 'city': 'Dhaka', 'postal_code': '1200', 'country': 'Bangladesh',
+}
+
+
+class AccountQueryBudgetTests(QueryBudgetTestCase):
+    budgets = {
+        ('register', 'GET'): (0, 0),
+        ('register', 'POST'): (27, 8),
+        ('login', 'GET'): (0, 0),
+        ('login', 'POST'): (9, 2),
+        ('logout', 'POST'): (4, 1),
+        ('profile', 'GET'): (3, 3),
+        ('profile', 'POST'): (16, 10),
+        ('password_change', 'GET'): (2, 2),
+        ('password_change', 'POST'): (14, 3),
+    }
+    admin_budgets = {
+        'accounts.userbankaccount': (5, 24),
+        'accounts.useraddress': (5, 24),
+    }
+
+    def test_every_url_has_a_budget(self):
+        self.assertEveryUrlHasABudget(urls.urlpatterns)
+
+    def test_register(self):
+        self.client.logout()
+        url = reverse('register')
+        self.assertBudget('register', 'GET', url, status=200)
+        self.assertBudget('register', 'POST', url, {
+            **PROFILE, 'username': 'rahim', 'password1': 'budget-pass-2024', 'password2': 'budget-pass-2024',
+            'currency': 'USD',
+        }, status=302)
+
+    def test_login_and_logout(self):
+        self.client.logout()
+        url = reverse('login')
+        self.assertBudget('login', 'GET', url, status=200)
+        self.assertBudget('login', 'POST', url, {
+            'username': self.account.user.username, 'password': 'budget-pass',
+        }, status=302)
+        self.assertBudget('logout', 'POST', reverse('logout'), status=302)
+
+    def test_profile(self):
+        url = reverse('profile')
+        self.assertBudget('profile', 'GET', url, status=200)
+        self.assertBudget('profile', 'POST', url, PROFILE, status=302)
+
+    def test_password_change(self):
+        url = reverse('password_change')
+        self.assertBudget('password_change', 'GET', url, status=200)
+        self.assertBudget('password_change', 'POST', url, {
+            'old_password': 'budget-pass', 'new_password1': 'budget-pass-2025', 'new_password2': 'budget-pass-2025',
+        }, status=302)
+
+    def test_admin_changelists(self):
+        self.assertChangelistBudgets(['accounts'])
+
+
+class OnboardCustomersTests(TestCase):
+    def customer(self, username, **fields):
+        return {
+            'username': username, 'first_name': 'Rahim', 'last_name': 'Uddin', 'email': f'{username}@example.com',
+            'password': 'secret-pass', 'birth_date': '1990-01-01', 'gender': 'Male', 'account_type': 'savings',
+            'street_address': '1 Main Road', 'city': 'Dhaka', 'postal_code': '1200', 'country': 'Bangladesh',
+            **fields,
+        }
+
+    def onboard(self, rows):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'customers.csv'
+        with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.DictWriter(csv_file, CSV_FIELDS + ('currency',))
+            writer.writeheader()
+            writer.writerows(rows)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('onboard_customers', str(path), workers=1, batch_size=2, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_creates_good_rows_and_skips_bad_ones(self):
+        User.objects.create(username='taken')
+        stdout, stderr = self.onboard([
+            self.customer('rahim'),
+            self.customer('karim', currency='USD'),
+            self.customer('taken'),
+            self.customer('rahim'),
+            self.customer('nomail', email='not-an-email'),
+            self.customer('nogender', gender='Other'),
+            self.customer('nodate', birth_date='1990-13-01'),
+            self.customer('nocurrency', currency='XYZ'),
+        ])
+        self.assertIn('Onboarded 2 customers', stdout)
+        self.assertIn('skipped 6', stdout)
+        self.assertEqual(stderr.splitlines(), [
+            'Line 4: username taken already exists',
+            'Line 5: username rahim already exists',
+            'Line 6: invalid email not-an-email',
+            'Line 7: unknown gender Other',
+            'Line 8: invalid birth date 1990-13-01',
+            'Line 9: unsupported currency XYZ',
+        ])
+
+        account = UserBankAccount.objects.select_related('user__address').get(user__username='karim')
+        self.assertEqual((account.currency, account.user.address.city), ('USD', 'Dhaka'))
+        self.assertTrue(account.user.check_password('secret-pass'))
+        self.assertEqual(
+            set(AccountLocation.objects.values_list('user__username', flat=True)), {'rahim', 'karim'},
+        )
 
-# Create your tests here.
+    def test_failed_batch_writes_nothing(self):
+        with mock.patch('core.search.index_accounts', side_effect=RuntimeError('index is down')):
+            with self.assertRaises(RuntimeError):
+                self.onboard([self.customer('rahim')])
+        self.assertFalse(User.objects.filter(username='rahim').exists())
+        self.assertFalse(UserBankAccount.objects.exists())
@@ -1,3 +1,234 @@
 from django.contrib import admin
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Avg, Count, Max
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
+
+from . import profiling, search, sharding
+from .models import AccountLocation, ProfilerSwitch, RequestProfile
 
 # Register your models here.
+
+
+class IndexedSearchMixin:
+    """Answer changelist searches from the search index instead of LIKE scans.
+
+    Set ``search_kind`` to ``search.ACCOUNT`` or ``search.TRANSACTION``;
+    ``search_fields`` is still used on databases without the FTS index.
+    """
+    search_kind = None
+    search_limit = 500
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not search.fts_available():
+            return super().get_search_results(request, queryset, search_term)
+        if self.search_kind == search.ACCOUNT:
+            ids = search.matching_account_ids(search_term, self.search_limit)
+        else:
+            ids = search.matching_transaction_ids(search_term, self.search_limit)
+        return queryset.filter(pk__in=ids), False
+
+
+class LedgerShardFilter(admin.SimpleListFilter):
+    """Pick the ledger shard a changelist reads; ``default`` when none is picked."""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(database, database) for database in sharding.ledger_databases()]
+
+    def choices(self, changelist):
+        # there is no "All": a changelist reads one database
+        selected = self.value() or DEFAULT_DB_ALIAS
+        for database, title in self.lookup_choices:
+            yield {
+                'selected': database == selected,
+                'query_string': changelist.get_query_string({self.parameter_name: database}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        # ShardedAdminMixin.get_queryset has already switched the database
+        return queryset
+
+
+class ShardedAdminMixin:
+    """Admin for a ledger model whose rows may live on any shard.
+
+    The changelist reads the shard picked in its "shard" filter.  Change,
+    delete and history pages find the object on whichever shard has it,
+    and related ledger rows in the form are looked up on that shard too.
+    """
+
+    def selected_shard(self, request):
+        database = request.GET.get(LedgerShardFilter.parameter_name)
+        return database if database in sharding.ledger_databases() else None
+
+    def get_list_filter(self, request):
+        list_filter = list(super().get_list_filter(request))
+        if sharding.is_sharded():
+            list_filter.insert(0, LedgerShardFilter)
+        return list_filter
+
+    def get_list_select_related(self, request):
+        related = super().get_list_select_related(request)
+        if self.selected_shard(request) in (None, DEFAULT_DB_ALIAS) or not isinstance(related, (list, tuple)):
+            return related
+        # users only live on the default database and cannot be joined from a shard
+        return [
+            name for name in related
+            if sharding.is_ledger_model(self.model._meta.get_field(name.split('__')[0]).related_model)
+        ]
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        database = self.selected_shard(request)
+        return queryset.using(database) if database else queryset
+
+    def get_object(self, request, object_id, from_field=None):
+        queryset = self.get_queryset(request)
+        field = queryset.model._meta.pk if from_field is None else queryset.model._meta.get_field(from_field)
+        try:
+            object_id = field.to_python(object_id)
+        except (ValidationError, ValueError):
+            return None
+        for database in sharding.ledger_databases():
+            obj = queryset.using(database).filter(**{field.name: object_id}).first()
+            if obj is not None:
+                request.ledger_database = database
+                return obj
+        return None
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if sharding.is_ledger_model(db_field.related_model) and 'queryset' not in kwargs:
+            database = getattr(request, 'ledger_database', None) or self.selected_shard(request)
+            if database:
+                kwargs['queryset'] = db_field.related_model._default_manager.using(database)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+@admin.register(AccountLocation)
+class AccountLocationAdmin(admin.ModelAdmin):
+    list_display = ['account_no', 'user', 'database']
+    list_filter = ['database']
+    list_select_related = ['user']
+    search_fields = ['account_no']
+
+
+@admin.register(ProfilerSwitch)
+class ProfilerSwitchAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'enabled', 'sample_rate', 'slow_ms', 'updated_at']
+    list_editable = ['enabled', 'sample_rate', 'slow_ms']
+    list_display_links = ['__str__']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # other processes pick the change up within RELOAD_SECONDS
+        profiling.reload_switch()
+
+
+def _functions_table(functions):
+    return format_html(
+        '<table><tr><th>Function</th><th>Own ms</th><th>Total ms</th></tr>{}</table>',
+        format_html_join(
+            '', '<tr><td>{}</td><td>{}</td><td>{}</td></tr>',
+            ((row['function'], row['own_ms'], row['total_ms']) for row in functions),
+        ),
+    )
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ['url_name', 'method', 'path', 'duration_ms', 'reason', 'samples', 'created_at', 'stacks_link']
+    list_filter = ['reason', 'url_name']
+    ordering = ['-duration_ms']
+    exclude = ['top_functions']
+    readonly_fields = [
+        'url_name', 'path', 'method', 'duration_ms', 'reason', 'samples',
+        'stacks_file', 'created_at', 'functions', 'stacks_link',
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+    def delete_model(self, request, obj):
+        profiling.delete_profile(obj)
+
+    def delete_queryset(self, request, queryset):
+        for profile in queryset:
+            profiling.delete_profile(profile)
+
+    @admin.display(description='Top functions')
+    def functions(self, obj):
+        return _functions_table(obj.top_functions)
+
+    @admin.display(description='Stacks')
+    def stacks_link(self, obj):
+        return format_html(
+            '<a href="{}">folded</a>', reverse('admin:core_requestprofile_stacks', args=[obj.pk])
+        )
+
+    def get_urls(self):
+        return [
+            path(
+                'slow-endpoints/',
+                self.admin_site.admin_view(self.slow_endpoints_view),
+                name='core_requestprofile_slow_endpoints',
+            ),
+            path(
+                '<int:pk>/stacks/',
+                self.admin_site.admin_view(self.stacks_view),
+                name='core_requestprofile_stacks',
+            ),
+        ] + super().get_urls()
+
+    def slow_endpoints_view(self, request):
+        """Profiled endpoints, slowest first, with their slowest profile's hot functions."""
+        endpoints = list(
+            RequestProfile.objects.values('url_name')
+            .annotate(profiles=Count('id'), avg_ms=Avg('duration_ms'), max_ms=Max('duration_ms'))
+            .order_by('-max_ms')
+        )
+        slowest = {}
+        for profile in RequestProfile.objects.order_by('url_name', '-duration_ms').only(
+            'url_name', 'duration_ms', 'top_functions'
+        ):
+            slowest.setdefault(profile.url_name, profile)
+        for endpoint in endpoints:
+            profile = slowest[endpoint['url_name']]
+            endpoint['slowest'] = profile
+            endpoint['functions'] = _functions_table(profile.top_functions[:5])
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Slowest endpoints',
+            'endpoints': endpoints,
+            'switch': profiling.get_switch(),
+        }
+        return TemplateResponse(request, 'admin/core/requestprofile/slow_endpoints.html', context)
+
+    def stacks_view(self, request, pk):
+        """The collapsed stacks, for flamegraph.pl or speedscope."""
+        import gzip
+
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        try:
+            with gzip.open(profile.stacks_file, 'rt', encoding='utf-8') as stacks_file:
+                stacks = stacks_file.read()
+        except FileNotFoundError:
+            raise Http404('The stacks of this profile were removed.')
+        response = HttpResponse(stacks, content_type='text/plain; charset=utf-8')
+        if 'download' in request.GET:
+            response['Content-Disposition'] = f'attachment; filename="{profile.url_name}-{profile.pk}.folded"'
+        return response
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {
+            **(extra_context or {}),
+            'slow_endpoints_url': reverse('admin:core_requestprofile_slow_endpoints'),
+        }
+        return super().changelist_view(request, extra_context)
@@ -0,0 +1,302 @@
+"""Idempotency keys for money-moving POSTs.
+
+A client that may retry sends the same ``Idempotency-Key`` header with
+every attempt; forms send an ``idempotency_key`` field rendered once per
+page by ``{% idempotency_field %}``, so a double click or a resubmitted
+page carries the key of the first submission.  The first request with a
+key claims an ``IdempotencyKey`` row on the default database, runs the
+view and stores what it answered.  A retry gets that answer back without
+running the view again, from whichever worker process it lands on: the
+unique ``(user, key)`` constraint lets only one request claim a key.  An
+API retry that arrives while the first is still running gets a 409; a form
+resubmitted by a double click waits up to ``FORM_WAIT_SECONDS`` for the
+first answer and replays it, or is sent to the view's success page with a
+note that the request is still being processed.
+
+Completed keys are kept in a per-process LRU in front of the table, so a
+replay is a dictionary hit or one lookup on the unique index.  Answers
+expire after ``TTL_SECONDS``; ``sweep_idempotency_keys`` deletes expired
+rows and the LRU drops them on read.  A claim only holds the key for
+``LEASE_SECONDS``, so a key whose process died mid-request is usable again
+after the lease rather than the whole TTL.  The lease must outlast the
+workers' request timeout, or a slow request could be run twice.
+
+Only answers worth replaying are stored: redirects, and small JSON bodies
+for APIs.  Anything else, such as a form re-rendered with errors, frees
+the key so the corrected request can run.  A view that raises may already
+have posted, so its key is kept as a 500 and retries get that back.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseRedirect
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'
+MAX_KEY_LENGTH = 64
+MAX_STORED_BODY = 16 * 1024
+POLL_SECONDS = 0.1
+
+DEFAULT_IDEMPOTENCY = {
+    'TTL_SECONDS': 24 * 60 * 60,
+    'LEASE_SECONDS': 120,
+    'FORM_WAIT_SECONDS': 2,
+    'CACHE_SIZE': 10000,
+}
+
+
+def _options():
+    return {**DEFAULT_IDEMPOTENCY, **getattr(settings, 'IDEMPOTENCY', {})}
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    fingerprint: str
+    status_code: int
+    location: str
+    content_type: str
+    body: bytes
+    expires_at: datetime
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            row.fingerprint, row.status_code, row.location, row.content_type, bytes(row.body), row.expires_at
+        )
+
+    def response(self):
+        response = HttpResponse(self.body, status=self.status_code, content_type=self.content_type or None)
+        if self.location:
+            response['Location'] = self.location
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+
+class LRUCache:
+    """Completed responses by ``(user_id, key)``, least recently used out first."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is None:
+                return None
+            if stored.expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return stored
+
+    def put(self, key, stored):
+        with self._lock:
+            self._entries[key] = stored
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LRUCache(_options()['CACHE_SIZE'])
+    return _cache
+
+
+def request_fingerprint(request):
+    """Hash of what the request asks for, so a key cannot be reused for another request."""
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    if request.content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        for name, values in sorted(request.POST.lists()):
+            if name not in ('csrfmiddlewaretoken', FIELD):
+                digest.update(f'{name}={values}\n'.encode())
+    else:
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _lookup(user_id, key, now):
+    stored = get_cache().get((user_id, key), now)
+    if stored is not None:
+        return stored
+    row = IdempotencyKey.objects.filter(user_id=user_id, key=key, expires_at__gt=now).first()
+    if row is None or row.status_code is None:
+        return row
+    stored = StoredResponse.from_row(row)
+    get_cache().put((user_id, key), stored)
+    return stored
+
+
+def _claim(user_id, key, fingerprint, now):
+    """The new in-progress row, or ``None`` when another request holds the key."""
+    expires_at = now + timedelta(seconds=_options()['LEASE_SECONDS'])
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user_id=user_id, key=key, fingerprint=fingerprint, expires_at=expires_at
+                )
+        except IntegrityError:
+            # an expired answer or lease the sweeper has not reached yet does not count
+            if not IdempotencyKey.objects.filter(user_id=user_id, key=key, expires_at__lte=now).delete()[0]:
+                return None
+    return None
+
+
+def _storable(response):
+    if 300 <= response.status_code < 400:
+        return response.get('Location', '')
+    content_type = response.get('Content-Type', '')
+    if (
+        response.status_code < 400 and content_type.startswith('application/json')
+        and not response.streaming and len(response.content) <= MAX_STORED_BODY
+    ):
+        return ''
+    return None
+
+
+def _store(claim, status_code, location='', content_type='', body=b''):
+    claim.status_code = status_code
+    claim.location = location
+    claim.content_type = content_type
+    claim.body = body
+    claim.expires_at = timezone.now() + timedelta(seconds=_options()['TTL_SECONDS'])
+    claim.save(update_fields=['status_code', 'location', 'content_type', 'body', 'expires_at'])
+    get_cache().put((claim.user_id, claim.key), StoredResponse.from_row(claim))
+
+
+def _complete(claim, response):
+    location = _storable(response)
+    if location is None:
+        IdempotencyKey.objects.filter(pk=claim.pk).delete()
+    elif location:
+        _store(claim, response.status_code, location)
+    else:
+        _store(claim, response.status_code, content_type=response['Content-Type'], body=response.content)
+
+
+def _in_progress():
+    response = HttpResponse('A request with this idempotency key is still being processed.', status=409)
+    response['Retry-After'] = '1'
+    return response
+
+
+def _await_answer(user_id, key):
+    """Poll for the answer of the request holding the key, up to ``FORM_WAIT_SECONDS``."""
+    deadline = time.monotonic() + _options()['FORM_WAIT_SECONDS']
+    stored = None
+    while time.monotonic() < deadline:
+        time.sleep(POLL_SECONDS)
+        stored = _lookup(user_id, key, timezone.now())
+        if stored is None or isinstance(stored, StoredResponse):
+            break
+    return stored
+
+
+def _still_processing(request, pending_url):
+    messages.warning(
+        request,
+        'Your request is still being processed. Check your transaction report before trying again.',
+        fail_silently=True,
+    )
+    return HttpResponseRedirect(pending_url or request.path)
+
+
+def _replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        return HttpResponse('This idempotency key was used for a different request.', status=422)
+    if not isinstance(stored, StoredResponse):
+        return _in_progress()
+    return stored.response()
+
+
+def idempotent(view, pending_url=None):
+    """Run a POST view at most once per idempotency key of the logged-in user.
+
+    A resubmitted form that outwaits the first submission is redirected to
+    ``pending_url``, or back to the form.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST' or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        key = request.headers.get(HEADER) or request.POST.get(FIELD)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return HttpResponse(f'Idempotency keys are at most {MAX_KEY_LENGTH} characters.', status=400)
+
+        now = timezone.now()
+        fingerprint = request_fingerprint(request)
+        stored = _lookup(request.user.pk, key, now)
+        if stored is None:
+            claim = _claim(request.user.pk, key, fingerprint, now)
+            if claim is not None:
+                try:
+                    response = view(request, *args, **kwargs)
+                except Exception:
+                    _store(claim, 500, content_type='text/plain', body=b'The original request failed.')
+                    raise
+                _complete(claim, response)
+                return response
+            # another request claimed the key in the meantime
+            stored = _lookup(request.user.pk, key, now)
+        if HEADER in request.headers:
+            return _in_progress() if stored is None else _replay(stored, fingerprint)
+
+        # a double click on a form: wait for the first submission's answer
+        if stored is not None and not isinstance(stored, StoredResponse) and stored.fingerprint == fingerprint:
+            stored = _await_answer(request.user.pk, key)
+            if not isinstance(stored, StoredResponse):
+                return _still_processing(request, pending_url)
+        if stored is None:
+            return _still_processing(request, pending_url)
+        return _replay(stored, fingerprint)
+
+    return wrapper
+
+
+class IdempotentPostMixin:
+    """Make a class-based view's POST ``idempotent``."""
+
+    def dispatch(self, request, *args, **kwargs):
+        return idempotent(super().dispatch, getattr(self, 'success_url', None))(request, *args, **kwargs)
+
+
+def sweep(batch_size=1000, now=None):
+    """Delete expired keys in batches; returns how many went."""
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        expired = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not expired:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=expired).delete()[0]
@@ -0,0 +1,87 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models.signals import post_save
+
+from core import sharding
+
+AMOUNT = Decimal('1.00')
+
+
+# workers are spawned and import this module before Django is set up, so
+# models are only imported inside functions
+
+
+def _setup_worker(with_index):
+    django.setup()
+    if not with_index:
+        from core.signals import index_transaction
+        from transactions.models import Transaction
+
+        post_save.disconnect(index_transaction, sender=Transaction)
+
+
+def _post_pairs(database, account_pk, pairs):
+    from accounts.models import UserBankAccount
+    from transactions.constants import DEPOSIT, WITHDRAWAL
+    from transactions.posting import post_transaction
+
+    account = UserBankAccount.objects.using(database).get(pk=account_pk)
+    started = time.perf_counter()
+    for _ in range(pairs):
+        post_transaction(account, AMOUNT, DEPOSIT)
+        post_transaction(account, AMOUNT, WITHDRAWAL)
+    return time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure posting throughput with one writer process per shard, for 1..N shards. '
+        'Every posting is a deposit/withdrawal pair of 1.00 on an existing account, so balances '
+        'are unchanged but ledger rows are added: run it against scratch data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=500, help='Deposit/withdrawal pairs per writer.')
+        parser.add_argument(
+            '--with-index', action='store_true',
+            help='Keep updating the search index, which is a single writer on the default database.',
+        )
+
+    def handle(self, *args, **options):
+        from accounts.models import UserBankAccount
+
+        shards = sharding.ledger_databases()
+        accounts = []
+        for database in shards:
+            account = UserBankAccount.objects.using(database).order_by('pk').first()
+            if account is None:
+                raise CommandError(f'Shard {database} has no accounts; onboard some customers first.')
+            accounts.append((database, account.pk))
+        connections.close_all()
+
+        baseline = None
+        for count in range(1, len(shards) + 1):
+            with ProcessPoolExecutor(
+                max_workers=count,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_setup_worker,
+                initargs=(options['with_index'],),
+            ) as pool:
+                durations = list(pool.map(
+                    _post_pairs,
+                    [database for database, _ in accounts[:count]],
+                    [pk for _, pk in accounts[:count]],
+                    [options['pairs']] * count,
+                ))
+            throughput = count * options['pairs'] * 2 / max(durations)
+            baseline = baseline or throughput
+            self.stdout.write(
+                f'{count} shard{"s" if count > 1 else ""}: {throughput:,.0f} postings/s '
+                f'({throughput / baseline:.2f}x)'
+            )
@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Cast
+
+from accounts.models import UserBankAccount
+from core import search, sharding
+from core.models import AccountLocation
+from transactions.models import BalanceCheckpoint, LoanInstallment, Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the accounts numbered FIRST to LAST, with their transactions, loan installments and '
+        'balance checkpoints, to another ledger shard. With range sharding, update LEDGER_SHARDING '
+        'RANGES to match so new accounts in the range are placed there too.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('first', type=int)
+        parser.add_argument('last', type=int)
+        parser.add_argument('--to', required=True, dest='target', help='Database alias of the target shard.')
+
+    def handle(self, *args, **options):
+        target = options['target']
+        if target not in sharding.ledger_databases():
+            raise CommandError(f'{target} is not a ledger shard')
+
+        locations = (
+            AccountLocation.objects.exclude(database=target)
+            .annotate(number=Cast('account_no', models.BigIntegerField()))
+            .filter(number__gte=options['first'], number__lte=options['last'])
+            .order_by('number')
+        )
+        moved = 0
+        for location in locations.iterator():
+            self.move_account(location, target)
+            moved += 1
+            if moved % 100 == 0:
+                self.stdout.write(f'{moved} accounts moved')
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} accounts to {target}'))
+
+    def move_account(self, location, target):
+        source = location.database
+        with transaction.atomic(using=source):
+            # a no-op write takes the account's write lock on every backend,
+            # so postings wait for the move and then find the account gone
+            UserBankAccount.objects.using(source).filter(account_no=location.account_no).update(balance=F('balance'))
+            account = UserBankAccount.objects.using(source).get(account_no=location.account_no)
+            transactions = list(Transaction.objects.using(source).filter(account=account).order_by('pk'))
+            installments = list(LoanInstallment.objects.using(source).filter(account=account))
+            checkpoints = list(BalanceCheckpoint.objects.using(source).filter(account=account))
+            source_id = account.pk
+
+            with transaction.atomic(using=target):
+                # a copy left by an interrupted run is replaced, with its rows
+                UserBankAccount.objects.using(target).filter(account_no=account.account_no).delete()
+                self.copy_rows(account, transactions, installments, checkpoints, target)
+
+            AccountLocation.objects.filter(pk=location.pk).update(database=target)
+            Transaction.objects.using(source).filter(target_account_id=source_id).update(target_account=None)
+            # the delete also drops the old ids from the search index
+            UserBankAccount.objects.using(source).filter(pk=source_id).delete()
+
+        search.index_accounts(sharding.select_owner(UserBankAccount.objects.using(target).filter(pk=account.pk)))
+        search.index_transactions(Transaction.objects.using(target).filter(account=account).select_related('account'))
+
+    def copy_rows(self, account, transactions, installments, checkpoints, target):
+        """Insert the rows on ``target`` under new ids from its own id block.
+
+        Keeping the old ids would carry the target's sequence into the
+        source's block, and the next row created there would reuse an id
+        the source still hands out.
+        """
+        source_id = account.pk
+        account.pk = None
+        UserBankAccount.objects.using(target).bulk_create([account])
+
+        old_transaction_ids = []
+        for row in transactions:
+            old_transaction_ids.append(row.pk)
+            row.pk = None
+            row.account_id = account.pk
+            # transfer counterparts stay behind, the link cannot cross shards
+            row.target_account_id = account.pk if row.target_account_id == source_id else None
+        timestamps = [row.timestamp for row in transactions]
+        Transaction.objects.using(target).bulk_create(transactions)
+        # inserts stamp auto_now_add fields with the current time
+        for row, timestamp in zip(transactions, timestamps):
+            row.timestamp = timestamp
+        Transaction.objects.using(target).bulk_update(transactions, ['timestamp'])
+
+        transaction_ids = {old: row.pk for old, row in zip(old_transaction_ids, transactions)}
+        for installment in installments:
+            installment.pk = None
+            installment.account_id = account.pk
+            installment.loan_id = transaction_ids[installment.loan_id]
+        LoanInstallment.objects.using(target).bulk_create(installments)
+
+        for checkpoint in checkpoints:
+            checkpoint.pk = None
+            checkpoint.account_id = account.pk
+        BalanceCheckpoint.objects.using(target).bulk_create(checkpoints)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the customer and transaction search index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not search.fts_available():
+            self.stdout.write('This database is searched through its trigram indexes, nothing to rebuild.')
+            return
+        search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.idempotency import sweep
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency keys whose TTL has passed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Keys deleted per statement.')
+
+    def handle(self, *args, **options):
+        deleted = sweep(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{deleted} expired idempotency keys deleted'))
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+TRIGRAM_INDEXES = [
+    ('accounts_userbankaccount', 'account_no'),
+    ('accounts_useraddress', 'city'),
+    ('auth_user', 'first_name'),
+    ('auth_user', 'last_name'),
+    ('auth_user', 'email'),
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS core_search_index USING fts5("
+            "account_no, owner, email, city, amount, day, "
+            "tokenize = 'unicode61', prefix = '2 3 4')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, column in TRIGRAM_INDEXES:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {table}_{column}_trgm ON {table} USING gin ({column} gin_trgm_ops)'
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS core_search_index')
+    elif vendor == 'postgresql':
+        for table, column in TRIGRAM_INDEXES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{column}_trgm')
+
+
+def populate_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "INSERT INTO core_search_index (rowid, account_no, owner, email, city, amount, day) "
+        "SELECT a.id * 2, a.account_no, u.first_name || ' ' || u.last_name || ' ' || u.username, "
+        "u.email, COALESCE(ad.city, ''), '', '' "
+        "FROM accounts_userbankaccount a JOIN auth_user u ON u.id = a.user_id "
+        "LEFT JOIN accounts_useraddress ad ON ad.user_id = u.id"
+    )
+    schema_editor.execute(
+        "INSERT INTO core_search_index (rowid, account_no, owner, email, city, amount, day) "
+        "SELECT t.id * 2 + 1, a.account_no, '', '', '', printf('%.2f', t.amount), date(t.timestamp) "
+        "FROM transactions_transaction t JOIN accounts_userbankaccount a ON a.id = t.account_id",
+        None,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('accounts', '0002_account_number_sequence'),
+        ('transactions', '0004_loan_installment'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
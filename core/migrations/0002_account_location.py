@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_existing_accounts(apps, schema_editor):
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+    AccountLocation = apps.get_model('core', 'AccountLocation')
+    database = schema_editor.connection.alias
+    AccountLocation.objects.using(database).bulk_create(
+        AccountLocation(user_id=user_id, account_no=account_no, database=database)
+        for user_id, account_no in UserBankAccount.objects.using(database).values_list('user_id', 'account_no')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_unconstrained_user'),
+        ('core', '0001_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_no', models.CharField(max_length=20, unique=True)),
+                ('database', models.CharField(max_length=50)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='account_location', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(record_existing_accounts, migrations.RunPython.noop),
+    ]
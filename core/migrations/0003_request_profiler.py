@@ -0,0 +1,44 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_account_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfilerSwitch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enabled', models.BooleanField(default=False)),
+                ('sample_rate', models.FloatField(default=0.01, help_text='Share of requests to profile, 0 to 1.')),
+                ('slow_ms', models.PositiveIntegerField(default=500, help_text='Profile the next request to any path slower than this.')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'profiler switch',
+            },
+        ),
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_name', models.CharField(max_length=100)),
+                ('path', models.CharField(max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('duration_ms', models.FloatField()),
+                ('reason', models.CharField(max_length=10)),
+                ('samples', models.PositiveIntegerField()),
+                ('top_functions', models.JSONField(default=list)),
+                ('stacks_file', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['url_name', '-duration_ms'], name='profile_url_duration_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,81 @@
+from django.contrib.auth.models import User
 from django.db import models
 
-# Create your models here.
+
+class AccountLocation(models.Model):
+    """Which ledger database a bank account lives on.
+
+    Kept on the default database next to the users, so an account can be
+    found from its owner or its number with one indexed lookup, wherever
+    the shard map would place it today.
+    """
+    user = models.OneToOneField(User, related_name='account_location', on_delete=models.CASCADE)
+    account_no = models.CharField(max_length=20, unique=True)
+    database = models.CharField(max_length=50)
+
+    def __str__(self):
+        return f'{self.account_no} on {self.database}'
+
+
+class ProfilerSwitch(models.Model):
+    """Runtime switch for the sampling request profiler.
+
+    A single row edited from the admin; every process re-reads it at most
+    every ``REQUEST_PROFILING['RELOAD_SECONDS']``.
+    """
+    enabled = models.BooleanField(default=False)
+    sample_rate = models.FloatField(default=0.01, help_text='Share of requests to profile, 0 to 1.')
+    slow_ms = models.PositiveIntegerField(
+        default=500, help_text='Profile the next request to any path slower than this.'
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'profiler switch'
+
+    def __str__(self):
+        return 'Request profiler ' + ('on' if self.enabled else 'off')
+
+
+class RequestProfile(models.Model):
+    url_name = models.CharField(max_length=100)
+    path = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    duration_ms = models.FloatField()
+    reason = models.CharField(max_length=10)
+    samples = models.PositiveIntegerField()
+    top_functions = models.JSONField(default=list)
+    stacks_file = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['url_name', '-duration_ms'], name='profile_url_duration_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.url_name} {self.duration_ms:.0f} ms'
+
+
+class IdempotencyKey(models.Model):
+    """The outcome of a POST sent with an idempotency key.
+
+    ``status_code`` stays empty while the first request is running.
+    """
+    user = models.ForeignKey(User, related_name='idempotency_keys', on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    location = models.CharField(max_length=255, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    body = models.BinaryField(blank=True, default=b'')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}:{self.key} ({self.status_code or "in progress"})'
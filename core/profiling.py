@@ -0,0 +1,254 @@
+"""Sampling profiler for slow requests.
+
+``SamplingProfilerMiddleware`` does nothing but a cached flag check until
+the ``ProfilerSwitch`` row is enabled from the admin.  Then it profiles a
+random ``sample_rate`` share of requests, plus the next request to any
+path that took longer than ``slow_ms``.  A profiled request is watched by
+a ``StackSampler`` thread that records the request thread's Python stack
+every ``SAMPLE_INTERVAL_MS``; the stacks are written gzipped in collapsed
+("folded") format, ready for flamegraph.pl or speedscope, and the hottest
+functions are kept on a ``RequestProfile`` row keyed by URL name.
+"""
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_SLOW_PATHS = 1000
+DEFAULT_PROFILING = {
+    'SAMPLE_INTERVAL_MS': 1,
+    'RELOAD_SECONDS': 10,
+    'TOP_FUNCTIONS': 20,
+    'KEEP_PER_URL': 50,
+    'DIRECTORY': None,
+}
+
+
+def _options():
+    return {**DEFAULT_PROFILING, **getattr(settings, 'REQUEST_PROFILING', {})}
+
+
+def profile_directory():
+    return _options()['DIRECTORY'] or settings.BASE_DIR / 'profiles'
+
+
+class StackSampler:
+    """Record one thread's stack every ``interval`` seconds."""
+
+    def __init__(self, interval, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit):
+        """Hottest functions by own and by inclusive time."""
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for function in set(frames):
+                inclusive[function] += count
+        interval_ms = self.interval * 1000
+        return [
+            {
+                'function': function,
+                'own_ms': round(own[function] * interval_ms, 1),
+                'total_ms': round(inclusive[function] * interval_ms, 1),
+            }
+            for function, _ in own.most_common(limit)
+        ]
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class _Switch:
+    enabled = False
+    sample_rate = 0.0
+    slow_ms = 0
+    loaded_at = float('-inf')
+
+
+_switch = _Switch()
+_slow_paths = set()
+
+
+def _switch_is_fresh():
+    return time.monotonic() - _switch.loaded_at < _options()['RELOAD_SECONDS']
+
+
+def get_switch():
+    """The ``ProfilerSwitch`` settings, re-read every ``RELOAD_SECONDS``."""
+    global _switch
+    if _switch_is_fresh():
+        return _switch
+    from .models import ProfilerSwitch
+
+    switch = _Switch()
+    row = ProfilerSwitch.objects.order_by('pk').first()
+    if row is not None:
+        switch.enabled, switch.sample_rate, switch.slow_ms = row.enabled, row.sample_rate, row.slow_ms
+    switch.loaded_at = time.monotonic()
+    _switch = switch
+    return switch
+
+
+def reload_switch():
+    _switch.loaded_at = float('-inf')
+
+
+def save_profile(request, duration_ms, reason, sampler):
+    # imported here so workers that never profile skip them
+    import gzip
+    from datetime import datetime
+
+    from .models import RequestProfile
+
+    options = _options()
+    match = request.resolver_match
+    url_name = (match.view_name if match else None) or 'unresolved'
+    directory = profile_directory() / url_name.replace(':', '-')
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{datetime.now():%Y%m%d-%H%M%S-%f}.folded.gz"
+    with gzip.open(path, 'wt', encoding='utf-8') as stacks_file:
+        stacks_file.write(sampler.folded())
+
+    RequestProfile.objects.create(
+        url_name=url_name,
+        path=request.path[:255],
+        method=request.method,
+        duration_ms=duration_ms,
+        reason=reason,
+        samples=sum(sampler.stacks.values()),
+        top_functions=sampler.top_functions(options['TOP_FUNCTIONS']),
+        stacks_file=str(path),
+    )
+    stale = RequestProfile.objects.filter(url_name=url_name).order_by('-created_at')[options['KEEP_PER_URL']:]
+    for profile in stale:
+        delete_profile(profile)
+
+
+def delete_profile(profile):
+    import os
+
+    try:
+        os.remove(profile.stacks_file)
+    except FileNotFoundError:
+        pass
+    profile.delete()
+
+
+def _reason(path, switch):
+    """Why this request is profiled, or ``None`` when it is only timed."""
+    if path in _slow_paths:
+        _slow_paths.discard(path)
+        return 'slow'
+    if random.random() < switch.sample_rate:
+        return 'sampled'
+    return None
+
+
+def _timed(path, started, switch):
+    if (time.perf_counter() - started) * 1000 > switch.slow_ms and len(_slow_paths) < MAX_SLOW_PATHS:
+        _slow_paths.add(path)
+
+
+def _save(request, duration_ms, reason, sampler):
+    try:
+        save_profile(request, duration_ms, reason, sampler)
+    except Exception:
+        # a profile is never worth failing the request
+        logger.exception('Could not save the profile of %s', request.path)
+
+
+class SamplingProfilerMiddleware:
+    """Profile requests under WSGI and ASGI alike.
+
+    Under ASGI the sampler watches the event loop thread, so a sync view
+    run in asgiref's thread shows up as the wait for that thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        switch = get_switch()
+        if not switch.enabled:
+            return self.get_response(request)
+
+        reason = _reason(request.path, switch)
+        started = time.perf_counter()
+        if reason is None:
+            response = self.get_response(request)
+            _timed(request.path, started, switch)
+            return response
+
+        sampler = StackSampler(_options()['SAMPLE_INTERVAL_MS'] / 1000).start()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            sampler.stop()
+        _save(request, duration_ms, reason, sampler)
+        return response
+
+    async def __acall__(self, request):
+        switch = _switch if _switch_is_fresh() else await sync_to_async(get_switch)()
+        if not switch.enabled:
+            return await self.get_response(request)
+
+        reason = _reason(request.path, switch)
+        started = time.perf_counter()
+        if reason is None:
+            response = await self.get_response(request)
+            _timed(request.path, started, switch)
+            return response
+
+        sampler = StackSampler(_options()['SAMPLE_INTERVAL_MS'] / 1000).start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            sampler.stop()
+        await sync_to_async(_save)(request, duration_ms, reason, sampler)
+        return response
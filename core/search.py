@@ -0,0 +1,189 @@
+"""Indexed search over customers and transactions for support staff.
+
+On SQLite the index is an FTS5 table, ``core_search_index``, holding one
+row per account (number, owner, email, city) and one per transaction
+(account number, amount, date).  Every term is matched as a prefix, so
+``1000`` finds account ``100042``.  Rows are keyed by rowid
+(``object_id * 2 + kind``) so signal-driven updates touch a single row.
+
+Other databases fall back to ORM lookups, which the search migration backs
+with trigram GIN indexes on PostgreSQL.
+
+The index lives on the default database and covers every ledger shard;
+ids are unique across shards, so matches are fetched from each of them.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+
+from accounts.models import UserBankAccount
+from transactions.models import Transaction
+from . import sharding
+
+SEARCH_TABLE = 'core_search_index'
+ACCOUNT = 0
+TRANSACTION = 1
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def _rowid(kind, object_id):
+    return object_id * 2 + kind
+
+
+def _account_row(account):
+    user = account.user
+    address = getattr(user, 'address', None)
+    return (
+        _rowid(ACCOUNT, account.pk),
+        account.account_no,
+        f'{user.first_name} {user.last_name} {user.username}',
+        user.email,
+        address.city if address else '',
+        '',
+        '',
+    )
+
+
+def _transaction_row(transaction, account_no):
+    return (
+        _rowid(TRANSACTION, transaction.pk),
+        account_no,
+        '',
+        '',
+        '',
+        f'{transaction.amount:.2f}',
+        transaction.timestamp.date().isoformat() if transaction.timestamp else '',
+    )
+
+
+def _write(rows):
+    if not rows or not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {SEARCH_TABLE} '
+            '(rowid, account_no, owner, email, city, amount, day) VALUES (%s, %s, %s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+def index_accounts(accounts):
+    _write([_account_row(account) for account in accounts])
+
+
+def index_transactions(transactions):
+    account_numbers = {}
+    for transaction in transactions:
+        if transaction.account_id not in account_numbers:
+            account_numbers[transaction.account_id] = transaction.account.account_no
+    _write([_transaction_row(t, account_numbers[t.account_id]) for t in transactions])
+
+
+def remove(kind, object_id):
+    if fts_available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [_rowid(kind, object_id)])
+
+
+def rebuild(batch_size=5000):
+    """Re-index every account and transaction."""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+
+    for database in sharding.ledger_databases():
+        accounts = sharding.select_owner(UserBankAccount.objects.using(database).order_by('pk'))
+        batch = []
+        for account in accounts.iterator(chunk_size=batch_size):
+            batch.append(_account_row(account))
+            if len(batch) >= batch_size:
+                _write(batch)
+                batch = []
+        _write(batch)
+
+        account_numbers = dict(UserBankAccount.objects.using(database).values_list('pk', 'account_no'))
+        batch = []
+        for transaction in Transaction.objects.using(database).order_by('pk').iterator(chunk_size=batch_size):
+            batch.append(_transaction_row(transaction, account_numbers[transaction.account_id]))
+            if len(batch) >= batch_size:
+                _write(batch)
+                batch = []
+        _write(batch)
+
+
+def build_match(text):
+    """Turn free text into an FTS5 query: every term must match as a prefix."""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _matching_ids(text, kind, limit):
+    match = build_match(text)
+    if not match:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND rowid %% 2 = %s '
+            'ORDER BY rank LIMIT %s',
+            [match, kind, limit],
+        )
+        return [rowid // 2 for (rowid,) in cursor.fetchall()]
+
+
+def matching_account_ids(text, limit=200):
+    return _matching_ids(text, ACCOUNT, limit) if fts_available() else None
+
+
+def matching_transaction_ids(text, limit=200):
+    return _matching_ids(text, TRANSACTION, limit) if fts_available() else None
+
+
+def search_accounts(text, limit=50):
+    ids = matching_account_ids(text, limit)
+    if ids is None:
+        text = text.strip()
+        # owners live on the default database, match them there first
+        owners = User.objects.filter(
+            Q(first_name__icontains=text)
+            | Q(last_name__icontains=text)
+            | Q(email__icontains=text)
+            | Q(address__city__icontains=text)
+        ).values_list('pk', flat=True)[:limit]
+        query = Q(account_no__startswith=text) | Q(user_id__in=list(owners))
+    else:
+        query = Q(pk__in=ids)
+
+    results = []
+    for database in sharding.ledger_databases():
+        accounts = sharding.select_owner(UserBankAccount.objects.using(database))
+        results.extend(accounts.filter(query)[:limit - len(results)])
+        if len(results) >= limit:
+            break
+    return results
+
+
+def search_transactions(text, limit=50):
+    ids = matching_transaction_ids(text, limit)
+    if ids is None:
+        text = text.strip()
+        query = Q(account__account_no__startswith=text)
+        try:
+            query |= Q(amount=Decimal(text))
+        except InvalidOperation:
+            pass
+    else:
+        query = Q(pk__in=ids)
+
+    results = []
+    for database in sharding.ledger_databases():
+        transactions = Transaction.objects.using(database).select_related('account').order_by('-timestamp')
+        results.extend(transactions.filter(query)[:limit])
+    results.sort(key=lambda transaction: transaction.timestamp, reverse=True)
+    return results[:limit]
+
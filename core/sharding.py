@@ -0,0 +1,190 @@
+"""Account-sharded ledger storage.
+
+Bank accounts, their transactions, loan installments and balance
+checkpoints (the ledger) can be spread over the database aliases in
+``LEDGER_SHARDING['SHARDS']``.  New accounts are placed by account number,
+hashed or looked up in ``RANGES``;
+``AccountLocation`` on the default database records where each account
+actually is, so accounts moved by ``rebalance_shards`` are still found.
+Users, addresses and everything else stay on ``default``.
+
+All ledger rows of one account share a shard, so postings stay local
+transactions; transfers between shards use the two-phase protocol in
+``transactions.posting``.  Every shard hands out primary keys from its own
+block of ``ID_RANGE`` ids, which keeps ids unique across shards; rows
+moved by ``rebalance_shards`` get new ids from the target's block.
+
+With a single shard the router steps aside and every query goes to
+``default`` as before.
+"""
+import hashlib
+from bisect import bisect_right
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+LEDGER_MODELS = {
+    ('accounts', 'userbankaccount'),
+    ('transactions', 'transaction'),
+    ('transactions', 'loaninstallment'),
+    ('transactions', 'balancecheckpoint'),
+}
+ID_RANGE = 10 ** 12
+
+DEFAULT_SHARDING = {
+    'SHARDS': [DEFAULT_DB_ALIAS],
+    'STRATEGY': 'hash',
+    'RANGES': [],
+}
+
+
+def _options():
+    return {**DEFAULT_SHARDING, **getattr(settings, 'LEDGER_SHARDING', {})}
+
+
+def ledger_databases():
+    return list(_options()['SHARDS'])
+
+
+def is_sharded():
+    return len(_options()['SHARDS']) > 1
+
+
+def is_ledger_model(model):
+    return (model._meta.app_label, model._meta.model_name) in LEDGER_MODELS
+
+
+def shard_for_account_no(account_no):
+    """The shard a new account with this number is placed on."""
+    options = _options()
+    shards = options['SHARDS']
+    if len(shards) == 1:
+        return shards[0]
+    if options['STRATEGY'] == 'range':
+        # RANGES is [(first_account_no, alias), ...] in ascending order
+        ranges = options['RANGES']
+        index = bisect_right([int(first) for first, _ in ranges], int(account_no)) - 1
+        return ranges[max(index, 0)][1]
+    digest = hashlib.blake2b(str(account_no).encode(), digest_size=8).digest()
+    return shards[int.from_bytes(digest, 'big') % len(shards)]
+
+
+def database_for_account_no(account_no):
+    """The shard the existing account ``account_no`` lives on."""
+    if not is_sharded():
+        return ledger_databases()[0]
+    from .models import AccountLocation
+
+    database = (
+        AccountLocation.objects.filter(account_no=account_no)
+        .values_list('database', flat=True).first()
+    )
+    return database or shard_for_account_no(account_no)
+
+
+def database_for_user(user_id):
+    if not is_sharded():
+        return ledger_databases()[0]
+    from .models import AccountLocation
+
+    database = (
+        AccountLocation.objects.filter(user_id=user_id)
+        .values_list('database', flat=True).first()
+    )
+    return database or DEFAULT_DB_ALIAS
+
+
+def record_locations(accounts):
+    """Add ``AccountLocation`` rows for freshly inserted accounts."""
+    from .models import AccountLocation
+
+    AccountLocation.objects.bulk_create([
+        AccountLocation(user_id=account.user_id, account_no=account.account_no, database=account._state.db)
+        for account in accounts
+    ])
+
+
+def select_owner(accounts):
+    """Fetch the owners of an account queryset along with it.
+
+    Users only exist on the default database, so other shards load them
+    with a second query instead of a join.
+    """
+    if accounts.db == DEFAULT_DB_ALIAS:
+        return accounts.select_related('user', 'user__address')
+    return accounts.prefetch_related('user', 'user__address')
+
+
+def id_floor(database):
+    return ledger_databases().index(database) * ID_RANGE
+
+
+def reserve_id_range(using):
+    """Make the ledger tables on ``using`` number rows from its id block."""
+    if using not in ledger_databases() or not id_floor(using):
+        return
+    from django.apps import apps
+
+    floor = id_floor(using)
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for app_label, model_name in sorted(LEDGER_MODELS):
+            table = apps.get_model(app_label, model_name)._meta.db_table
+            cursor.execute(f'SELECT MAX(id) FROM {connection.ops.quote_name(table)}')
+            if (cursor.fetchone()[0] or 0) >= floor:
+                continue
+            if connection.vendor == 'sqlite':
+                cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s', [table])
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, floor])
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)", [table, floor])
+            elif connection.vendor == 'mysql':
+                cursor.execute(f'ALTER TABLE {connection.ops.quote_name(table)} AUTO_INCREMENT = {floor + 1}')
+
+
+class LedgerRouter:
+    """Send ledger queries to the shard of the account they belong to.
+
+    Queries without an instance hint (``Model.objects...``) go to
+    ``default``; code that reads another shard says so with ``.using()``.
+    Related lookups and saves follow the instance they start from, and
+    ``user.account`` is resolved through ``AccountLocation``.
+    """
+
+    def db_for_read(self, model, instance=None, **hints):
+        if not is_sharded():
+            return None
+        if not is_ledger_model(model):
+            return DEFAULT_DB_ALIAS
+        if instance is not None and instance._meta.label == settings.AUTH_USER_MODEL:
+            # user.account
+            return database_for_user(instance.pk)
+        return self._ledger_database(instance)
+
+    def db_for_write(self, model, instance=None, **hints):
+        if not is_sharded():
+            return None
+        if not is_ledger_model(model):
+            return DEFAULT_DB_ALIAS
+        return self._ledger_database(instance)
+
+    def _ledger_database(self, instance):
+        if instance is None or not is_ledger_model(type(instance)):
+            return None
+        if instance._meta.model_name == 'userbankaccount' and instance._state.adding and instance.account_no:
+            # a new account goes where the shard map puts its number
+            return shard_for_account_no(instance.account_no)
+        return instance._state.db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not is_sharded():
+            return None
+        if is_ledger_model(type(obj1)) and is_ledger_model(type(obj2)):
+            return obj1._state.db == obj2._state.db
+        # accounts point at users on the default database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in ledger_databases():
+            return None
+        return (app_label, model_name) in LEDGER_MODELS
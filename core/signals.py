@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from accounts.models import UserAddress, UserBankAccount
+from transactions.models import Transaction
+from . import search, sharding
+from .models import AccountLocation
+
+OWNER_FIELDS = {'first_name', 'last_name', 'username', 'email', 'city'}
+
+
+@receiver(post_save, sender=UserBankAccount)
+def index_account(sender, instance, raw=False, update_fields=None, **kwargs):
+    # balance postings save with update_fields=['balance'], which is not indexed
+    if raw or (update_fields and 'account_no' not in update_fields):
+        return
+    search.index_accounts([instance])
+
+
+@receiver(post_save, sender=UserBankAccount)
+def record_account_location(sender, instance, created, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    if created and not raw:
+        AccountLocation.objects.update_or_create(
+            user_id=instance.user_id, defaults={'account_no': instance.account_no, 'database': using}
+        )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserAddress)
+def reindex_owner_accounts(sender, instance, raw=False, update_fields=None, **kwargs):
+    # logins only touch last_login, which is not indexed
+    if raw or (update_fields and not OWNER_FIELDS & set(update_fields)):
+        return
+    user = instance if sender is User else instance.user
+    accounts = UserBankAccount.objects.using(sharding.database_for_user(user.pk)).filter(user=user)
+    search.index_accounts(sharding.select_owner(accounts))
+
+
+@receiver(post_save, sender=Transaction)
+def index_transaction(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_transactions([instance])
+
+
+@receiver(post_delete, sender=UserBankAccount)
+def unindex_account(sender, instance, **kwargs):
+    search.remove(search.ACCOUNT, instance.pk)
+
+
+@receiver(post_delete, sender=Transaction)
+def unindex_transaction(sender, instance, **kwargs):
+    search.remove(search.TRANSACTION, instance.pk)
+
+
+@receiver(post_migrate)
+def reserve_ledger_id_range(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.label == 'transactions':
+        sharding.reserve_id_range(using)
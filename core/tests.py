@@ -1,3 +1,441 @@
-from django.test import TestCase
+import gzip
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from core import profiling, search, sharding
+from core.assets import css_build_options, purge_css
+from core.models import AccountLocation, ProfilerSwitch, RequestProfile
+from mamar_bank.importtime import FORBIDDEN_MODULES, MODULE_BUDGETS, WORKER_SETTINGS, measure
+from mamar_bank.querybudget import QueryBudgetTestCase
+from accounts.management.commands.onboard_customers import Command as OnboardCustomersCommand
+from accounts.models import UserAddress, UserBankAccount
+from transactions.constants import ABORTED, COMMITTED, DEPOSIT, LOAN, PENDING, PREPARED
+from transactions.models import BalanceCheckpoint, LoanInstallment, ShardTransfer, Transaction
+from transactions.posting import begin_transfer, post_transfer, prepare_transfer
+
+
+class WorkerColdStartTests(SimpleTestCase):
+    # wall-clock time depends on the machine, so only what startup loads and does is checked
+    def assertWithinBudget(self, entry_point):
+        result = measure(entry_point, WORKER_SETTINGS, runs=1)
+        self.assertLessEqual(
+            result['module_count'], MODULE_BUDGETS[entry_point],
+            f"{entry_point} imports {result['module_count']} modules; slowest imports: {result['slowest'][:5]}",
+        )
+        self.assertEqual(result['connections'], 0, f'{entry_point} opens the database at startup')
+        for name in FORBIDDEN_MODULES:
+            self.assertNotIn(name, result['modules'], f'{entry_point} imports {name} at startup')
+
+    def test_wsgi_cold_start(self):
+        self.assertWithinBudget('mamar_bank.wsgi')
+
+    def test_asgi_cold_start(self):
+        self.assertWithinBudget('mamar_bank.asgi')
+
+    def test_worker_requires_secret_key(self):
+        env = {name: value for name, value in os.environ.items() if name != 'SECRET_KEY'}
+        completed = subprocess.run(
+            [sys.executable, '-c', 'import mamar_bank.wsgi'], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**env, 'DJANGO_SETTINGS_MODULE': WORKER_SETTINGS, 'ALLOWED_HOSTS': 'localhost'},
+        )
+        self.assertNotEqual(completed.returncode, 0)
+        self.assertIn('ImproperlyConfigured: Set the SECRET_KEY environment variable', completed.stderr)
+
+
+class CoreQueryBudgetTests(QueryBudgetTestCase):
+    budgets = {
+        ('home', 'GET'): (2, 2),
+        ('staff_search', 'GET'): (5, 42),
+    }
+    admin_budgets = {
+        'auth.user': (6, 25),
+        'auth.group': (5, 4),
+        'core.accountlocation': (6, 25),
+        'core.profilerswitch': (5, 4),
+        'core.requestprofile': (7, 4),
+    }
+
+    def test_home(self):
+        self.assertBudget('home', 'GET', reverse('home'), status=200)
+
+    def test_staff_search(self):
+        self.client.force_login(self.staff)
+        self.assertBudget('staff_search', 'GET', reverse('staff_search') + '?q=Dhaka', status=200)
+
+    def test_admin_changelists(self):
+        self.assertChangelistBudgets(['auth', 'core'])
+
+
+class StaticAssetTests(SimpleTestCase):
+    # requests pass the profiler middleware, which reads its switch row
+    databases = {'default'}
+
+    def test_purge_keeps_only_used_classes(self):
+        css = (
+            '/*! tailwindcss */body{margin:0}.flex{display:flex}.grid{display:grid}'
+            '.hover\\:bg-white:hover{color:#fff}.animate-spin{animation:spin 1s linear infinite}'
+            '@media (min-width:640px){.sm\\:w-2\\/3{width:66%}.sm\\:block{display:block}}'
+            '@keyframes spin{to{transform:rotate(360deg)}}@keyframes ping{75%{opacity:0}}'
+        )
+        purged = purge_css(css, {'flex', 'hover:bg-white', 'sm:w-2/3'})
+        self.assertEqual(
+            purged,
+            '/*! tailwindcss */body{margin:0}.flex{display:flex}.hover\\:bg-white:hover{color:#fff}'
+            '@media (min-width:640px){.sm\\:w-2\\/3{width:66%}}\n',
+        )
+
+    def test_serves_precompressed_fingerprinted_files(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(STATIC_ROOT=root):
+            css = Path(root) / 'css' / 'app.0123456789ab.css'
+            css.parent.mkdir()
+            css.write_text('.flex{display:flex}')
+            Path(f'{css}.gz').write_bytes(gzip.compress(b'.flex{display:flex}'))
+
+            response = self.client.get('/static/css/app.0123456789ab.css', HTTP_ACCEPT_ENCODING='gzip, deflate')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Content-Type'], 'text/css')
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'.flex{display:flex}')
+
+            response = self.client.get('/static/css/app.0123456789ab.css')
+            self.assertNotIn('Content-Encoding', response)
+            self.assertEqual(self.client.get('/static/css/missing.css').status_code, 404)
+
+    # class names no Tailwind build has, and dark mode variants the site does not enable
+    UNSTYLED = {
+        'breadcrumbs', 'footer', 'text-blue', 'text-md', 'text-s', 'hover:text-dark', 'border-white-400',
+        'dark:border-neutral-500', 'dark:focus:ring-pink-800',
+    }
+
+    def template_classes(self):
+        classes = set()
+        for app in css_build_options()['CONTENT']:
+            for root, _, files in os.walk(settings.BASE_DIR / app):
+                for name in files:
+                    path = os.path.join(root, name)
+                    if name.endswith('.html'):
+                        with open(path, encoding='utf-8') as template:
+                            for value in re.findall(r'class\s*=\s*"([^"]*)"', template.read()):
+                                classes.update(re.sub(r'{%.*?%}|{{.*?}}', ' ', value).split())
+                    elif name.endswith('.py') and 'tests' not in name:
+                        with open(path, encoding='utf-8') as module:
+                            for value in re.findall(r"'class'\s*:\s*\(?((?:\s*'[^']*')+)", module.read()):
+                                classes.update(' '.join(re.findall(r"'([^']*)'", value)).split())
+        return classes
+
+    def test_app_css_defines_every_template_class(self):
+        css = css_build_options()['OUTPUT'].read_text(encoding='utf-8')
+        defined = {re.sub(r'\\(.)', r'\1', name) for name in re.findall(r'\.((?:\\.|[\w-])+)', css)}
+        missing = self.template_classes() - defined - self.UNSTYLED
+        self.assertFalse(missing, f'app.css lacks {sorted(missing)}; run build_css')
+
+
+class ProfilerTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(REQUEST_PROFILING={'DIRECTORY': self.directory, 'KEEP_PER_URL': 2})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        profiling.reload_switch()
+        profiling._slow_paths.clear()
+        self.addCleanup(profiling.reload_switch)
+
+    def switch(self, **fields):
+        ProfilerSwitch.objects.create(**fields)
+        profiling.reload_switch()
+
+    def test_switched_off_by_default(self):
+        self.client.get(reverse('home'))
+        self.assertFalse(profiling.get_switch().enabled)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_switch_is_reread_only_after_reload(self):
+        self.assertFalse(profiling.get_switch().enabled)
+        ProfilerSwitch.objects.create(enabled=True)
+        self.assertFalse(profiling.get_switch().enabled)
+        profiling.reload_switch()
+        self.assertTrue(profiling.get_switch().enabled)
+
+    def test_sampled_request_stores_its_stacks(self):
+        self.switch(enabled=True, sample_rate=1)
+        self.client.get(reverse('home'))
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.url_name, profile.method, profile.reason), ('home', 'GET', 'sampled'))
+        self.assertEqual(Path(profile.stacks_file).parent, self.directory / 'home')
+        with gzip.open(profile.stacks_file, 'rt') as stacks:
+            folded = stacks.read()
+        self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in folded.splitlines()), profile.samples)
+
+    def test_slow_path_is_profiled_on_its_next_request(self):
+        self.switch(enabled=True, sample_rate=0, slow_ms=0)
+        self.client.get(reverse('home'))
+        self.assertFalse(RequestProfile.objects.exists())
+        self.client.get(reverse('home'))
+        self.assertEqual(RequestProfile.objects.get().reason, 'slow')
+
+    def test_keeps_the_latest_profiles_per_url(self):
+        self.switch(enabled=True, sample_rate=1)
+        for _ in range(3):
+            self.client.get(reverse('home'))
+        profiles = RequestProfile.objects.all()
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(
+            sorted(str(path) for path in (self.directory / 'home').iterdir()),
+            sorted(profile.stacks_file for profile in profiles),
+        )
+
+    def test_sampler_records_the_watched_thread(self):
+        sampler = profiling.StackSampler(0.001).start()
+        deadline = profiling.time.perf_counter() + 0.05
+        while profiling.time.perf_counter() < deadline:
+            pass
+        stacks = sampler.stop()
+        self.assertTrue(stacks)
+        self.assertTrue(all('test_sampler_records_the_watched_thread' in stack for stack in stacks))
+        self.assertEqual(sampler.top_functions(1)[0]['function'], 'core.tests:test_sampler_records_the_watched_thread')
+
+    def test_async_requests_are_profiled(self):
+        self.switch(enabled=True, sample_rate=1)
+
+        async def view(request):
+            return HttpResponse('ok')
+
+        middleware = profiling.SamplingProfilerMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/async/'))
+        self.assertEqual(response.content, b'ok')
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.url_name, profile.path, profile.reason), ('unresolved', '/async/', 'sampled'))
+
+
+class SearchIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ayesha = cls.create_account(201001, 'Ayesha', 'Rahman', 'Dhaka')
+        cls.karim = cls.create_account(201002, 'Karim', 'Uddin', 'Chittagong')
+        cls.deposit = Transaction.objects.create(
+            account=cls.karim, amount=Decimal('1234.50'), balance_after_transaction=Decimal('1234.50'),
+            transaction_type=DEPOSIT,
+        )
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+
+    @staticmethod
+    def create_account(account_no, first_name, last_name, city):
+        user = User.objects.create(
+            username=f'customer{account_no}', email=f'{first_name.lower()}@example.com',
+            first_name=first_name, last_name=last_name,
+        )
+        UserAddress.objects.create(user=user, street_address='1 Road', city=city, postal_code='1000', country='BD')
+        return UserBankAccount.objects.create(
+            user=user, account_no=str(account_no), account_type='savings', gender='Male',
+            birth_date=date(1990, 1, 1),
+        )
+
+    def account_numbers(self, text):
+        return [account.account_no for account in search.search_accounts(text)]
+
+    def test_terms_match_as_prefixes_of_any_field(self):
+        self.assertEqual(sorted(self.account_numbers('20100')), ['201001', '201002'])
+        self.assertEqual(self.account_numbers('ayes'), ['201001'])
+        self.assertEqual(self.account_numbers('chitta'), ['201002'])
+        self.assertEqual(self.account_numbers('karim@example'), ['201002'])
+        # every term has to match
+        self.assertEqual(self.account_numbers('karim dhaka'), [])
+
+    def test_transactions_match_amount_date_and_account(self):
+        day = self.deposit.timestamp.date().isoformat()
+        for text in ('1234.5', day, '201002'):
+            self.assertEqual(search.search_transactions(text), [self.deposit], text)
+        self.assertEqual(search.search_transactions('201001'), [])
+
+    def test_closer_matches_rank_first(self):
+        rahman = self.create_account(201003, 'Rahman', 'Rahman', 'Rajshahi')
+        self.assertEqual(search.matching_account_ids('rahman'), [rahman.pk, self.ayesha.pk])
+
+    def test_updates_reindex_the_account(self):
+        user = self.ayesha.user
+        user.last_name = 'Chowdhury'
+        user.save()
+        user.address.city = 'Sylhet'
+        user.address.save()
+        self.assertEqual(self.account_numbers('rahman'), [])
+        self.assertEqual(self.account_numbers('dhaka'), [])
+        self.assertEqual(self.account_numbers('chowdhury sylhet'), ['201001'])
+
+        self.deposit.delete()
+        self.assertEqual(search.search_transactions('1234.5'), [])
+
+    def test_rebuild_restores_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.SEARCH_TABLE}')
+        self.assertEqual(self.account_numbers('ayesha'), [])
+        search.rebuild()
+        self.assertEqual(self.account_numbers('ayesha'), ['201001'])
+        self.assertEqual(search.search_transactions('1234.5'), [self.deposit])
+
+    def test_staff_see_results(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('staff_search'), {'q': 'Dhaka'})
+        self.assertEqual(response.context['accounts'], [self.ayesha])
+        self.assertContains(response, 'ayesha@example.com')
+
+        self.client.force_login(self.ayesha.user)
+        self.assertEqual(self.client.get(reverse('staff_search'), {'q': 'Dhaka'}).status_code, 403)
+
+
+HAS_LEDGER_SHARD = 'ledger_1' in settings.DATABASES
+
+
+@skipUnless(HAS_LEDGER_SHARD, 'run with --settings=mamar_bank.settings.sharded')
+@override_settings(LEDGER_SHARDING={
+    'SHARDS': ['default', 'ledger_1'], 'STRATEGY': 'range', 'RANGES': [('1', 'default'), ('300000', 'ledger_1')],
+})
+class ShardedLedgerTests(TestCase):
+    # the test runner sets up every alias named here, even for a skipped class
+    databases = {'default', 'ledger_1'} if HAS_LEDGER_SHARD else {'default'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.local = cls.create_account(200001, balance=1000)
+        cls.remote = cls.create_account(300001, balance=1000)
+        cls.staff = User.objects.create(username='staff', is_staff=True, is_superuser=True)
+
+    @staticmethod
+    def create_account(account_no, balance=0):
+        user = User.objects.create(username=f'customer{account_no}', email=f'customer{account_no}@example.com')
+        return UserBankAccount.objects.using(sharding.shard_for_account_no(account_no)).create(
+            user=user, account_no=str(account_no), account_type='savings', gender='Male',
+            birth_date=date(1990, 1, 1), balance=Decimal(balance),
+        )
+
+    def balances(self):
+        return (
+            UserBankAccount.objects.using('default').get(pk=self.local.pk).balance,
+            UserBankAccount.objects.using('ledger_1').get(pk=self.remote.pk).balance,
+        )
+
+    def test_accounts_are_placed_by_number(self):
+        self.assertEqual((self.local._state.db, self.remote._state.db), ('default', 'ledger_1'))
+        self.assertGreaterEqual(self.remote.pk, sharding.ID_RANGE)
+        self.assertEqual(
+            dict(AccountLocation.objects.values_list('account_no', 'database')),
+            {'200001': 'default', '300001': 'ledger_1'},
+        )
+        self.assertEqual(sharding.database_for_account_no('300001'), 'ledger_1')
+        # user.account is routed to the shard the location names
+        self.assertEqual(User.objects.get(pk=self.remote.user_id).account.pk, self.remote.pk)
+
+    def test_transfer_across_shards_commits_both_legs(self):
+        debit, credit = post_transfer(self.local, self.remote, Decimal(100))
+        self.assertEqual(self.balances(), (Decimal(900), Decimal(1100)))
+        self.assertEqual((debit._state.db, credit._state.db), ('default', 'ledger_1'))
+        self.assertEqual((debit.amount, credit.amount), (Decimal(-100), Decimal(100)))
+        transfer = ShardTransfer.objects.get()
+        self.assertEqual(transfer.status, COMMITTED)
+        self.assertEqual(debit.transfer_reference, transfer.reference)
+        self.assertEqual(credit.transfer_reference, transfer.reference)
+
+    def test_recovery_finishes_or_aborts_interrupted_transfers(self):
+        # died before the debit, after the debit, and after marking it prepared
+        not_debited = begin_transfer(self.local, self.remote, Decimal(10))
+        debited = begin_transfer(self.local, self.remote, Decimal(20))
+        prepare_transfer(debited)
+        prepared = begin_transfer(self.local, self.remote, Decimal(30))
+        prepare_transfer(prepared)
+        ShardTransfer.objects.filter(pk=prepared.pk).update(status=PREPARED)
+        self.assertEqual(self.balances(), (Decimal(950), Decimal(1000)))
+
+        for _ in range(2):
+            call_command('recover_transfers', older_than=0, stdout=StringIO())
+        statuses = dict(ShardTransfer.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[not_debited.pk], statuses[debited.pk], statuses[prepared.pk]], [ABORTED, COMMITTED, COMMITTED]
+        )
+        # each credit is posted once however often recovery runs
+        self.assertEqual(self.balances(), (Decimal(950), Decimal(1050)))
+        self.assertEqual(Transaction.objects.using('ledger_1').filter(account_id=self.remote.pk).count(), 2)
+        self.assertFalse(ShardTransfer.objects.filter(status=PENDING).exists())
+
+    def test_staff_approve_loans_on_every_shard(self):
+        loan = Transaction.objects.using('ledger_1').create(
+            account=self.remote, amount=Decimal(1200), transaction_type=LOAN, balance_after_transaction=1000,
+        )
+        self.client.force_login(self.staff)
+        changelist = self.client.get(reverse('admin:transactions_transaction_changelist'), {'shard': 'ledger_1'})
+        self.assertEqual(list(changelist.context['cl'].result_list), [loan])
+
+        url = reverse('admin:transactions_transaction_change', args=[loan.pk])
+        form = self.client.get(url).context['adminform'].form
+        data = {name: value for name, value in form.initial.items() if value is not None}
+        response = self.client.post(url, {**data, 'loan_approve': 'on'})
+        self.assertEqual(response.status_code, 302)
+
+        self.assertTrue(Transaction.objects.using('ledger_1').get(pk=loan.pk).loan_approve)
+        self.assertEqual(UserBankAccount.objects.using('ledger_1').get(pk=self.remote.pk).balance, Decimal(2200))
+        self.assertTrue(LoanInstallment.objects.using('ledger_1').filter(loan_id=loan.pk).exists())
+        self.assertFalse(Transaction.objects.filter(pk=loan.pk).exists())
+
+    def test_moved_accounts_get_ids_from_the_target_block(self):
+        loan = Transaction.objects.using('ledger_1').create(
+            account=self.remote, amount=Decimal(1200), transaction_type=LOAN, balance_after_transaction=1000,
+        )
+        taken_at = datetime(2024, 1, 2, tzinfo=dt_timezone.utc)
+        Transaction.objects.using('ledger_1').filter(pk=loan.pk).update(timestamp=taken_at)
+        LoanInstallment.objects.using('ledger_1').create(
+            loan=loan, account=self.remote, number=1, due_date=date(2024, 2, 2),
+            principal=Decimal(1200), interest=0, amount_due=Decimal(1200),
+        )
+        BalanceCheckpoint.objects.using('ledger_1').create(
+            account=self.remote, as_of=datetime(2024, 1, 3, tzinfo=dt_timezone.utc), balance=Decimal(1000),
+        )
+
+        call_command('rebalance_shards', 300001, 300001, '--to=default', stdout=StringIO())
+        self.assertFalse(UserBankAccount.objects.using('ledger_1').exists())
+        self.assertEqual(AccountLocation.objects.get(account_no='300001').database, 'default')
+        moved = UserBankAccount.objects.using('default').get(account_no='300001')
+        moved_loan = Transaction.objects.using('default').get(account=moved)
+        self.assertEqual(moved_loan.timestamp, taken_at)
+        self.assertEqual(LoanInstallment.objects.using('default').get(account=moved).loan, moved_loan)
+        self.assertEqual(BalanceCheckpoint.objects.using('default').get(account=moved).balance, Decimal(1000))
+
+        created = [moved, moved_loan, self.create_account(200002), Transaction.objects.using('default').create(
+            account=self.local, amount=Decimal(1), transaction_type=LOAN, balance_after_transaction=1000,
+        )]
+        for row in created:
+            self.assertLess(row.pk, sharding.id_floor('ledger_1'), row)
+
+    def test_failed_onboarding_leaves_no_shard_accounts(self):
+        command = OnboardCustomersCommand(stdout=StringIO(), stderr=StringIO())
+        command.created = 0
+        row = {
+            'username': 'rahim', 'first_name': 'Rahim', 'last_name': 'Uddin', 'email': 'rahim@example.com',
+            'birth_date': date(1990, 1, 1), 'gender': 'Male', 'account_type': 'savings',
+            'street_address': '1 Main Road', 'city': 'Dhaka', 'postal_code': '1200', 'country': 'Bangladesh',
+        }
+        with mock.patch('core.sharding.shard_for_account_no', return_value='ledger_1'), \
+                mock.patch('core.search.index_accounts', side_effect=RuntimeError('index is down')):
+            with self.assertRaises(RuntimeError):
+                command.write_customers([row], ['!'])
+        self.assertFalse(User.objects.filter(username='rahim').exists())
+        self.assertEqual(list(UserBankAccount.objects.using('ledger_1').all()), [self.remote])
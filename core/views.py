@@ -1,5 +1,7 @@
 from django.shortcuts import render
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import TemplateView
+from . import search
 # Create your views here.
 
 
@@ -8,4 +10,21 @@ from django.views.generic import TemplateView
 
 
 class Homeview(TemplateView):
-    template_name = 'index.html'
\ No newline at end of file
+    template_name = 'index.html'
+
+
+class StaffSearchView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    template_name = 'search.html'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get('q', '').strip()
+        context.update({
+            'query': query,
+            'accounts': search.search_accounts(query) if query else [],
+            'transactions': search.search_transactions(query) if query else [],
+        })
+        return context
@@ -0,0 +1,121 @@
+"""
+Cold-start benchmark for the WSGI and ASGI entry points.
+
+Every measurement runs in a fresh interpreter with ``python -X importtime``
+so results match what an autoscaled worker pays on boot:
+
+    python -m mamar_bank.importtime
+    python -m mamar_bank.importtime --settings mamar_bank.settings.development --runs 10
+
+``core.tests`` enforces ``MODULE_BUDGETS`` and ``FORBIDDEN_MODULES`` and
+checks that startup opens no database connection; ``BUDGETS_MS`` depends on
+the machine and is only reported here.  The worker profile requires
+``SECRET_KEY`` and ``ALLOWED_HOSTS``; placeholders are used when unset,
+since nothing is served.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+ENTRY_POINTS = ('mamar_bank.wsgi', 'mamar_bank.asgi')
+WORKER_SETTINGS = 'mamar_bank.settings.worker'
+
+# Median wall-clock time to import the entry point and build the application.
+BUDGETS_MS = {
+    'mamar_bank.wsgi': 1000,
+    'mamar_bank.asgi': 1000,
+}
+
+# Modules imported by the entry point, including Python's own.
+MODULE_BUDGETS = {
+    'mamar_bank.wsgi': 650,
+    'mamar_bank.asgi': 650,
+}
+
+# Modules the worker profile must not load at startup.
+FORBIDDEN_MODULES = ('environ', 'numpy', 'smtplib')
+
+
+def parse_importtime(stderr):
+    """Return ``{module: (self_us, cumulative_us)}`` from ``-X importtime`` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure(entry_point, settings_module=WORKER_SETTINGS, runs=3):
+    """Import ``entry_point`` ``runs`` times in fresh interpreters."""
+    env = {
+        'SECRET_KEY': 'importtime', 'ALLOWED_HOSTS': 'localhost',
+        **os.environ, 'DJANGO_SETTINGS_MODULE': settings_module,
+    }
+    # printed after the import, so it is not part of the timing that matters
+    code = (
+        f'import {entry_point}\n'
+        'from django.db import connections\n'
+        'print(sum(c.connection is not None for c in connections.all(initialized_only=True)))'
+    )
+    wall_ms = []
+    modules = {}
+    for _ in range(runs):
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        wall_ms.append((time.perf_counter() - started) * 1000)
+        modules = parse_importtime(completed.stderr)
+
+    slowest = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)
+    return {
+        'entry_point': entry_point,
+        'settings': settings_module,
+        'wall_ms': statistics.median(wall_ms),
+        'import_ms': sum(self_us for self_us, _ in modules.values()) / 1000,
+        'module_count': len(modules),
+        'modules': set(modules),
+        'connections': int(completed.stdout),
+        'slowest': [(name, cumulative / 1000) for name, (_, cumulative) in slowest[:15]],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--settings', default=WORKER_SETTINGS)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    over_budget = False
+    for entry_point in ENTRY_POINTS:
+        result = measure(entry_point, args.settings, args.runs)
+        budget = BUDGETS_MS[entry_point]
+        print(
+            f"{entry_point}: {result['wall_ms']:.0f} ms cold start (budget {budget} ms), "
+            f"{result['import_ms']:.0f} ms in imports across {result['module_count']} modules "
+            f"(budget {MODULE_BUDGETS[entry_point]}), {result['connections']} database connections"
+        )
+        for name, cumulative_ms in result['slowest']:
+            print(f'    {cumulative_ms:8.1f} ms  {name}')
+        loaded = [name for name in FORBIDDEN_MODULES if name in result['modules']]
+        if loaded:
+            print(f"    forbidden modules loaded: {', '.join(loaded)}")
+        over_budget |= (
+            result['wall_ms'] > budget or result['module_count'] > MODULE_BUDGETS[entry_point]
+            or result['connections'] > 0 or bool(loaded)
+        )
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
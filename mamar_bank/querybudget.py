@@ -0,0 +1,222 @@
+"""
+SQL query budgets for views.
+
+``QueryBudgetMixin.assertQueryBudget`` fails a test when the code under it
+runs more queries, or reads more rows, than its budget allows, and the
+failure lists every query with the rows it returned so the N+1 is easy to
+spot:
+
+    with self.assertQueryBudget(queries=6, rows=40):
+        self.client.get(reverse('transaction_report'))
+
+Rows are counted by re-running each SELECT as ``SELECT COUNT(*)`` once the
+block is done, so they are the rows the query returned at the end of the
+block.  ``seed_bank`` fills the database with enough customers and
+transactions that a query per row shows up as a blown budget, and
+``QueryBudgetTestCase`` runs the app test suites against it.
+"""
+
+import time
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TestCase
+from django.urls import reverse
+
+
+class QueryBudget:
+    """Record the queries run on one database while the block is active."""
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.queries = []
+
+    def __enter__(self):
+        self._wrapper = connections[self.using].execute_wrapper(self._record)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+        if exc_info[0] is None:
+            self._count_rows()
+
+    def _record(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': params,
+                'many': many,
+                'ms': (time.perf_counter() - started) * 1000,
+                'rows': 0,
+            })
+
+    def _count_rows(self):
+        connection = connections[self.using]
+        with connection.cursor() as cursor:
+            for query in self.queries:
+                sql = query['sql']
+                if query['many'] or not sql.lstrip().upper().startswith('SELECT') or ' FOR UPDATE' in sql:
+                    continue
+                cursor.execute(f'SELECT COUNT(*) FROM ({sql}) budget_rows', query['params'])
+                query['rows'] = cursor.fetchone()[0]
+
+    @property
+    def rows(self):
+        return sum(query['rows'] for query in self.queries)
+
+    def report(self):
+        lines = [f'{len(self.queries)} queries, {self.rows} rows on {self.using}:']
+        for number, query in enumerate(self.queries, start=1):
+            lines.append(f"{number:>3}. [{query['rows']} rows, {query['ms']:.1f} ms] {query['sql']}")
+            if query['params']:
+                lines.append(f"     params: {query['params']}")
+        return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """``TestCase`` mixin adding ``assertQueryBudget``."""
+
+    @contextmanager
+    def assertQueryBudget(self, queries, rows=None, using=DEFAULT_DB_ALIAS):
+        with QueryBudget(using) as budget:
+            yield budget
+        over = len(budget.queries) > queries or (rows is not None and budget.rows > rows)
+        if over:
+            self.fail(
+                f'Query budget of {queries} queries'
+                + (f' and {rows} rows' if rows is not None else '')
+                + ' exceeded.\n' + budget.report()
+            )
+
+
+def seed_bank(customers=20, transactions_per_account=25, loans_per_account=2, password='budget-pass'):
+    """Create customers with addresses, ledgers, transfers and loan schedules.
+
+    Returns the bank accounts; every customer's password is ``password``.
+    """
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+
+    from accounts.models import AccountNumberSequence, UserAddress, UserBankAccount
+    from transactions.constants import DEPOSIT, LOAN, TRANSFER, WITHDRAWAL
+    from transactions.loans import create_schedule
+    from transactions.models import ExchangeRate, Transaction
+
+    ExchangeRate.objects.get_or_create(currency='EUR', defaults={'rate': Decimal('1.08')})
+    password = make_password(password)
+    accounts = []
+    for number, account_no in enumerate(AccountNumberSequence.reserve(customers)):
+        user = User.objects.create(
+            username=f'customer{account_no}', first_name='Customer', last_name=str(number),
+            email=f'customer{account_no}@example.com', password=password,
+        )
+        UserAddress.objects.create(
+            user=user, street_address=f'{number} Main Road', city='Dhaka', postal_code=1200 + number,
+            country='Bangladesh',
+        )
+        accounts.append(UserBankAccount.objects.create(
+            user=user, account_no=account_no, account_type='savings', gender='Male',
+            birth_date=date(1990, 1, 1), currency='EUR' if number % 4 == 0 else 'USD',
+        ))
+
+    ledger = []
+    for index, account in enumerate(accounts):
+        balance = Decimal(0)
+        target = accounts[(index + 1) % len(accounts)]
+        for number in range(transactions_per_account):
+            if number % 5 == 4:
+                transaction_type, amount = TRANSFER, Decimal(-50)
+            elif number % 3 == 2:
+                transaction_type, amount = WITHDRAWAL, Decimal(100)
+            else:
+                transaction_type, amount = DEPOSIT, Decimal(500)
+            balance += -amount if transaction_type == WITHDRAWAL else amount
+            ledger.append(Transaction(
+                account=account, amount=amount, transaction_type=transaction_type,
+                balance_after_transaction=balance,
+                target_account=target if transaction_type == TRANSFER else None,
+            ))
+        account.balance = balance
+    Transaction.objects.bulk_create(ledger)
+    UserBankAccount.objects.bulk_update(accounts, ['balance'])
+
+    for account in accounts:
+        for number in range(loans_per_account):
+            loan = Transaction.objects.create(
+                account=account, amount=Decimal(1200), transaction_type=LOAN,
+                balance_after_transaction=account.balance, loan_approve=number == 0,
+            )
+            if loan.loan_approve:
+                create_schedule(loan)
+    return accounts
+
+
+def warm_caches():
+    """Load the per-process caches so budgets do not depend on test order."""
+    from core import profiling
+    from transactions import fx
+
+    fx.refresh()
+    profiling.reload_switch()
+    profiling.get_switch()
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    """Budgets for a customer of a seeded bank.
+
+    ``budgets`` maps ``(url name, method)`` to ``(queries, rows)`` and
+    ``admin_budgets`` maps model labels to the budget of their changelist.
+    Every budget includes the request overhead: the session and the user
+    with their account.
+    """
+    budgets = {}
+    admin_budgets = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.models import User
+
+        cls.accounts = seed_bank()
+        cls.account = cls.accounts[1]
+        cls.staff = User.objects.create(username='staff', is_staff=True, is_superuser=True)
+
+    def setUp(self):
+        warm_caches()
+        self.client.force_login(self.account.user)
+
+    def assertBudget(self, name, method, url, data=None, status=None):
+        queries, rows = self.budgets[(name, method)]
+        with self.assertQueryBudget(queries, rows):
+            response = self.client.post(url, data) if method == 'POST' else self.client.get(url)
+        if status is not None:
+            self.assertEqual(response.status_code, status, f'{method} {url}')
+        return response
+
+    def assertEveryUrlHasABudget(self, urlpatterns):
+        self.assertEqual(
+            {pattern.name for pattern in urlpatterns}, {name for name, _ in self.budgets},
+            'every URL needs a query budget',
+        )
+
+    def assertChangelistBudgets(self, app_labels):
+        """Check the changelist budget of every admin model of ``app_labels``."""
+        from django.contrib import admin
+
+        models = [model for model in admin.site._registry if model._meta.app_label in app_labels]
+        self.assertEqual(
+            {model._meta.label_lower for model in models}, set(self.admin_budgets),
+            'every admin changelist needs a query budget',
+        )
+        self.client.force_login(self.staff)
+        for model in models:
+            queries, rows = self.admin_budgets[model._meta.label_lower]
+            url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+            with self.subTest(model._meta.label), self.assertQueryBudget(queries, rows):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
@@ -0,0 +1,8 @@
+"""
+Settings profiles for mamar_bank.
+
+``base`` holds everything shared; ``development`` and ``worker`` extend it,
+``sharded`` extends ``development`` with the ledger split over SQLite files.
+This package is intentionally empty so importing a profile does not pull in
+the others.
+"""
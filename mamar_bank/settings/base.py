@@ -0,0 +1,243 @@
+"""
+Settings shared by every mamar_bank profile.
+
+Pick a profile with DJANGO_SETTINGS_MODULE: ``mamar_bank.settings.development``
+for local work and ``mamar_bank.settings.worker`` for production WSGI/ASGI
+workers.
+
+Generated by 'django-admin startproject' using Django 5.0.6.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.0/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/5.0/ref/settings/
+"""
+
+from pathlib import Path
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
+SECRET_KEY = 'django-insecure-nkw9r2x)t#c*tfd-gp7l3whb5(gw3u437qup@l%8okux%v2mel'
+# SECURITY WARNING: keep the secret key used in production secret!
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = True
+
+ALLOWED_HOSTS = ['127.0.0.1']
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'core',
+    'accounts',
+    'transactions',
+    'django.contrib.humanize',
+]
+
+MIDDLEWARE = [
+    'core.profiling.SamplingProfilerMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+ROOT_URLCONF = 'mamar_bank.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.debug',
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'mamar_bank.wsgi.application'
+
+
+# Database
+# https://docs.djangoproject.com/en/5.0/ref/settings/#databases
+
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    }
+}
+
+DATABASE_ROUTERS = ['core.sharding.LedgerRouter']
+
+
+# Email. The SMTP backend only opens a connection when a message is sent;
+# credentials come from the active profile.
+
+EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_HOST = 'smtp.gmail.com'
+EMAIL_USE_TLS = True
+EMAIL_PORT = 587
+
+
+# Loads request.user with its bank account in one query
+AUTHENTICATION_BACKENDS = ['accounts.backends.AccountModelBackend']
+
+# Password validation
+# https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/5.0/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/5.0/howto/static-files/
+
+STATIC_URL = 'static/'
+
+STATICFILES_DIRS = [
+    BASE_DIR / 'static',
+]
+
+# collectstatic writes content-hashed copies of every file here, plus .gz
+# and .br variants that Django serves with far-future cache headers
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'core.assets.PrecompressedManifestStaticFilesStorage',
+    },
+}
+
+# `manage.py build_css` purges SOURCE down to the classes used under CONTENT
+CSS_BUILD = {
+    'SOURCE': 'https://unpkg.com/tailwindcss@1.9.6/dist/tailwind.min.css',
+    'CONTENT': ['core', 'accounts', 'transactions'],
+    'EXTRA': [BASE_DIR / 'assets' / 'tailwind-extra.css'],
+    'OUTPUT': BASE_DIR / 'static' / 'css' / 'app.css',
+}
+
+# Bank-wide analytics dashboard
+ANALYTICS_SNAPSHOT_PATH = BASE_DIR / 'analytics_snapshot.npz'
+ANALYTICS_CACHE_TTL = 300
+# schedule analytics_snapshot more often; older snapshots are flagged as stale
+ANALYTICS_SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+# Group-commit posting queue for deposits and withdrawals (opt-in)
+POSTING_QUEUE = {
+    'ENABLED': False,
+    'MAX_BATCH_SIZE': 100,
+    'MAX_WAIT_MS': 5,
+    'TIMEOUT': 10,
+}
+
+# Loan amortization
+LOAN_ANNUAL_INTEREST_RATE = 0.12
+LOAN_TERM_MONTHS = 12
+
+# Multi-currency accounts: ExchangeRate rows are units of BASE_CURRENCY per
+# unit of the currency, reloaded into each process at most this often
+BASE_CURRENCY = 'USD'
+FX_SNAPSHOT_TTL = 60
+
+# Ledger shards (database aliases). New accounts are placed by a hash of the
+# account number, or with STRATEGY 'range' by RANGES: [(first_account_no, alias), ...]
+LEDGER_SHARDING = {
+    'SHARDS': ['default'],
+    'STRATEGY': 'hash',
+    'RANGES': [],
+}
+
+# Sampling request profiler, switched on and tuned at runtime from the
+# admin (Core > Profiler switch); stacks are stored under DIRECTORY
+REQUEST_PROFILING = {
+    'SAMPLE_INTERVAL_MS': 1,
+    'RELOAD_SECONDS': 10,
+    'TOP_FUNCTIONS': 20,
+    'KEEP_PER_URL': 50,
+    'DIRECTORY': BASE_DIR / 'profiles',
+}
+
+# Live balance feed (server-sent events, served under ASGI). The in-process
+# broker only reaches streams of the process that posted; with several
+# worker processes use 'transactions.live.RedisBroker' with OPTIONS {'url': ...}
+LIVE_FEED = {
+    'BACKEND': 'transactions.live.InProcessBroker',
+    'OPTIONS': {'max_queued': 100},
+    'HEARTBEAT_SECONDS': 15,
+}
+
+# write_balance_checkpoints stores a balance every EVERY ledger rows of an
+# account and at each midnight, leaving the last SETTLE_SECONDS alone so
+# postings still in flight are not skipped
+BALANCE_CHECKPOINTS = {
+    'EVERY': 500,
+    'SETTLE_SECONDS': 300,
+}
+
+# deposit, withdraw and transfer POSTs with an Idempotency-Key header or
+# form field answer retries with the stored result for TTL_SECONDS;
+# sweep_idempotency_keys deletes expired keys
+IDEMPOTENCY = {
+    'TTL_SECONDS': 24 * 60 * 60,
+    # longer than the workers' request timeout
+    'LEASE_SECONDS': 120,
+    'FORM_WAIT_SECONDS': 2,
+    'CACHE_SIZE': 10000,
+}
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+
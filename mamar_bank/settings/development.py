@@ -0,0 +1,26 @@
+"""
+Local development profile: debug on, credentials read from ``.env``.
+"""
+
+import environ
+
+from .base import *  # noqa: F401,F403
+
+env = environ.Env()
+environ.Env.read_env()
+
+# SECRET_KEY = env("SECRET_KEY")
+
+# DATABASES = {
+#     'default': {
+#         'ENGINE': 'django.db.backends.postgresql_psycopg2',
+#         'NAME': env("DB_NAME"),
+#         'USER': env("DB_USER"),
+#         'PASSWORD': env("DB_PASSWORD"),
+#         'HOST': env("DB_HOST"),
+#         'PORT': env("DB_PORT"),
+#     }
+# }
+
+EMAIL_HOST_USER = env("USER_EMAIL")
+EMAIL_HOST_PASSWORD = env("USER_PASSWORD")
@@ -0,0 +1,35 @@
+"""
+Development profile with the ledger spread over several SQLite files.
+
+``default`` keeps users and is the first shard; ``LEDGER_SHARDS`` (default
+4) sets the total.  Migrate every alias once:
+
+    python manage.py migrate --settings=mamar_bank.settings.sharded
+    python manage.py migrate --database=ledger_1 --settings=mamar_bank.settings.sharded
+
+The multi-database tests need the extra aliases and run under this profile:
+
+    python manage.py test core.tests.ShardedLedgerTests --settings=mamar_bank.settings.sharded
+"""
+
+from .development import *  # noqa: F401,F403
+from .development import env
+
+SHARD_COUNT = env.int('LEDGER_SHARDS', default=4)
+
+DATABASES = {
+    **DATABASES,  # noqa: F405
+    **{
+        f'ledger_{index}': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / f'db_ledger_{index}.sqlite3',  # noqa: F405
+        }
+        for index in range(1, SHARD_COUNT)
+    },
+}
+
+LEDGER_SHARDING = {
+    'SHARDS': ['default', *(f'ledger_{index}' for index in range(1, SHARD_COUNT))],
+    'STRATEGY': 'hash',
+    'RANGES': [],
+}
@@ -0,0 +1,48 @@
+"""
+Minimal production profile for WSGI/ASGI workers.
+
+Workers are autoscaled, so this profile keeps startup cheap: configuration
+comes straight from ``os.environ`` (no ``environ`` import or ``.env``
+parsing) and the debug context processor is dropped.  ``SECRET_KEY`` and
+``ALLOWED_HOSTS`` have no fallback: a worker without them refuses to start.
+Email stays lazy: the SMTP backend is only imported and connected when a
+message is actually sent.
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .base import *  # noqa: F401,F403
+from .base import TEMPLATES
+
+
+def required_env(name):
+    value = os.environ.get(name)
+    if not value:
+        raise ImproperlyConfigured(f'Set the {name} environment variable for the worker profile.')
+    return value
+
+
+DEBUG = False
+
+SECRET_KEY = required_env('SECRET_KEY')
+
+ALLOWED_HOSTS = required_env('ALLOWED_HOSTS').split(',')
+
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        'OPTIONS': {
+            **TEMPLATES[0]['OPTIONS'],
+            'context_processors': [
+                processor for processor in TEMPLATES[0]['OPTIONS']['context_processors']
+                if processor != 'django.template.context_processors.debug'
+            ],
+        },
+    },
+]
+
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', EMAIL_BACKEND)  # noqa: F405
+EMAIL_HOST_USER = os.environ.get('USER_EMAIL', '')
+EMAIL_HOST_PASSWORD = os.environ.get('USER_PASSWORD', '')
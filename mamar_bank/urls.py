@@ -14,12 +14,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
-from core.views import Homeview
+from django.urls import path, include, re_path
+from core.assets import serve_static
+from core.views import Homeview, StaffSearchView
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('account_s/', include('accounts.urls')),
     path('', Homeview.as_view(), name='home'),
-    path('transaction/', include('transactions.urls'))
+    path('search/', StaffSearchView.as_view(), name='staff_search'),
+    path('transaction/', include('transactions.urls')),
+    # Registered in every profile on purpose: workers serve the collected,
+    # fingerprinted and precompressed files themselves (unlike
+    # django.views.static, which is only fit for DEBUG), with paths confined
+    # to STATIC_ROOT.  A CDN or web server in front may take these over.
+    re_path(rf'^{settings.STATIC_URL.lstrip("/")}(?P<path>.*)$', serve_static, name='static'),
 ]
@@ -0,0 +1,63 @@
+// Live balance: the navbar balance and an open transaction report follow
+// postings pushed by the balance_feed server-sent events endpoint.
+(function () {
+    if (!window.EventSource) {
+        return;
+    }
+    var script = document.currentScript;
+    var feed = new EventSource(script.getAttribute('data-url'));
+
+    function money(value) {
+        return Number(value).toLocaleString('en-US', {minimumFractionDigits: 2, maximumFractionDigits: 2});
+    }
+
+    function showBalance(balance) {
+        document.querySelectorAll('[data-live-balance]').forEach(function (element) {
+            element.textContent = balance;
+        });
+    }
+
+    function cell(text) {
+        var td = document.createElement('td');
+        td.className = 'px-4 py-2';
+        td.textContent = text;
+        return td;
+    }
+
+    function addRow(event) {
+        var tbody = document.querySelector('[data-live-transactions]');
+        if (!tbody) {
+            return;
+        }
+        var transaction = event.transaction;
+        var row = document.createElement('tr');
+        row.className = 'border-b';
+        var when = new Date(transaction.timestamp);
+        row.appendChild(cell(when.toLocaleString('en-US', {dateStyle: 'long', timeStyle: 'short'})));
+
+        var type = cell('');
+        type.className = 'px-4 py-3 text-sm border';
+        var badge = document.createElement('span');
+        badge.className = 'px-2 py-1 font-bold leading-tight rounded-sm ' +
+            (transaction.type === 'Withdrawal' ? 'text-red-700 bg-red-100' : 'text-green-700 bg-green-100');
+        badge.textContent = transaction.type;
+        type.appendChild(badge);
+        row.appendChild(type);
+
+        row.appendChild(cell(money(transaction.amount) + ' ' + event.currency));
+        row.appendChild(cell(money(transaction.balance_after) + ' ' + event.currency));
+
+        var total = tbody.querySelector('[data-live-total]');
+        tbody.insertBefore(row, total);
+        total.lastElementChild.textContent = money(event.balance) + ' ' + event.currency;
+    }
+
+    feed.addEventListener('balance', function (message) {
+        showBalance(JSON.parse(message.data).balance);
+    });
+    feed.addEventListener('transaction', function (message) {
+        var event = JSON.parse(message.data);
+        showBalance(event.balance);
+        addRow(event);
+    });
+})();
@@ -1,14 +1,63 @@
 from django.contrib import admin
+from core import search
+from core.admin import IndexedSearchMixin, ShardedAdminMixin
 from .views import send_transaction_email
 # from transactions.models import Transaction
-from .models import Transaction
+from .models import Transaction, LoanInstallment, ExchangeRate, ShardTransfer, StandingOrder
+from .balances import invalidate_checkpoints
+from .constants import LOAN
+from .loans import approve_loan
+from .posting import DEBIT_TYPES
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(ShardedAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['account', 'amount', 'balance_after_transaction', 'transaction_type', 'loan_approve']
+    list_select_related = ['account']
+    search_fields = ['account__account_no', 'amount']
+    search_kind = search.TRANSACTION
     
     def save_model(self, request, obj, form, change):
-        obj.account.balance += obj.amount
-        obj.balance_after_transaction = obj.account.balance
-        obj.account.save()
-        send_transaction_email(obj.account.user, obj.amount, "Loan Approval", "transactions/admin_email.html")
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        if obj.transaction_type == LOAN:
+            # approval credits the loan once and stores its repayment schedule
+            if obj.loan_approve and 'loan_approve' in form.changed_data:
+                approve_loan(obj)
+                send_transaction_email(obj.account.user, obj.amount, "Loan Approval", "transactions/admin_email.html")
+            else:
+                super().save_model(request, obj, form, change)
+            return
+        if not change:
+            # a row added here moves the balance the same way a posting does
+            obj.account.balance += -obj.amount if obj.transaction_type in DEBIT_TYPES else obj.amount
+            obj.balance_after_transaction = obj.account.balance
+            obj.account.save(update_fields=['balance'])
+        super().save_model(request, obj, form, change)
+        if change:
+            invalidate_checkpoints(obj.account, obj.timestamp)
+
+
+@admin.register(LoanInstallment)
+class LoanInstallmentAdmin(ShardedAdminMixin, admin.ModelAdmin):
+    list_display = ['loan', 'account', 'number', 'due_date', 'amount_due', 'amount_paid', 'status']
+    list_filter = ['status']
+    list_select_related = ['loan', 'account']
+    date_hierarchy = 'due_date'
+    ordering = ['due_date']
+
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ['currency', 'rate', 'updated_at']
+
+
+@admin.register(ShardTransfer)
+class ShardTransferAdmin(admin.ModelAdmin):
+    list_display = ['reference', 'source_account_no', 'target_account_no', 'amount', 'status', 'updated_at']
+    list_filter = ['status']
+    search_fields = ['source_account_no', 'target_account_no']
+
+
+@admin.register(StandingOrder)
+class StandingOrderAdmin(admin.ModelAdmin):
+    list_display = ['account_no', 'target_account_no', 'amount', 'recurrence', 'next_run_at', 'active', 'last_error']
+    list_filter = ['active', 'recurrence']
+    search_fields = ['account_no', 'target_account_no']
+    readonly_fields = ['claimed_by', 'claimed_until', 'last_run_at', 'last_error']
@@ -0,0 +1,224 @@
+"""Bank-wide analytics computed over a columnar snapshot of the ledger.
+
+The snapshot holds only the columns the dashboard needs, as NumPy arrays,
+so every aggregate is a handful of vectorized passes instead of a query
+per chart.  It is written to ``ANALYTICS_SNAPSHOT_PATH`` by the
+``analytics_snapshot`` command and the computed aggregates are cached for
+``ANALYTICS_CACHE_TTL`` seconds.  Requests only build a snapshot when
+there is none; an existing one is always served, and flagged as stale on
+the dashboard once it is older than ``ANALYTICS_SNAPSHOT_MAX_AGE``, so
+the command should be scheduled more often than that.
+"""
+import os
+import tempfile
+import threading
+import time
+from itertools import chain
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from accounts.models import UserBankAccount
+from core import sharding
+from .constants import TRANSACTION_TYPE, DEPOSIT, WITHDRAWAL, LOAN
+from . import fx
+from .models import Transaction
+
+CACHE_KEY = 'transactions:analytics'
+SNAPSHOT_COLUMNS = ('account_id', 'transaction_type', 'amount', 'timestamp', 'loan_approve')
+SECONDS_PER_DAY = 86400
+DAILY_WINDOW = 30
+TOP_ACCOUNTS = 10
+
+_build_lock = threading.Lock()
+
+
+def snapshot_path():
+    return str(getattr(settings, 'ANALYTICS_SNAPSHOT_PATH', settings.BASE_DIR / 'analytics_snapshot.npz'))
+
+
+def build_snapshot(chunk_size=20000):
+    """Read the ledger in ``chunk_size`` slices into columnar arrays.
+
+    Amounts are converted to ``BASE_CURRENCY`` and kept as integer cents,
+    timestamps as days since the epoch, so the arrays stay compact and
+    group-by keys are plain integers.  Every ledger shard is read in turn.
+    """
+    rows = chain.from_iterable(
+        Transaction.objects.using(database).order_by()
+        .values_list(*SNAPSHOT_COLUMNS, 'account__currency')
+        .iterator(chunk_size=chunk_size)
+        for database in sharding.ledger_databases()
+    )
+    rates = fx.get_rates()
+    base_currency = fx.base_currency()
+    chunks = {name: [] for name in SNAPSHOT_COLUMNS}
+    buffer = []
+
+    def flush():
+        if not buffer:
+            return
+        account_ids, types, amounts, timestamps, approved, currencies = zip(*buffer)
+        chunks['account_id'].append(np.fromiter(account_ids, dtype=np.int64, count=len(buffer)))
+        chunks['transaction_type'].append(np.fromiter((t or 0 for t in types), dtype=np.int8, count=len(buffer)))
+        chunks['amount'].append(np.rint(rates.convert_many(amounts, currencies, base_currency) * 100).astype(np.int64))
+        chunks['timestamp'].append(np.fromiter((int(ts.timestamp()) // SECONDS_PER_DAY for ts in timestamps), dtype=np.int32, count=len(buffer)))
+        chunks['loan_approve'].append(np.fromiter(approved, dtype=np.bool_, count=len(buffer)))
+        buffer.clear()
+
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= chunk_size:
+            flush()
+    flush()
+
+    dtypes = {'account_id': np.int64, 'transaction_type': np.int8, 'amount': np.int64, 'timestamp': np.int32, 'loan_approve': np.bool_}
+    return {
+        name: np.concatenate(parts) if parts else np.empty(0, dtype=dtypes[name])
+        for name, parts in chunks.items()
+    }
+
+
+def save_snapshot(snapshot, path=None):
+    path = str(path or snapshot_path())
+    # a temporary file of its own, so concurrent writers never share one
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp.npz', delete=False) as tmp_file:
+        try:
+            np.savez(tmp_file, **snapshot)
+        except BaseException:
+            os.remove(tmp_file.name)
+            raise
+    os.replace(tmp_file.name, path)
+    cache.delete(CACHE_KEY)
+    return path
+
+
+def load_snapshot(path=None):
+    with np.load(path or snapshot_path()) as data:
+        return {name: data[name] for name in SNAPSHOT_COLUMNS}
+
+
+def _cents(value):
+    return round(float(value) / 100, 2)
+
+
+def daily_volume(snapshot, days=DAILY_WINDOW):
+    day = snapshot['timestamp']
+    if not day.size:
+        return []
+    last_day = int(day.max())
+    first_day = last_day - days + 1
+    in_window = day >= first_day
+    day_index = (day[in_window] - first_day).astype(np.int64)
+    types = snapshot['transaction_type'][in_window].astype(np.int64)
+    amounts = np.abs(snapshot['amount'][in_window])
+
+    type_count = max(code for code, _ in TRANSACTION_TYPE) + 1
+    keys = day_index * type_count + types
+    counts = np.bincount(keys, minlength=days * type_count).reshape(days, type_count)
+    volumes = np.bincount(keys, weights=amounts, minlength=days * type_count).reshape(days, type_count)
+
+    epoch = date(1970, 1, 1)
+    result = []
+    for offset in range(days):
+        if not counts[offset].any():
+            continue
+        result.append({
+            'date': epoch + timedelta(days=first_day + offset),
+            'types': [
+                {'label': label, 'count': int(counts[offset, code]), 'volume': _cents(volumes[offset, code])}
+                for code, label in TRANSACTION_TYPE
+            ],
+        })
+    return result
+
+
+def amount_distribution(snapshot, transaction_type):
+    amounts = snapshot['amount'][snapshot['transaction_type'] == transaction_type]
+    if not amounts.size:
+        return {'count': 0, 'total': 0, 'mean': 0, 'p50': 0, 'p90': 0, 'p99': 0, 'max': 0}
+    p50, p90, p99 = np.percentile(amounts, [50, 90, 99])
+    return {
+        'count': int(amounts.size),
+        'total': _cents(amounts.sum()),
+        'mean': _cents(amounts.mean()),
+        'p50': _cents(p50),
+        'p90': _cents(p90),
+        'p99': _cents(p99),
+        'max': _cents(amounts.max()),
+    }
+
+
+def loan_exposure(snapshot):
+    is_loan = snapshot['transaction_type'] == LOAN
+    approved = is_loan & snapshot['loan_approve']
+    pending = is_loan & ~snapshot['loan_approve']
+    return {
+        'approved_count': int(approved.sum()),
+        'approved_total': _cents(snapshot['amount'][approved].sum()),
+        'pending_count': int(pending.sum()),
+        'pending_total': _cents(snapshot['amount'][pending].sum()),
+        'borrowers': int(np.unique(snapshot['account_id'][approved]).size),
+    }
+
+
+def top_accounts(snapshot, limit=TOP_ACCOUNTS):
+    account_ids = snapshot['account_id']
+    if not account_ids.size:
+        return []
+    # ids are sparse across shards, so group by position in the unique ids
+    ids, index = np.unique(account_ids, return_inverse=True)
+    volume = np.bincount(index, weights=np.abs(snapshot['amount']))
+    counts = np.bincount(index)
+    limit = min(limit, ids.size)
+    top = np.argpartition(volume, -limit)[-limit:]
+    top = top[np.argsort(volume[top])[::-1]]
+    account_numbers = {}
+    for database in sharding.ledger_databases():
+        account_numbers.update(
+            UserBankAccount.objects.using(database).filter(pk__in=ids[top].tolist()).values_list('pk', 'account_no')
+        )
+    return [
+        {
+            'account_no': account_numbers.get(int(ids[position]), int(ids[position])),
+            'count': int(counts[position]),
+            'volume': _cents(volume[position]),
+        }
+        for position in top
+    ]
+
+
+def compute_analytics(snapshot):
+    return {
+        'transaction_count': int(snapshot['amount'].size),
+        'daily_volume': daily_volume(snapshot),
+        'deposits': amount_distribution(snapshot, DEPOSIT),
+        'withdrawals': amount_distribution(snapshot, WITHDRAWAL),
+        'loans': loan_exposure(snapshot),
+        'top_accounts': top_accounts(snapshot),
+        'currency': fx.base_currency(),
+    }
+
+
+def get_bank_analytics():
+    """Return the cached aggregates, building the snapshot only if there is none."""
+    analytics = cache.get(CACHE_KEY)
+    if analytics is not None:
+        return analytics
+
+    path = snapshot_path()
+    if not os.path.exists(path):
+        with _build_lock:
+            # another request may have built it while this one waited
+            if not os.path.exists(path):
+                save_snapshot(build_snapshot(), path)
+    snapshot = load_snapshot(path)
+    built_at = os.path.getmtime(path)
+
+    analytics = compute_analytics(snapshot)
+    analytics['built_at'] = datetime.fromtimestamp(built_at, tz=timezone.utc)
+    analytics['stale'] = time.time() - built_at > getattr(settings, 'ANALYTICS_SNAPSHOT_MAX_AGE', 24 * 60 * 60)
+    cache.set(CACHE_KEY, analytics, getattr(settings, 'ANALYTICS_CACHE_TTL', 300))
+    return analytics
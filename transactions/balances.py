@@ -0,0 +1,130 @@
+"""Point-in-time balances.
+
+``balance_after_transaction`` is a snapshot taken when a row was written
+and is not corrected when a loan is approved or a row is edited later, so
+it cannot answer "what was the balance at ``ts``".  The ledger rows can:
+the balance at ``ts`` is the sum of every row before it, each signed by
+``ledger_delta``.  To keep that sum short, ``write_checkpoints`` stores a
+``BalanceCheckpoint`` every ``EVERY`` rows of an account and at each
+midnight; ``account_balance_at`` starts from the nearest checkpoint and
+only adds the rows after it, two indexed queries however old the account.
+
+Checkpoints are derived data.  Code that changes a row already covered by
+one (``approve_loan``, edits in the admin) calls ``invalidate_checkpoints``
+and the next run writes them again.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import groupby
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Case, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from .constants import LOAN
+from .models import BalanceCheckpoint, Transaction
+from .posting import DEBIT_TYPES
+
+DEFAULT_BALANCE_CHECKPOINTS = {
+    'EVERY': 500,
+    'SETTLE_SECONDS': 300,
+}
+
+
+def _options():
+    return {**DEFAULT_BALANCE_CHECKPOINTS, **getattr(settings, 'BALANCE_CHECKPOINTS', {})}
+
+
+def ledger_delta():
+    """How much a ledger row moved its account's balance, as a query expression."""
+    return Case(
+        When(transaction_type__in=DEBIT_TYPES, then=-F('amount')),
+        # a loan request only moves money once it is approved
+        When(transaction_type=LOAN, loan_approve=False, then=Value(Decimal(0))),
+        default=F('amount'),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def account_balance_at(account, ts):
+    """The balance of ``account`` from its ledger rows before ``ts``."""
+    using = account._state.db or DEFAULT_DB_ALIAS
+    checkpoint = (
+        BalanceCheckpoint.objects.using(using).filter(account=account, as_of__lte=ts).order_by('-as_of').first()
+    )
+    tail = Transaction.objects.using(using).filter(account=account, timestamp__lt=ts)
+    balance = Decimal(0)
+    if checkpoint is not None:
+        tail = tail.filter(timestamp__gte=checkpoint.as_of)
+        balance = checkpoint.balance
+    return balance + (tail.aggregate(total=Sum(ledger_delta()))['total'] or 0)
+
+
+def invalidate_checkpoints(account, since):
+    """Drop the checkpoints of ``account`` that cover a row at ``since``."""
+    using = account._state.db or DEFAULT_DB_ALIAS
+    BalanceCheckpoint.objects.using(using).filter(account=account, as_of__gt=since).delete()
+
+
+def _day_start(ts):
+    return timezone.make_aware(datetime.combine(timezone.localtime(ts).date(), time.min))
+
+
+def _walk(account_id, rows, checkpoint, every):
+    """New checkpoints for one account's rows after ``checkpoint``."""
+    balance = checkpoint.balance if checkpoint is not None else Decimal(0)
+    count = 0
+    previous = None
+    for _, timestamp, delta in rows:
+        if count:
+            # a checkpoint may only fall between two rows, never inside a tie
+            boundary = _day_start(timestamp)
+            if boundary > previous or (count >= every and timestamp > previous):
+                as_of = boundary if boundary > previous else timestamp
+                yield BalanceCheckpoint(account_id=account_id, as_of=as_of, balance=balance)
+                count = 0
+        balance += delta
+        count += 1
+        previous = timestamp
+
+
+def write_checkpoints(using=DEFAULT_DB_ALIAS, until=None, every=None, batch_size=500):
+    """Checkpoint every account on ``using`` up to ``until``; returns how many were written.
+
+    Accounts are read ``batch_size`` at a time and only their rows after
+    their latest checkpoint are fetched, so a run costs the new rows, not
+    the history.
+    """
+    options = _options()
+    every = every or options['EVERY']
+    until = until or timezone.now() - timedelta(seconds=options['SETTLE_SECONDS'])
+    latest = BalanceCheckpoint.objects.using(using).filter(account=OuterRef('account_id')).order_by('-as_of')
+    accounts = UserBankAccount.objects.using(using).order_by('pk').values_list('pk', flat=True)
+    written = last_pk = 0
+    while True:
+        batch = list(accounts.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return written
+        last_pk = batch[-1]
+        checkpoints = {
+            checkpoint.account_id: checkpoint
+            for checkpoint in BalanceCheckpoint.objects.using(using).filter(
+                account_id__in=batch, as_of=Subquery(latest.values('as_of')[:1])
+            )
+        }
+        new_rows = Q(account_id__in=[pk for pk in batch if pk not in checkpoints])
+        for checkpoint in checkpoints.values():
+            new_rows |= Q(account_id=checkpoint.account_id, timestamp__gte=checkpoint.as_of)
+        rows = (
+            Transaction.objects.using(using).filter(new_rows, timestamp__lt=until)
+            .annotate(delta=ledger_delta())
+            .order_by('account_id', 'timestamp', 'pk')
+            .values_list('account_id', 'timestamp', 'delta')
+        )
+        new = []
+        for account_id, account_rows in groupby(rows, key=lambda row: row[0]):
+            new.extend(_walk(account_id, account_rows, checkpoints.get(account_id), every))
+        BalanceCheckpoint.objects.using(using).bulk_create(new, ignore_conflicts=True)
+        written += len(new)
@@ -11,4 +11,36 @@ TRANSACTION_TYPE = (
     (LOAN, 'Loan'),
     (LOAN_PAID, 'Loan Paid'),
     (TRANSFER, 'TRANSFER'),
-)
\ No newline at end of file
+)
+
+SCHEDULED = 'scheduled'
+PAID = 'paid'
+OVERDUE = 'overdue'
+
+INSTALLMENT_STATUS = (
+    (SCHEDULED, 'Scheduled'),
+    (PAID, 'Paid'),
+    (OVERDUE, 'Overdue'),
+)
+
+PENDING = 'pending'
+PREPARED = 'prepared'
+COMMITTED = 'committed'
+ABORTED = 'aborted'
+
+TRANSFER_STATUS = (
+    (PENDING, 'Pending'),
+    (PREPARED, 'Prepared'),
+    (COMMITTED, 'Committed'),
+    (ABORTED, 'Aborted'),
+)
+
+DAILY = 'daily'
+WEEKLY = 'weekly'
+MONTHLY = 'monthly'
+
+RECURRENCE = (
+    (DAILY, 'Daily'),
+    (WEEKLY, 'Weekly'),
+    (MONTHLY, 'Monthly'),
+)
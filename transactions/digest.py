@@ -0,0 +1,108 @@
+"""Daily digest emails.
+
+Accounts whose ``notifications`` preference is ``DIGEST`` get no email per
+transaction; instead the nightly ``send_digests`` command mails them one
+summary of the day.  A day's ledger rows for all digest accounts on a
+shard come back in a single query ordered by account, so grouping them is
+one pass, and the owners are loaded with one more query on ``default``.  The rendered emails
+go out in batches over a single SMTP connection.
+"""
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import groupby
+
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from accounts.constants import DIGEST
+from accounts.models import UserBankAccount
+from .constants import DEPOSIT, LOAN, LOAN_PAID, TRANSFER, WITHDRAWAL
+from .models import Transaction
+
+SUBJECT = 'Your daily account digest'
+TEMPLATE = 'transactions/digest_email.html'
+
+
+@dataclass
+class Digest:
+    user: User
+    account: UserBankAccount
+    day: date
+    transactions: list = field(default_factory=list)
+
+    @property
+    def closing_balance(self):
+        return self.transactions[-1].balance_after_transaction
+
+    def totals(self):
+        """Money in and out over the day, in the account currency."""
+        money_in = money_out = Decimal(0)
+        for transaction in self.transactions:
+            kind, amount = transaction.transaction_type, transaction.amount
+            if kind == DEPOSIT or (kind == LOAN and transaction.loan_approve) or (kind == TRANSFER and amount > 0):
+                money_in += amount
+            elif kind in (WITHDRAWAL, LOAN_PAID):
+                money_out += amount
+            elif kind == TRANSFER:
+                money_out -= amount
+        return {'money_in': money_in, 'money_out': money_out}
+
+
+def day_window(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def collect_digests(day, using=DEFAULT_DB_ALIAS):
+    """One ``Digest`` per digest subscriber on ``using`` with activity on ``day``."""
+    start, end = day_window(day)
+    ledger = (
+        Transaction.objects.using(using)
+        .filter(account__notifications=DIGEST, timestamp__gte=start, timestamp__lt=end)
+        .select_related('account')
+        .order_by('account_id', 'timestamp', 'pk')
+    )
+    digests = [
+        Digest(user=None, account=rows[0].account, day=day, transactions=rows)
+        for rows in (list(rows) for _, rows in groupby(ledger, key=lambda row: row.account_id))
+    ]
+    # users live on the default database, whichever shard the ledger is on
+    users = User.objects.in_bulk([digest.account.user_id for digest in digests])
+    for digest in digests:
+        digest.user = users.get(digest.account.user_id)
+    return [digest for digest in digests if digest.user is not None and digest.user.email]
+
+
+def build_message(digest):
+    # imported here so workers only load the mail stack once they send
+    from django.core.mail import EmailMultiAlternatives
+
+    message = render_to_string(TEMPLATE, {
+        'user': digest.user,
+        'account': digest.account,
+        'day': digest.day,
+        'transactions': digest.transactions,
+        'totals': digest.totals(),
+        'closing_balance': digest.closing_balance,
+        'currency': digest.account.currency,
+    })
+    email = EmailMultiAlternatives(SUBJECT, '', to=[digest.user.email])
+    email.attach_alternative(message, 'text/html')
+    return email
+
+
+def send_digests(digests, batch_size=100):
+    """Render and send ``digests`` over one connection; returns how many went out."""
+    if not digests:
+        return 0
+    from django.core.mail import get_connection
+
+    sent = 0
+    with get_connection() as connection:
+        for start in range(0, len(digests), batch_size):
+            batch = [build_message(digest) for digest in digests[start:start + batch_size]]
+            sent += connection.send_messages(batch) or 0
+    return sent
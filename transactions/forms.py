@@ -1,6 +1,14 @@
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+
 from django import forms
-from .models import Transaction
+from django.utils import timezone
+from .models import Transaction, StandingOrder
+from . import fx
+from .posting import PayrollLine
 from accounts.models import UserBankAccount
+from core import sharding
 
 class TransactionForm(forms.ModelForm):
     class Meta:
@@ -24,7 +32,7 @@ class DepositForm(TransactionForm):
         amount = self.cleaned_data.get('amount')
         if amount < min_deposit_amount:
             raise forms.ValidationError(
-                f'You need to deposit at least {min_deposit_amount} &'
+                f'You need to deposit at least {min_deposit_amount} {self.account.currency}'
             )
         return amount
 
@@ -39,7 +47,7 @@ class withdrawForm(TransactionForm):
         
         if amount < min_withdraw_amount:
             raise forms.ValidationError(
-                f'You can withdraw at least {min_withdraw_amount} &'
+                f'You can withdraw at least {min_withdraw_amount} {self.account.currency}'
             )
         
         if amount > max_withdraw_amount:
@@ -49,7 +57,7 @@ class withdrawForm(TransactionForm):
         
         if amount > balance:
             raise forms.ValidationError(
-                f'You have {balance} $ in your account. You can not withdraw more than your account balance'
+                f'You have {balance} {self.account.currency} in your account. You can not withdraw more than your account balance'
             )
             
         return amount
@@ -60,6 +68,13 @@ class LoanRequestForm(TransactionForm):
         return amount
 
 
+class LoanPaymentForm(forms.Form):
+    amount = forms.DecimalField(
+        max_digits=10, decimal_places=2, min_value=0.01, required=False,
+        help_text='Leave empty to pay off the whole loan.'
+    )
+
+
 class TransferForm(forms.ModelForm):
     target_account_no = forms.CharField(max_length=8, required=True, label="Target Account Number")
     
@@ -74,7 +89,10 @@ class TransferForm(forms.ModelForm):
     def clean_target_account_no(self):
         account_no = self.cleaned_data.get('target_account_no')
         try:
-            target_account = UserBankAccount.objects.get(account_no = account_no)
+            # the view emails the recipient, fetch the owner along
+            target_account = sharding.select_owner(
+                UserBankAccount.objects.using(sharding.database_for_account_no(account_no))
+            ).get(account_no = account_no)
         except UserBankAccount.DoesNotExist:
             raise forms.ValidationError(f'Account number {account_no} not found.')
         if target_account == self.account:
@@ -90,9 +108,124 @@ class TransferForm(forms.ModelForm):
             raise forms.ValidationError(f"Insufficient balance. Your current balance is {self.account.balance}")
         return amount
     
+    def clean(self):
+        cleaned_data = super().clean()
+        target_account = cleaned_data.get('target_account_no')
+        amount = cleaned_data.get('amount')
+        if target_account is not None and amount is not None:
+            try:
+                fx.convert(amount, self.account.currency, target_account.currency)
+            except fx.UnknownCurrency:
+                raise forms.ValidationError(
+                    f'Transfers from {self.account.currency} to {target_account.currency} are not available.'
+                )
+        return cleaned_data
+
     def save(self, commit=True):
         target_account = self.cleaned_data.get('target_account_no')
         self.instance.account = self.account
         self.instance.target_account = target_account
         self.instance.balance_after_transaction = self.account.balance - self.cleaned_data.get('amount')
         return super().save(commit)
+
+
+
+class PayrollForm(forms.Form):
+    """A CSV of ``account_no,amount`` lines, with or without a header row."""
+    MAX_LINES = 10000
+    MAX_ERRORS = 10
+
+    payroll_file = forms.FileField(label='Payroll CSV', help_text='One "account number,amount" per line.')
+
+    def clean_payroll_file(self):
+        upload = self.cleaned_data['payroll_file']
+        try:
+            text = io.TextIOWrapper(upload.file, encoding='utf-8-sig')
+            rows = list(csv.reader(text))
+        except (UnicodeDecodeError, csv.Error):
+            raise forms.ValidationError('The file is not a UTF-8 CSV file.')
+
+        lines = []
+        errors = []
+        for number, row in enumerate(rows, start=1):
+            if not any(cell.strip() for cell in row):
+                continue
+            if number == 1 and row[0].strip().lower() in ('account_no', 'account number', 'account'):
+                continue
+            if len(row) < 2:
+                errors.append(f'Line {number}: expected an account number and an amount.')
+                continue
+            account_no, amount = row[0].strip(), row[1].strip()
+            try:
+                amount = Decimal(amount)
+            except InvalidOperation:
+                errors.append(f'Line {number}: {amount!r} is not an amount.')
+                continue
+            if not amount.is_finite():
+                errors.append(f'Line {number}: {row[1].strip()!r} is not an amount.')
+                continue
+            if amount <= 0 or amount.as_tuple().exponent < -2:
+                errors.append(f'Line {number}: the amount must be positive with at most two decimals.')
+                continue
+            lines.append(PayrollLine(number, account_no, amount))
+        if errors:
+            raise forms.ValidationError(errors[:self.MAX_ERRORS])
+        if not lines:
+            raise forms.ValidationError('The file has no payments.')
+        if len(lines) > self.MAX_LINES:
+            raise forms.ValidationError(f'A payroll can have at most {self.MAX_LINES} payments.')
+        return lines
+
+
+
+class StandingOrderForm(forms.ModelForm):
+    class Meta:
+        model = StandingOrder
+        fields = ['target_account_no', 'amount', 'recurrence', 'next_run_at']
+        labels = {'target_account_no': 'Target Account Number', 'next_run_at': 'First payment'}
+        widgets = {'next_run_at': forms.DateTimeInput(attrs={'type': 'datetime-local'})}
+
+    def __init__(self, *args, **kwargs):
+        self.account = kwargs.pop('account')
+        super().__init__(*args, **kwargs)
+        self.fields['target_account_no'].required = True
+        self.fields['target_account_no'].help_text = ''
+        for field in self.fields.values():
+            field.widget.attrs.update({
+                'class': (
+                    'shadow appearance-none border rounded w-full py-2 px-3 text-gray-700 '
+                    'leading-tight focus:outline-none focus:shadow-outline'
+                )
+            })
+
+    def clean_target_account_no(self):
+        account_no = self.cleaned_data.get('target_account_no')
+        if account_no == self.account.account_no:
+            raise forms.ValidationError("You cannot transfer your own account")
+        currency = UserBankAccount.objects.using(sharding.database_for_account_no(account_no)).filter(
+            account_no=account_no
+        ).values_list('currency', flat=True).first()
+        if currency is None:
+            raise forms.ValidationError(f'Account number {account_no} not found.')
+        try:
+            fx.get_rates().rate(self.account.currency, currency)
+        except fx.UnknownCurrency:
+            raise forms.ValidationError(f'Transfers from {self.account.currency} to {currency} are not available.')
+        return account_no
+
+    def clean_amount(self):
+        amount = self.cleaned_data.get('amount')
+        if amount <= 0:
+            raise forms.ValidationError("Amount must be grater than zero.")
+        return amount
+
+    def clean_next_run_at(self):
+        next_run_at = self.cleaned_data.get('next_run_at')
+        # the widget has minute precision, so the current minute is still allowed
+        if next_run_at < timezone.now().replace(second=0, microsecond=0):
+            raise forms.ValidationError('The first payment cannot be in the past.')
+        return next_run_at
+
+    def save(self, commit=True):
+        self.instance.account_no = self.account.account_no
+        return super().save(commit)
@@ -0,0 +1,94 @@
+"""Foreign exchange rates for multi-currency accounts.
+
+Rates live in ``ExchangeRate`` but are read through an immutable
+``RateSnapshot`` held per process.  A refresh builds a new snapshot and
+swaps the module reference in one assignment, so readers never see a
+half-updated table and conversions never query the database per row.
+Saving a rate refreshes the local snapshot right away; other processes
+pick it up within ``FX_SNAPSHOT_TTL`` seconds.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from types import MappingProxyType
+
+from django.conf import settings
+
+from .models import ExchangeRate
+
+CENT = Decimal('0.01')
+
+
+class UnknownCurrency(Exception):
+    """No exchange rate is configured for the currency."""
+
+
+@dataclass(frozen=True)
+class RateSnapshot:
+    version: int
+    loaded_at: float
+    rates: MappingProxyType
+
+    def rate(self, from_currency, to_currency):
+        try:
+            return self.rates[from_currency] / self.rates[to_currency]
+        except KeyError as exc:
+            raise UnknownCurrency(f'No exchange rate for {exc.args[0]}') from None
+
+    def convert(self, amount, from_currency, to_currency):
+        if from_currency == to_currency:
+            return amount
+        return (amount * self.rate(from_currency, to_currency)).quantize(CENT)
+
+    def convert_many(self, amounts, currencies, to_currency):
+        """Convert parallel sequences of amounts and currency codes at once.
+
+        Returns a float NumPy array, for reports and exports rather than
+        posting.
+        """
+        import numpy as np
+
+        amounts = np.asarray(amounts, dtype=np.float64)
+        codes, index = np.unique(np.asarray(currencies), return_inverse=True)
+        factors = np.array([float(self.rate(code, to_currency)) for code in codes.tolist()])
+        return np.round(amounts * factors[index.reshape(amounts.shape)], 2)
+
+
+_snapshot = None
+_refresh_lock = threading.Lock()
+
+
+def base_currency():
+    return getattr(settings, 'BASE_CURRENCY', 'USD')
+
+
+def refresh():
+    global _snapshot
+    with _refresh_lock:
+        rates = {base_currency(): Decimal(1)}
+        rates.update(ExchangeRate.objects.values_list('currency', 'rate'))
+        version = _snapshot.version + 1 if _snapshot else 1
+        _snapshot = RateSnapshot(version, time.monotonic(), MappingProxyType(rates))
+    return _snapshot
+
+
+def get_rates():
+    snapshot = _snapshot
+    if snapshot is None or time.monotonic() - snapshot.loaded_at > getattr(settings, 'FX_SNAPSHOT_TTL', 60):
+        snapshot = refresh()
+    return snapshot
+
+
+def convert(amount, from_currency, to_currency):
+    return get_rates().convert(amount, from_currency, to_currency)
+
+
+def currency_choices(choices):
+    """The ``choices`` whose currency can be converted, base currency included."""
+    rates = get_rates().rates
+    return [choice for choice in choices if choice[0] in rates]
+
+
+def format_money(amount, currency):
+    return f'{"{:,.2f}".format(float(amount))} {currency}'
@@ -0,0 +1,228 @@
+"""Live balance feed.
+
+Every committed ledger row is published as an event on the channel of its
+account; ``balance_feed`` streams the events of the logged-in customer's
+account to the browser as server-sent events, so the navbar balance and
+the transaction report update without reloading.
+
+A broker fans events out to subscribers.  ``InProcessBroker`` keeps one
+bounded ``asyncio.Queue`` per open stream and wakes it from whichever
+thread posted the transaction; an idle stream is a suspended coroutine,
+with no thread or database connection held.  It only reaches streams of
+the process that posted, so deployments with several worker processes set
+``LIVE_FEED['BACKEND']`` to ``RedisBroker`` (or their own broker with the
+same ``publish`` and ``subscribe``), which relays events between processes
+through Redis pub/sub.
+"""
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIVE_FEED = {
+    'BACKEND': 'transactions.live.InProcessBroker',
+    'OPTIONS': {},
+    'HEARTBEAT_SECONDS': 15,
+}
+
+
+def _options():
+    return {**DEFAULT_LIVE_FEED, **getattr(settings, 'LIVE_FEED', {})}
+
+
+def account_channel(account_id):
+    return f'account-{account_id}'
+
+
+class Subscription:
+    """The events of one channel for one stream, read on its event loop."""
+
+    def __init__(self, broker, channel, max_queued):
+        import asyncio
+
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(max_queued)
+
+    def put(self, data):
+        if self.queue.full():
+            # a stalled client loses the oldest event; every event carries the balance
+            self.queue.get_nowait()
+        self.queue.put_nowait(data)
+
+    async def get(self, timeout):
+        """The next event, or ``None`` after ``timeout`` seconds without one."""
+        import asyncio
+
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Fan events out to the subscriptions of this process."""
+
+    def __init__(self, max_queued=100):
+        self.max_queued = max_queued
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """Subscribe the running event loop to ``channel``."""
+        subscription = Subscription(self, channel, self.max_queued)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._channels.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._channels[subscription.channel]
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(subscriptions) for subscriptions in self._channels.values())
+
+    def publish(self, channel, data):
+        """Deliver ``data`` to every subscription of ``channel``; safe from any thread."""
+        with self._lock:
+            subscriptions = tuple(self._channels.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, data)
+            except RuntimeError:
+                # the stream's loop has shut down
+                self.unsubscribe(subscription)
+
+
+class RedisBroker(InProcessBroker):
+    """Relay events between processes through Redis pub/sub.
+
+    Publishing goes to Redis; one listener thread per process receives every
+    channel under ``prefix`` and fans it out to the local subscriptions.
+    Needs the ``redis`` package.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='mamar_bank:live:', max_queued=100):
+        import redis
+
+        super().__init__(max_queued)
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def publish(self, channel, data):
+        self._redis.publish(self.prefix + channel, data)
+
+    def subscribe(self, channel):
+        self._ensure_listener()
+        return super().subscribe(channel)
+
+    def _ensure_listener(self):
+        if self._listener is not None:
+            return
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='live-feed-listener', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for message in pubsub.listen():
+                    channel = message['channel'].decode()[len(self.prefix):]
+                    super().publish(channel, message['data'].decode())
+            except Exception:
+                logger.exception('Live feed lost its Redis subscription, reconnecting')
+                time.sleep(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                options = _options()
+                _broker = import_string(options['BACKEND'])(**options['OPTIONS'])
+    return _broker
+
+
+def transaction_event(row, currency):
+    return json.dumps({
+        'balance': str(row.balance_after_transaction),
+        'currency': currency,
+        'transaction': {
+            'id': row.pk,
+            'type': row.get_transaction_type_display(),
+            'amount': str(row.amount),
+            'balance_after': str(row.balance_after_transaction),
+            'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+        },
+    })
+
+
+def publish_transactions(rows, using=DEFAULT_DB_ALIAS):
+    """Publish new ledger rows once the transaction that wrote them commits."""
+    if not rows:
+        return
+    events = [(account_channel(row.account_id), transaction_event(row, row.account.currency)) for row in rows]
+
+    def publish():
+        broker = get_broker()
+        for channel, data in events:
+            try:
+                broker.publish(channel, data)
+            except Exception:
+                # the feed is a convenience, never worth failing a posting
+                logger.exception('Could not publish to %s', channel)
+
+    transaction.on_commit(publish, using=using)
+
+
+def sse(data, event=None):
+    """One server-sent event frame."""
+    lines = [f'event: {event}'] if event else []
+    lines.extend(f'data: {line}' for line in data.splitlines())
+    return '\n'.join(lines) + '\n\n'
+
+
+async def stream(account_id, balance_reader):
+    """Server-sent events for one account, forever.
+
+    Subscribes before reading the balance, so no posting falls between the
+    first ``balance`` event and the ``transaction`` events that follow.
+    """
+    subscription = get_broker().subscribe(account_channel(account_id))
+    heartbeat = _options()['HEARTBEAT_SECONDS']
+    try:
+        balance, currency = await balance_reader()
+        yield 'retry: 5000\n' + sse(json.dumps({'balance': str(balance), 'currency': currency}), 'balance')
+        while True:
+            data = await subscription.get(heartbeat)
+            # a comment line keeps proxies from closing an idle stream
+            yield sse(data, 'transaction') if data is not None else ': keep-alive\n\n'
+    finally:
+        subscription.close()
@@ -0,0 +1,221 @@
+"""Loan amortization, installment repayment and collections.
+
+A loan is still a ``LOAN`` ``Transaction``; approving it credits the
+account and writes its whole repayment schedule to ``LoanInstallment`` in
+one insert.  Payments (partial, full or the nightly scheduled debit) post a
+``LOAN_PAID`` transaction and are allocated to the oldest open
+installments first.  Due, overdue and collections queries all scan the
+``(due_date, status)`` index instead of recomputing per loan.  Everything
+runs on the loan's ledger shard; the batch jobs take the shard as ``using``.
+"""
+import calendar
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, DecimalField, F, Min, Sum
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from .constants import LOAN_PAID, SCHEDULED, PAID, OVERDUE
+from .balances import invalidate_checkpoints
+from .models import LoanInstallment
+from .posting import apply_posting
+
+OPEN_STATUSES = (SCHEDULED, OVERDUE)
+CENT = Decimal('0.01')
+
+
+def add_months(day, months, anchor_day=None):
+    """``day`` moved by ``months``, on ``anchor_day`` (default ``day.day``) or the month's last day."""
+    month_index = day.month - 1 + months
+    year = day.year + month_index // 12
+    month = month_index % 12 + 1
+    return day.replace(
+        year=year, month=month, day=min(anchor_day or day.day, calendar.monthrange(year, month)[1])
+    )
+
+
+def amortization_schedule(principal, annual_rate, months):
+    """Return ``(principal, interest)`` cent arrays for a fixed-payment loan.
+
+    All installments are computed at once from the closed-form balance
+    before each payment; the last principal absorbs rounding so the parts
+    always add up to the loan amount.  The term is shortened to at most one
+    installment per cent, so no installment repays nothing.
+    """
+    # imported here to keep NumPy out of worker startup
+    import numpy as np
+
+    principal_cents = int((Decimal(principal) * 100).to_integral_value())
+    months = max(1, min(months, principal_cents))
+    rate = float(annual_rate) / 12
+    periods = np.arange(months)
+    if rate:
+        growth = (1 + rate) ** periods
+        payment = principal_cents * rate / (1 - (1 + rate) ** -months)
+        opening_balance = principal_cents * growth - payment * (growth - 1) / rate
+        interest = np.rint(opening_balance * rate).astype(np.int64)
+        principal_part = np.rint(payment - opening_balance * rate).astype(np.int64)
+    else:
+        interest = np.zeros(months, dtype=np.int64)
+        principal_part = np.full(months, principal_cents // months, dtype=np.int64)
+    principal_part[-1] += principal_cents - principal_part.sum()
+    return principal_part, interest
+
+
+def create_schedule(loan, start_date=None, annual_rate=None, months=None):
+    annual_rate = getattr(settings, 'LOAN_ANNUAL_INTEREST_RATE', 0) if annual_rate is None else annual_rate
+    months = getattr(settings, 'LOAN_TERM_MONTHS', 12) if months is None else months
+    start_date = start_date or timezone.localdate()
+    principal_part, interest = amortization_schedule(loan.amount, annual_rate, months)
+    return LoanInstallment.objects.using(loan._state.db).bulk_create([
+        LoanInstallment(
+            loan=loan,
+            account_id=loan.account_id,
+            number=number,
+            due_date=add_months(start_date, number),
+            principal=Decimal(int(principal_cents)) / 100,
+            interest=Decimal(int(interest_cents)) / 100,
+            amount_due=Decimal(int(principal_cents + interest_cents)) / 100,
+        )
+        for number, (principal_cents, interest_cents) in enumerate(zip(principal_part, interest), start=1)
+    ])
+
+
+def approve_loan(loan):
+    """Credit an approved loan and store its repayment schedule."""
+    using = loan._state.db
+    with transaction.atomic(using=using):
+        account = UserBankAccount.objects.using(using).select_for_update().get(pk=loan.account_id)
+        account.balance += loan.amount
+        account.save(update_fields=['balance'])
+        loan.account = account
+        loan.loan_approve = True
+        loan.balance_after_transaction = account.balance
+        loan.save()
+        create_schedule(loan)
+        # the credit lands on a row that may already be checkpointed
+        invalidate_checkpoints(account, loan.timestamp)
+    return loan
+
+
+def ensure_schedule(loan):
+    # loans approved before the engine existed are repayable in one
+    # installment, written on their first payment
+    if not loan.installments.exists():
+        create_schedule(loan, start_date=loan.timestamp.date(), annual_rate=0, months=1)
+
+
+def _allocate(installments, amount, paid_at):
+    remaining = amount
+    for installment in installments:
+        if remaining <= 0:
+            break
+        share = min(remaining, installment.outstanding)
+        installment.amount_paid += share
+        remaining -= share
+        if installment.outstanding == 0:
+            installment.status = PAID
+            installment.paid_at = paid_at
+    return installments
+
+
+def pay_loan(loan, amount=None):
+    """Pay ``amount`` (default: everything outstanding) towards ``loan``.
+
+    Raises ``PostingRejected`` when the balance does not cover the payment.
+    Returns the ``LOAN_PAID`` transaction.
+    """
+    using = loan._state.db
+    with transaction.atomic(using=using):
+        account = UserBankAccount.objects.using(using).select_for_update().get(pk=loan.account_id)
+        # under the account lock, so concurrent first payments write one schedule
+        ensure_schedule(loan)
+        installments = list(
+            LoanInstallment.objects.using(using).select_for_update()
+            .filter(loan=loan, status__in=OPEN_STATUSES)
+            .order_by('due_date', 'number')
+        )
+        outstanding = sum((installment.outstanding for installment in installments), Decimal(0))
+        amount = outstanding if amount is None else min(Decimal(amount), outstanding)
+        if amount <= 0:
+            return None
+
+        payment = apply_posting(account, amount, LOAN_PAID)
+        account.save(update_fields=['balance'])
+        payment.save()
+        LoanInstallment.objects.using(using).bulk_update(
+            _allocate(installments, amount, payment.timestamp), ['amount_paid', 'status', 'paid_at']
+        )
+    return payment
+
+
+def collect_due_installments(today=None, batch_size=1000, using=DEFAULT_DB_ALIAS):
+    """Debit every due installment the account balance can cover.
+
+    Due installments are found through the ``(due_date, status)`` index and
+    settled one batch of accounts at a time; each account gets its own transaction
+    so one short balance does not block the rest.  Returns the number of
+    payments posted.
+    """
+    today = today or timezone.localdate()
+    due = (
+        LoanInstallment.objects.using(using).filter(due_date__lte=today, status__in=OPEN_STATUSES)
+        .values_list('account_id', flat=True)
+        .distinct()
+        .order_by('account_id')
+    )
+    payments = 0
+    last_account_id = 0
+    while True:
+        account_ids = list(due.filter(account_id__gt=last_account_id)[:batch_size])
+        if not account_ids:
+            break
+        last_account_id = account_ids[-1]
+        for account_id in account_ids:
+            payments += _collect_account(account_id, today, using)
+    return payments
+
+
+def _collect_account(account_id, today, using):
+    with transaction.atomic(using=using):
+        account = UserBankAccount.objects.using(using).select_for_update().get(pk=account_id)
+        installments = list(
+            LoanInstallment.objects.using(using).select_for_update()
+            .filter(account_id=account_id, due_date__lte=today, status__in=OPEN_STATUSES)
+            .order_by('due_date', 'number')
+        )
+        due_total = sum((installment.outstanding for installment in installments), Decimal(0))
+        amount = min(due_total, account.balance).quantize(CENT)
+        if amount <= 0:
+            return 0
+
+        payment = apply_posting(account, amount, LOAN_PAID)
+        account.save(update_fields=['balance'])
+        payment.save()
+        LoanInstallment.objects.using(using).bulk_update(
+            _allocate(installments, amount, payment.timestamp), ['amount_paid', 'status', 'paid_at']
+        )
+    return 1
+
+
+def mark_overdue(today=None, using=DEFAULT_DB_ALIAS):
+    today = today or timezone.localdate()
+    return LoanInstallment.objects.using(using).filter(due_date__lt=today, status=SCHEDULED).update(status=OVERDUE)
+
+
+def collections_report(today=None, using=DEFAULT_DB_ALIAS):
+    """Outstanding past-due amounts per account, from one indexed scan."""
+    today = today or timezone.localdate()
+    return (
+        LoanInstallment.objects.using(using).filter(due_date__lte=today, status__in=OPEN_STATUSES)
+        .values('account__account_no')
+        .annotate(
+            installments=Count('id'),
+            outstanding=Sum(F('amount_due') - F('amount_paid'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+            oldest_due=Min('due_date'),
+        )
+        .order_by('oldest_due')
+    )
+
@@ -0,0 +1,33 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import sharding
+from transactions.loans import collect_due_installments, collections_report, mark_overdue
+
+
+class Command(BaseCommand):
+    help = 'Nightly loan batch: debit due installments, flag overdue ones and print the collections report.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Run as of this day (YYYY-MM-DD).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--report-limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        today = options['date'] or timezone.localdate()
+        payments = overdue = 0
+        report = []
+        for database in sharding.ledger_databases():
+            payments += collect_due_installments(today, batch_size=options['batch_size'], using=database)
+            overdue += mark_overdue(today, using=database)
+            report.extend(collections_report(today, using=database)[:options['report_limit']])
+        self.stdout.write(f'{payments} installment payments collected, {overdue} installments now overdue')
+
+        report.sort(key=lambda row: row['oldest_due'])
+        for row in report[:options['report_limit']]:
+            self.stdout.write(
+                f"{row['account__account_no']}: {row['outstanding']} outstanding over "
+                f"{row['installments']} installments, oldest due {row['oldest_due']}"
+            )
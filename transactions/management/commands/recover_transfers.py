@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from transactions.constants import PENDING, PREPARED
+from transactions.models import ShardTransfer
+from transactions.posting import recover_transfer
+
+
+class Command(BaseCommand):
+    help = 'Complete or abort cross-shard transfers that were interrupted between their two phases.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=60,
+            help='Only touch transfers idle for this many seconds, so running ones are left alone.',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['older_than'])
+        stale = ShardTransfer.objects.filter(status__in=[PENDING, PREPARED], updated_at__lt=cutoff).order_by('pk')
+        completed = aborted = 0
+        for transfer in stale.iterator():
+            if recover_transfer(transfer):
+                completed += 1
+            else:
+                aborted += 1
+        self.stdout.write(self.style.SUCCESS(f'{completed} transfers completed, {aborted} aborted'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from transactions.standing_orders import DEFAULT_LEASE_SECONDS, run_due_orders
+
+
+class Command(BaseCommand):
+    help = 'Post every due standing order and advance its schedule. Safe to run in several processes at once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders claimed per round trip.')
+        parser.add_argument(
+            '--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS,
+            help='How long a claimed batch stays reserved for this worker.',
+        )
+
+    def handle(self, *args, **options):
+        counts = run_due_orders(batch_size=options['batch_size'], lease_seconds=options['lease_seconds'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['posted']} standing orders posted, {counts['rejected']} rejected, "
+            f"{counts['pending']} still queued, {counts['failed']} failed, {counts['lost']} left to other workers"
+        ))
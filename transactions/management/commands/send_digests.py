@@ -0,0 +1,23 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import sharding
+from transactions.digest import collect_digests, send_digests
+
+
+class Command(BaseCommand):
+    help = "Email every daily-digest subscriber a summary of yesterday's transactions."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Send the digest of this day (YYYY-MM-DD).')
+        parser.add_argument('--batch-size', type=int, default=100, help='Emails rendered and sent per batch.')
+
+    def handle(self, *args, **options):
+        day = options['date'] or timezone.localdate() - timedelta(days=1)
+        digests = []
+        for database in sharding.ledger_databases():
+            digests.extend(collect_digests(day, using=database))
+        sent = send_digests(digests, batch_size=options['batch_size'])
+        self.stdout.write(f'{sent} digests sent for {day}')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core import sharding
+from transactions.balances import write_checkpoints
+
+
+class Command(BaseCommand):
+    help = 'Store balance checkpoints for every account, so point-in-time balances only sum a short tail.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=int, help='Ledger rows between checkpoints, defaults to BALANCE_CHECKPOINTS.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Accounts read per round trip.')
+
+    def handle(self, *args, **options):
+        written = 0
+        for database in sharding.ledger_databases():
+            written += write_checkpoints(database, every=options['every'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{written} balance checkpoints written'))
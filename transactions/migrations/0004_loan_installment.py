@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_account_number_sequence'),
+        ('transactions', '0003_remove_transaction_description'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanInstallment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField()),
+                ('due_date', models.DateField()),
+                ('principal', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('interest', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('amount_due', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('amount_paid', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('status', models.CharField(choices=[('scheduled', 'Scheduled'), ('paid', 'Paid'), ('overdue', 'Overdue')], default='scheduled', max_length=10)),
+                ('paid_at', models.DateTimeField(blank=True, null=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='loan_installments', to='accounts.userbankaccount')),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='installments', to='transactions.transaction')),
+            ],
+            options={
+                'ordering': ['due_date', 'number'],
+                'indexes': [models.Index(fields=['due_date', 'status'], name='installment_due_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='loaninstallment',
+            constraint=models.UniqueConstraint(fields=('loan', 'number'), name='unique_loan_installment_number'),
+        ),
+    ]
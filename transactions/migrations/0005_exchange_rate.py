@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0004_loan_installment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=[('USD', 'USD'), ('BDT', 'BDT'), ('EUR', 'EUR'), ('GBP', 'GBP'), ('INR', 'INR')], max_length=3, unique=True)),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
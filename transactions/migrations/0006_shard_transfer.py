@@ -0,0 +1,45 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:21
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_unconstrained_user'),
+        ('transactions', '0005_exchange_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='transfer_reference',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='target_account',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='incoming_transactions', to='accounts.userbankaccount'),
+        ),
+        migrations.CreateModel(
+            name='ShardTransfer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('source_account_no', models.CharField(max_length=20)),
+                ('source_database', models.CharField(max_length=50)),
+                ('target_account_no', models.CharField(max_length=20)),
+                ('target_database', models.CharField(max_length=50)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('credited', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('prepared', 'Prepared'), ('committed', 'Committed'), ('aborted', 'Aborted')], default='pending', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='shard_transfer_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_shard_transfer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StandingOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_no', models.CharField(db_index=True, max_length=20)),
+                ('target_account_no', models.CharField(blank=True, help_text='Leave empty for a deposit.', max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('recurrence', models.CharField(choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], max_length=10)),
+                ('next_run_at', models.DateTimeField()),
+                ('active', models.BooleanField(default=True)),
+                ('claimed_by', models.CharField(blank=True, editable=False, max_length=100)),
+                ('claimed_until', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('last_run_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('last_error', models.CharField(blank=True, editable=False, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['next_run_at'],
+                'indexes': [models.Index(fields=['active', 'next_run_at'], name='standing_order_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_notification_preference'),
+        ('transactions', '0007_standing_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+            ],
+            options={
+                'ordering': ['as_of'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'timestamp'], name='transaction_account_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='balancecheckpoint',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_checkpoints', to='accounts.userbankaccount'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancecheckpoint',
+            constraint=models.UniqueConstraint(fields=('account', 'as_of'), name='unique_balance_checkpoint'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0008_balance_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='standingorder',
+            name='anchor_day',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, help_text='Day of the month monthly orders run on.', null=True),
+        ),
+    ]
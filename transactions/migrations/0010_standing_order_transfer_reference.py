@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0009_standing_order_anchor_day'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='standingorder',
+            name='transfer_reference',
+            field=models.UUIDField(blank=True, editable=False, help_text='ShardTransfer of the last period.', null=True),
+        ),
+    ]
@@ -1,16 +1,153 @@
+import uuid
+
 from django.db import models
 from accounts.models import UserBankAccount
-from .constants import TRANSACTION_TYPE
+from accounts.constants import CURRENCY
+from .constants import TRANSACTION_TYPE, INSTALLMENT_STATUS, SCHEDULED, TRANSFER_STATUS, PENDING, RECURRENCE
 
 class Transaction(models.Model):
     account = models.ForeignKey(UserBankAccount, related_name = 'transactions', on_delete = models.CASCADE)
-    target_account = models.ForeignKey(UserBankAccount, related_name='incoming_transactions', on_delete=models.CASCADE, null=True, blank=True)
+    # accounts can live on different shards, so no database-level constraint
+    target_account = models.ForeignKey(UserBankAccount, related_name='incoming_transactions', on_delete=models.CASCADE, null=True, blank=True, db_constraint=False)
     
     amount = models.DecimalField(decimal_places=2, max_digits=10)
     balance_after_transaction = models.DecimalField(decimal_places=2, max_digits=10)
     transaction_type = models.IntegerField(choices=TRANSACTION_TYPE, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     loan_approve = models.BooleanField(default=False)
+    transfer_reference = models.UUIDField(null=True, blank=True, db_index=True)
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['account', 'timestamp'], name='transaction_account_time_idx'),
+        ]
+
+
+
+class BalanceCheckpoint(models.Model):
+    """The balance of ``account`` from all its ledger rows before ``as_of``.
+
+    Written by ``write_balance_checkpoints`` on the account's shard, so a
+    historical balance only has to add up the rows after the nearest one.
+    """
+    account = models.ForeignKey(UserBankAccount, related_name='balance_checkpoints', on_delete=models.CASCADE)
+    as_of = models.DateTimeField()
+    balance = models.DecimalField(decimal_places=2, max_digits=12)
+
+    class Meta:
+        ordering = ['as_of']
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'as_of'], name='unique_balance_checkpoint'),
+        ]
+
+    def __str__(self):
+        return f'{self.account} {self.balance} as of {self.as_of}'
+
+
+
+class LoanInstallment(models.Model):
+    loan = models.ForeignKey(Transaction, related_name='installments', on_delete=models.CASCADE)
+    account = models.ForeignKey(UserBankAccount, related_name='loan_installments', on_delete=models.CASCADE)
+    number = models.PositiveSmallIntegerField()
+    due_date = models.DateField()
+    principal = models.DecimalField(decimal_places=2, max_digits=10)
+    interest = models.DecimalField(decimal_places=2, max_digits=10)
+    amount_due = models.DecimalField(decimal_places=2, max_digits=10)
+    amount_paid = models.DecimalField(decimal_places=2, max_digits=10, default=0)
+    status = models.CharField(max_length=10, choices=INSTALLMENT_STATUS, default=SCHEDULED)
+    paid_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['due_date', 'number']
+        constraints = [
+            models.UniqueConstraint(fields=['loan', 'number'], name='unique_loan_installment_number'),
+        ]
+        indexes = [
+            models.Index(fields=['due_date', 'status'], name='installment_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'Loan {self.loan_id} installment {self.number}'
+
+    @property
+    def outstanding(self):
+        return self.amount_due - self.amount_paid
+
+
+
+class ExchangeRate(models.Model):
+    """Value of one unit of ``currency`` in ``settings.BASE_CURRENCY``."""
+    currency = models.CharField(max_length=3, choices=CURRENCY, unique=True)
+    rate = models.DecimalField(decimal_places=8, max_digits=18)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.currency} {self.rate}'
+
+
+class ShardTransfer(models.Model):
+    """Coordinator log of a transfer between accounts on different shards.
+
+    Both legs' ledger rows carry ``reference`` as their
+    ``transfer_reference``, which makes the credit idempotent.
+    """
+    reference = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    source_account_no = models.CharField(max_length=20)
+    source_database = models.CharField(max_length=50)
+    target_account_no = models.CharField(max_length=20)
+    target_database = models.CharField(max_length=50)
+    amount = models.DecimalField(decimal_places=2, max_digits=12)
+    credited = models.DecimalField(decimal_places=2, max_digits=12)
+    status = models.CharField(max_length=10, choices=TRANSFER_STATUS, default=PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='shard_transfer_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.source_account_no} -> {self.target_account_no} ({self.status})'
+
+
+
+class StandingOrder(models.Model):
+    """A recurring transfer, or a recurring deposit when there is no target.
+
+    Orders stay on the default database and name their accounts by number,
+    so one scheduler serves every ledger shard.  A scheduler worker owns an
+    order while ``claimed_until`` is in the future.
+    """
+    account_no = models.CharField(max_length=20, db_index=True)
+    target_account_no = models.CharField(max_length=20, blank=True, help_text='Leave empty for a deposit.')
+    amount = models.DecimalField(decimal_places=2, max_digits=10)
+    recurrence = models.CharField(max_length=10, choices=RECURRENCE)
+    next_run_at = models.DateTimeField()
+    anchor_day = models.PositiveSmallIntegerField(
+        null=True, blank=True, editable=False, help_text='Day of the month monthly orders run on.'
+    )
+    active = models.BooleanField(default=True)
+    claimed_by = models.CharField(max_length=100, blank=True, editable=False)
+    claimed_until = models.DateTimeField(null=True, blank=True, editable=False)
+    last_run_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_error = models.CharField(max_length=255, blank=True, editable=False)
+    transfer_reference = models.UUIDField(
+        null=True, blank=True, editable=False, help_text='ShardTransfer of the last period.'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['next_run_at']
+        indexes = [
+            models.Index(fields=['active', 'next_run_at'], name='standing_order_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.account_no} -> {self.target_account_no or "deposit"} {self.amount} {self.recurrence}'
+
+    def save(self, *args, **kwargs):
+        if self.anchor_day is None and self.next_run_at is not None:
+            self.anchor_day = self.next_run_at.day
+        super().save(*args, **kwargs)
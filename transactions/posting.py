@@ -0,0 +1,470 @@
+"""Posting balance-changing transactions to the ledger.
+
+``post_transaction`` is the single entry point the views use.  By default
+every posting is its own short database transaction.  With
+``POSTING_QUEUE['ENABLED']`` the posting is handed to a per-process
+committer thread instead, which groups concurrent postings into one
+database transaction: balances are updated with ``bulk_update``, ledger
+rows inserted with ``bulk_create`` and every waiting request is woken with
+its own result.  Batching only happens between requests served by the same
+process, so the queue pays off with threaded or ASGI workers.  A posting
+not confirmed within ``TIMEOUT`` raises ``PostingPending``: the committer
+may still apply it, so callers report it as in progress, not failed.
+
+Postings run on the shard of the account (see ``core.sharding``), with one
+queue per shard.  ``post_transfer`` moves money between two accounts,
+using a two-phase protocol when they live on different shards, and
+``post_payroll`` pays a whole file of recipients from one account at once.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, transaction
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from core import search
+from .constants import WITHDRAWAL, LOAN_PAID, TRANSFER, PENDING, PREPARED, COMMITTED, ABORTED
+from . import fx, live
+from .models import Transaction, ShardTransfer
+
+DEBIT_TYPES = (WITHDRAWAL, LOAN_PAID)
+PAYROLL_BATCH_SIZE = 1000
+
+DEFAULT_QUEUE_SETTINGS = {
+    'ENABLED': False,
+    'MAX_BATCH_SIZE': 100,
+    'MAX_WAIT_MS': 5,
+    'TIMEOUT': 10,
+}
+
+
+class PostingRejected(Exception):
+    """The posting cannot be applied, e.g. the balance is too low."""
+
+
+class PostingPending(Exception):
+    """A queued posting was not confirmed within ``TIMEOUT``; it may still be applied."""
+
+
+@dataclass
+class Posting:
+    account_id: int
+    amount: Decimal
+    transaction_type: int
+    future: Future = field(default_factory=Future)
+
+
+def apply_posting(account, amount, transaction_type):
+    """Move ``account.balance`` and return the unsaved ledger row.
+
+    The caller must hold a lock on ``account`` and save both objects.
+    """
+    if transaction_type in DEBIT_TYPES:
+        if amount > account.balance:
+            raise PostingRejected(f'Insufficient balance. Your current balance is {account.balance}')
+        account.balance -= amount
+    else:
+        account.balance += amount
+    return Transaction(
+        account=account,
+        amount=amount,
+        transaction_type=transaction_type,
+        balance_after_transaction=account.balance,
+    )
+
+
+def _post_now(account_id, amount, transaction_type, using=DEFAULT_DB_ALIAS):
+    with transaction.atomic(using=using):
+        account = UserBankAccount.objects.using(using).select_for_update().get(pk=account_id)
+        ledger_row = apply_posting(account, amount, transaction_type)
+        account.save(update_fields=['balance'])
+        ledger_row.save()
+    return ledger_row
+
+
+def post_transfer(account, target_account, amount):
+    """Move ``amount`` from ``account`` to ``target_account``.
+
+    ``amount`` is in the sender's currency; the recipient is credited the
+    converted amount.  Returns the sender's and the recipient's
+    ``Transaction``.
+    """
+    credited = fx.convert(amount, account.currency, target_account.currency)
+    if account._state.db != target_account._state.db:
+        return _transfer_across_shards(account, target_account, amount, credited)
+
+    using = account._state.db
+    with transaction.atomic(using=using):
+        accounts = UserBankAccount.objects.using(using).select_for_update().in_bulk([account.pk, target_account.pk])
+        source, target = accounts[account.pk], accounts[target_account.pk]
+        if amount > source.balance:
+            raise PostingRejected(f'Insufficient balance. Your current balance is {source.balance}')
+        source.balance -= amount
+        target.balance += credited
+        UserBankAccount.objects.using(using).bulk_update([source, target], ['balance'])
+
+        sender_transaction = Transaction.objects.using(using).create(
+            account=source,
+            target_account=target,
+            transaction_type=TRANSFER,
+            amount=-amount,
+            balance_after_transaction=source.balance,
+        )
+        recipient_transaction = Transaction.objects.using(using).create(
+            account=target,
+            transaction_type=TRANSFER,
+            amount=credited,
+            balance_after_transaction=target.balance,
+        )
+    account.balance = source.balance
+    target_account.balance = target.balance
+    return sender_transaction, recipient_transaction
+
+
+def _transfer_across_shards(account, target_account, amount, credited):
+    """Two-phase transfer between accounts on different shards.
+
+    The ``ShardTransfer`` row on the default database is the coordinator's
+    log.  Phase one debits the sender on its shard and marks the transfer
+    prepared; from then on it will be completed.  Phase two credits the
+    recipient on theirs.  If the process dies in between,
+    ``recover_transfers`` finishes the job.
+    """
+    transfer = begin_transfer(account, target_account, amount, credited)
+    sender_transaction, recipient_transaction = run_transfer(transfer)
+    account.balance = sender_transaction.balance_after_transaction
+    target_account.balance = recipient_transaction.balance_after_transaction
+    return sender_transaction, recipient_transaction
+
+
+def begin_transfer(account, target_account, amount, credited=None):
+    """Log a pending two-phase transfer on the default database.
+
+    Creating the log inside a caller's transaction ties the transfer to
+    whatever that transaction records; ``run_transfer`` moves the money
+    once it has committed.
+    """
+    if credited is None:
+        credited = fx.convert(amount, account.currency, target_account.currency)
+    return ShardTransfer.objects.create(
+        source_account_no=account.account_no,
+        source_database=account._state.db,
+        target_account_no=target_account.account_no,
+        target_database=target_account._state.db,
+        amount=amount,
+        credited=credited,
+    )
+
+
+def run_transfer(transfer):
+    """Run both phases of a pending ``transfer``; returns the sender's and the recipient's rows."""
+    try:
+        sender_transaction = prepare_transfer(transfer)
+    except PostingRejected:
+        transfer.status = ABORTED
+        transfer.save(update_fields=['status', 'updated_at'])
+        raise
+    transfer.status = PREPARED
+    transfer.save(update_fields=['status', 'updated_at'])
+    return sender_transaction, complete_transfer(transfer)
+
+
+def prepare_transfer(transfer):
+    """Phase one: debit the sender and record the transfer on its shard."""
+    using = transfer.source_database
+    with transaction.atomic(using=using):
+        source = UserBankAccount.objects.using(using).select_for_update().get(account_no=transfer.source_account_no)
+        if transfer.amount > source.balance:
+            raise PostingRejected(f'Insufficient balance. Your current balance is {source.balance}')
+        source.balance -= transfer.amount
+        source.save(update_fields=['balance'])
+        return Transaction.objects.using(using).create(
+            account=source,
+            transaction_type=TRANSFER,
+            amount=-transfer.amount,
+            balance_after_transaction=source.balance,
+            transfer_reference=transfer.reference,
+        )
+
+
+def complete_transfer(transfer):
+    """Phase two: credit the recipient once, however often it is called."""
+    using = transfer.target_database
+    with transaction.atomic(using=using):
+        target = UserBankAccount.objects.using(using).select_for_update().get(account_no=transfer.target_account_no)
+        # both legs carry the reference, and share a database when both accounts do
+        credit = Transaction.objects.using(using).filter(account=target, transfer_reference=transfer.reference).first()
+        if credit is None:
+            target.balance += transfer.credited
+            target.save(update_fields=['balance'])
+            credit = Transaction.objects.using(using).create(
+                account=target,
+                transaction_type=TRANSFER,
+                amount=transfer.credited,
+                balance_after_transaction=target.balance,
+                transfer_reference=transfer.reference,
+            )
+    transfer.status = COMMITTED
+    transfer.save(update_fields=['status', 'updated_at'])
+    return credit
+
+
+def recover_transfer(transfer):
+    """Finish a cross-shard transfer its process left behind.
+
+    A prepared transfer is completed.  A pending one is completed if the
+    sender's debit was committed and aborted otherwise.  Returns whether the
+    transfer was completed.
+    """
+    if transfer.status == PENDING:
+        debited = Transaction.objects.using(transfer.source_database).filter(
+            transfer_reference=transfer.reference
+        ).exists()
+        if not debited:
+            transfer.status = ABORTED
+            transfer.save(update_fields=['status', 'updated_at'])
+            return False
+    complete_transfer(transfer)
+    return True
+
+
+@dataclass
+class PayrollLine:
+    line: int
+    account_no: str
+    amount: Decimal
+
+
+def post_payroll(account, lines):
+    """Pay every ``PayrollLine`` from ``account`` in one go.
+
+    Recipients are resolved with one ``account_no__in`` query per shard and
+    the total is checked against the payer's balance once.  On the payer's
+    shard the debit, every credit and all balances are written in a single
+    database transaction with ``bulk_create`` and ``bulk_update``.
+    Recipients on other shards get their credit through the two-phase
+    protocol; their debits are part of that same transaction, one per
+    recipient so each can be recovered.  Amounts are in the payer's
+    currency.  Returns the credit ``Transaction`` rows.
+    """
+    from core import sharding
+
+    using = account._state.db
+    numbers = {line.account_no for line in lines}
+    if account.account_no in numbers:
+        raise PostingRejected('You cannot pay your own account.')
+    databases = {number: using for number in numbers}
+    if sharding.is_sharded():
+        from core.models import AccountLocation
+
+        databases.update(AccountLocation.objects.filter(account_no__in=numbers).values_list('account_no', 'database'))
+    remote_numbers = {number for number, database in databases.items() if database != using}
+
+    remote_accounts = {}
+    for database in {databases[number] for number in remote_numbers}:
+        shard_numbers = [number for number in remote_numbers if databases[number] == database]
+        remote_accounts.update(
+            (recipient.account_no, recipient)
+            for recipient in UserBankAccount.objects.using(database).filter(account_no__in=shard_numbers)
+        )
+    missing = sorted(remote_numbers - remote_accounts.keys())
+    if missing:
+        raise PostingRejected(f'Account numbers not found: {", ".join(missing)}')
+    transfers = ShardTransfer.objects.bulk_create([
+        ShardTransfer(
+            source_account_no=account.account_no,
+            source_database=using,
+            target_account_no=line.account_no,
+            target_database=databases[line.account_no],
+            amount=line.amount,
+            credited=fx.convert(line.amount, account.currency, remote_accounts[line.account_no].currency),
+        )
+        for line in lines if line.account_no in remote_accounts
+    ])
+
+    try:
+        with transaction.atomic(using=using):
+            payer = UserBankAccount.objects.using(using).select_for_update().get(pk=account.pk)
+            recipients = {
+                recipient.account_no: recipient
+                for recipient in UserBankAccount.objects.using(using).select_for_update()
+                .filter(account_no__in=numbers - remote_numbers).order_by('pk')
+            }
+            missing = sorted(numbers - remote_numbers - recipients.keys())
+            if missing:
+                raise PostingRejected(f'Account numbers not found: {", ".join(missing)}')
+            total = sum((line.amount for line in lines), Decimal(0))
+            if total > payer.balance:
+                raise PostingRejected(f'Insufficient balance. Your current balance is {payer.balance}')
+
+            ledger = []
+            local_total = total - sum((transfer.amount for transfer in transfers), Decimal(0))
+            if local_total:
+                payer.balance -= local_total
+                ledger.append(Transaction(
+                    account=payer, transaction_type=TRANSFER, amount=-local_total,
+                    balance_after_transaction=payer.balance,
+                ))
+            for transfer in transfers:
+                payer.balance -= transfer.amount
+                ledger.append(Transaction(
+                    account=payer, transaction_type=TRANSFER, amount=-transfer.amount,
+                    balance_after_transaction=payer.balance, transfer_reference=transfer.reference,
+                ))
+            credits = []
+            for line in lines:
+                recipient = recipients.get(line.account_no)
+                if recipient is None:
+                    continue
+                credited = fx.convert(line.amount, payer.currency, recipient.currency)
+                recipient.balance += credited
+                credits.append(Transaction(
+                    account=recipient, transaction_type=TRANSFER, amount=credited,
+                    balance_after_transaction=recipient.balance,
+                ))
+            UserBankAccount.objects.using(using).bulk_update(
+                [payer, *recipients.values()], ['balance'], batch_size=PAYROLL_BATCH_SIZE
+            )
+            ledger = Transaction.objects.using(using).bulk_create(ledger + credits, batch_size=PAYROLL_BATCH_SIZE)
+            # bulk_create sends no post_save, index and publish the rows here
+            search.index_transactions(ledger)
+            live.publish_transactions(ledger, using)
+    except Exception:
+        _set_status(transfers, ABORTED)
+        raise
+    account.balance = payer.balance
+
+    _set_status(transfers, PREPARED)
+    for transfer in transfers:
+        credits.append(complete_transfer(transfer))
+    return credits
+
+
+def _set_status(transfers, status):
+    if transfers:
+        ShardTransfer.objects.filter(pk__in=[transfer.pk for transfer in transfers]).update(
+            status=status, updated_at=timezone.now()
+        )
+
+
+class PostingQueue:
+    def __init__(self, max_batch_size=100, max_wait_ms=5, timeout=10, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, account_id, amount, transaction_type):
+        posting = Posting(account_id, amount, transaction_type)
+        self._ensure_committer()
+        self._queue.put(posting)
+        try:
+            return posting.future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # the committer still has it, so the caller must not post it again
+            raise PostingPending('The posting was queued but not confirmed in time.') from None
+
+    def _ensure_committer(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'posting-committer-{self.using}', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            close_old_connections()
+            self.commit(batch)
+
+    def commit(self, batch):
+        accepted = []
+        rejected = []
+        try:
+            with transaction.atomic(using=self.using):
+                accounts = UserBankAccount.objects.using(self.using).select_for_update().in_bulk(
+                    {posting.account_id for posting in batch}
+                )
+                ledger = []
+                for posting in batch:
+                    account = accounts.get(posting.account_id)
+                    try:
+                        if account is None:
+                            raise PostingRejected('Account not found.')
+                        ledger.append(apply_posting(account, posting.amount, posting.transaction_type))
+                    except PostingRejected as exc:
+                        rejected.append((posting, exc))
+                    else:
+                        accepted.append(posting)
+                UserBankAccount.objects.using(self.using).bulk_update(
+                    {row.account_id: row.account for row in ledger}.values(), ['balance']
+                )
+                Transaction.objects.using(self.using).bulk_create(ledger)
+                # bulk_create sends no post_save, index and publish the rows here
+                search.index_transactions(ledger)
+                live.publish_transactions(ledger, self.using)
+        except Exception as exc:
+            for posting in batch:
+                posting.future.set_exception(exc)
+            return
+
+        for posting, ledger_row in zip(accepted, ledger):
+            posting.future.set_result(ledger_row)
+        for posting, exc in rejected:
+            posting.future.set_exception(exc)
+
+
+_posting_queues = {}
+_posting_queue_lock = threading.Lock()
+
+
+def get_posting_queue(using=DEFAULT_DB_ALIAS):
+    posting_queue = _posting_queues.get(using)
+    if posting_queue is None:
+        with _posting_queue_lock:
+            posting_queue = _posting_queues.get(using)
+            if posting_queue is None:
+                options = {**DEFAULT_QUEUE_SETTINGS, **getattr(settings, 'POSTING_QUEUE', {})}
+                posting_queue = _posting_queues[using] = PostingQueue(
+                    max_batch_size=options['MAX_BATCH_SIZE'],
+                    max_wait_ms=options['MAX_WAIT_MS'],
+                    timeout=options['TIMEOUT'],
+                    using=using,
+                )
+    return posting_queue
+
+
+def post_transaction(account, amount, transaction_type):
+    """Post ``amount`` to ``account`` and return the saved ``Transaction``.
+
+    Raises ``PostingRejected`` when the posting cannot be applied and
+    ``PostingPending`` when a queued posting was not confirmed in time.
+    ``account.balance`` is refreshed to the balance after the posting.
+    """
+    using = account._state.db or DEFAULT_DB_ALIAS
+    options = {**DEFAULT_QUEUE_SETTINGS, **getattr(settings, 'POSTING_QUEUE', {})}
+    if options['ENABLED'] and not transaction.get_connection(using).in_atomic_block:
+        ledger_row = get_posting_queue(using).submit(account.pk, amount, transaction_type)
+    else:
+        ledger_row = _post_now(account.pk, amount, transaction_type, using)
+    account.balance = ledger_row.balance_after_transaction
+    return ledger_row
@@ -0,0 +1,18 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import fx, live
+from .models import ExchangeRate, Transaction
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def refresh_exchange_rates(sender, **kwargs):
+    fx.refresh()
+
+
+@receiver(post_save, sender=Transaction)
+def publish_transaction(sender, instance, created, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    if created and not raw:
+        live.publish_transactions([instance], using)
@@ -0,0 +1,173 @@
+"""Standing orders: recurring transfers and deposits.
+
+``run_due_orders`` is the scheduler.  It claims due orders in batches
+through the ``(active, next_run_at)`` index and leases each batch to one
+worker until ``claimed_until``, so any number of ``run_standing_orders``
+processes can run side by side without executing an order twice.  On
+databases with ``SKIP LOCKED`` (PostgreSQL) workers skip each other's rows
+while claiming; elsewhere the claim is a conditional ``UPDATE`` that only
+one worker can win per row.  A worker that dies leaves its lease to expire
+and the orders are claimed again.
+
+Each period is two steps.  First the order is advanced on the default
+database, only while the worker still holds the lease, and a transfer's
+``ShardTransfer`` log is written in that same transaction with its
+reference kept on the order.  Then ``run_transfer`` moves the money with
+the two-phase protocol, on whichever shards the accounts live.  A
+worker that dies in between leaves a pending transfer that
+``recover_transfers`` completes or aborts, and never a second posting: the
+order has already moved on.  Recurring deposits are a single
+``post_transaction`` and are lost rather than doubled in that case.
+
+An order whose account cannot cover the payment is skipped for the
+period and the reason kept in ``last_error``; so is one whose accounts are
+gone or whose shards fail, without stopping the rest of the batch.  A
+deposit still waiting in the posting queue counts as ``pending``.  After a
+run the order moves to its first occurrence after now, so an order that
+was not run for a while pays one period, not every one it missed.
+"""
+import logging
+import os
+import socket
+import uuid
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from core import sharding
+from .constants import DAILY, DEPOSIT, WEEKLY
+from .fx import UnknownCurrency
+from .loans import add_months
+from .models import StandingOrder
+from .posting import PostingPending, PostingRejected, begin_transfer, post_transaction, run_transfer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEASE_SECONDS = 300
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def next_run(order, now):
+    """The first run of ``order`` after ``now``.
+
+    Periods missed while no scheduler ran are skipped, not caught up.
+    """
+    run = order.next_run_at
+    if order.recurrence in (DAILY, WEEKLY):
+        period = timedelta(days=1) if order.recurrence == DAILY else timedelta(weeks=1)
+        return run + (max((now - run) // period, 0) + 1) * period
+    months = max((now.year - run.year) * 12 + now.month - run.month, 0)
+    # from the anchor day, so Jan 31 runs on Feb 28 and then on Mar 31
+    anchor_day = order.anchor_day or run.day
+    following = add_months(run, months, anchor_day)
+    return following if following > now else add_months(run, months + 1, anchor_day)
+
+
+def _due(now):
+    return StandingOrder.objects.filter(active=True, next_run_at__lte=now).filter(
+        Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+    )
+
+
+def claim_due_orders(worker, batch_size=500, lease_seconds=DEFAULT_LEASE_SECONDS, now=None):
+    """Lease up to ``batch_size`` due orders to ``worker`` and return them."""
+    now = now or timezone.now()
+    claimed_until = now + timedelta(seconds=lease_seconds)
+    if connections[DEFAULT_DB_ALIAS].features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(
+                _due(now).select_for_update(skip_locked=True).order_by('next_run_at')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            StandingOrder.objects.filter(pk__in=ids).update(claimed_by=worker, claimed_until=claimed_until)
+    else:
+        candidates = list(_due(now).order_by('next_run_at').values_list('pk', flat=True)[:batch_size])
+        # re-checked row by row: a worker that got there first has moved claimed_until
+        _due(now).filter(pk__in=candidates).update(claimed_by=worker, claimed_until=claimed_until)
+    return list(
+        StandingOrder.objects.filter(claimed_by=worker, claimed_until=claimed_until).order_by('next_run_at')
+    )
+
+
+def _account(account_no):
+    return UserBankAccount.objects.using(sharding.database_for_account_no(account_no)).get(account_no=account_no)
+
+
+def execute_order(order, worker, now=None):
+    """Advance one claimed order and post its period.
+
+    Returns ``'posted'``, ``'rejected'``, ``'pending'`` when the posting is
+    still queued, ``'failed'`` on a database error, or ``'lost'`` when the
+    lease expired and another worker may own the order.
+    """
+    now = now or timezone.now()
+    outcome, error = None, ''
+    try:
+        account = _account(order.account_no)
+        target = _account(order.target_account_no) if order.target_account_no else None
+    except UserBankAccount.DoesNotExist:
+        account = target = None
+        outcome, error = 'rejected', 'Account not found.'
+    except DatabaseError as exc:
+        logger.exception('Could not read the accounts of standing order %s', order.pk)
+        account = target = None
+        outcome, error = 'failed', f'Could not read the accounts: {exc}'
+
+    # committed before any shard is written: the shards cannot join this transaction
+    transfer = None
+    with transaction.atomic():
+        advanced = StandingOrder.objects.filter(
+            pk=order.pk, claimed_by=worker, claimed_until__gte=now, next_run_at=order.next_run_at
+        ).update(
+            next_run_at=next_run(order, now), claimed_by='', claimed_until=None, last_run_at=now,
+            last_error=error[:255], transfer_reference=None,
+        )
+        if not advanced:
+            return 'lost'
+        if account is None:
+            return outcome
+        if target is not None:
+            try:
+                transfer = begin_transfer(account, target, order.amount)
+            except UnknownCurrency as exc:
+                StandingOrder.objects.filter(pk=order.pk).update(last_error=str(exc)[:255])
+                return 'rejected'
+            StandingOrder.objects.filter(pk=order.pk).update(transfer_reference=transfer.reference)
+
+    try:
+        if transfer is not None:
+            run_transfer(transfer)
+        else:
+            post_transaction(account, order.amount, DEPOSIT)
+    except PostingRejected as exc:
+        outcome, error = 'rejected', str(exc)
+    except PostingPending:
+        outcome, error = 'pending', 'The posting is still being processed.'
+    except UserBankAccount.DoesNotExist:
+        # moved or closed since it was looked up; recovery settles the transfer log
+        outcome, error = 'rejected', 'Account not found.'
+    except DatabaseError as exc:
+        logger.exception('Standing order %s failed', order.pk)
+        outcome, error = 'failed', str(exc)
+    else:
+        return 'posted'
+    StandingOrder.objects.filter(pk=order.pk).update(last_error=error[:255])
+    return outcome
+
+
+def run_due_orders(batch_size=500, lease_seconds=DEFAULT_LEASE_SECONDS, worker=None):
+    """Claim and execute due orders until none are left; returns the outcome counts."""
+    worker = worker or worker_id()
+    counts = {'posted': 0, 'rejected': 0, 'pending': 0, 'failed': 0, 'lost': 0}
+    while True:
+        orders = claim_due_orders(worker, batch_size, lease_seconds)
+        if not orders:
+            return counts
+        for order in orders:
+            counts[execute_order(order, worker)] += 1
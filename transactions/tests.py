@@ -1,3 +1,848 @@
-from django.test import TestCase
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone as datetime_timezone
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.constants import DIGEST
+from accounts.forms import UserRegistrationForm
+from accounts.models import UserBankAccount
+from core import idempotency
+from core.models import IdempotencyKey
+
+from mamar_bank.querybudget import QueryBudgetTestCase
+from . import urls
+from . import analytics, fx, live
+from .balances import account_balance_at, ledger_delta, write_checkpoints
+from .constants import DEPOSIT, LOAN, MONTHLY, PAID, PENDING, SCHEDULED, TRANSACTION_TYPE, TRANSFER, WEEKLY, WITHDRAWAL
+from .digest import collect_digests, send_digests
+from .forms import StandingOrderForm
+from .posting import Posting, PostingPending, PostingQueue, post_transaction, recover_transfer, run_transfer
+from .standing_orders import claim_due_orders, execute_order, next_run, run_due_orders
+from .loans import amortization_schedule, approve_loan, pay_loan
+from .models import BalanceCheckpoint, ExchangeRate, LoanInstallment, ShardTransfer, StandingOrder, Transaction
+
+
+def create_account(account_no, balance=0, currency='USD', **fields):
+    """A customer with a bank account and no history."""
+    user = User.objects.create(
+        username=f'customer{account_no}', email=f'customer{account_no}@example.com',
+        first_name='Customer', last_name=str(account_no),
+    )
+    return UserBankAccount.objects.create(
+        user=user, account_no=str(account_no), account_type='savings', gender='Male', birth_date=date(1990, 1, 1),
+        balance=Decimal(balance), currency=currency, **fields,
+    )
+
+
+class TransactionQueryBudgetTests(QueryBudgetTestCase):
+    budgets = {
+        ('deposit_money', 'GET'): (2, 2),
+        ('deposit_money', 'POST'): (8, 3),
+        ('withdraw_money', 'GET'): (2, 2),
+        ('withdraw_money', 'POST'): (8, 3),
+        ('transaction_report', 'GET'): (3, 29),
+        ('loan_request', 'GET'): (2, 2),
+        ('loan_request', 'POST'): (5, 3),
+        ('loan_list', 'GET'): (3, 5),
+        ('pay', 'GET'): (5, 16),
+        ('pay', 'POST'): (12, 17),
+        ('transfer_money', 'GET'): (2, 2),
+        ('transfer_money', 'POST'): (11, 5),
+        ('payroll_transfer', 'GET'): (2, 2),
+        ('payroll_transfer', 'POST'): (10, 23),
+        ('standing_orders', 'GET'): (3, 2),
+        ('standing_orders', 'POST'): (4, 3),
+        ('cancel_standing_order', 'POST'): (4, 2),
+        ('bank_analytics', 'GET'): (4, 552),
+        ('balance_feed', 'GET'): (2, 2),
+    }
+    admin_budgets = {
+        'transactions.transaction': (5, 104),
+        'transactions.loaninstallment': (7, 107),
+        'transactions.exchangerate': (5, 5),
+        'transactions.shardtransfer': (5, 4),
+        'transactions.standingorder': (5, 4),
+    }
+
+    def test_every_url_has_a_budget(self):
+        self.assertEveryUrlHasABudget(urls.urlpatterns)
+
+    def test_deposit(self):
+        url = reverse('deposit_money')
+        self.assertBudget('deposit_money', 'GET', url, status=200)
+        self.assertBudget('deposit_money', 'POST', url, {'amount': '500'}, status=302)
+
+    def test_withdraw(self):
+        url = reverse('withdraw_money')
+        self.assertBudget('withdraw_money', 'GET', url, status=200)
+        self.assertBudget('withdraw_money', 'POST', url, {'amount': '500'}, status=302)
+
+    def test_report(self):
+        self.assertBudget('transaction_report', 'GET', reverse('transaction_report'), status=200)
+
+    def test_loans(self):
+        self.assertBudget('loan_request', 'GET', reverse('loan_request'), status=200)
+        self.assertBudget('loan_request', 'POST', reverse('loan_request'), {'amount': '1000'}, status=302)
+        self.assertBudget('loan_list', 'GET', reverse('loan_list'), status=200)
+
+    def test_pay_loan(self):
+        loan = Transaction.objects.filter(account=self.account, transaction_type=LOAN, loan_approve=True).first()
+        url = reverse('pay', args=[loan.pk])
+        self.assertBudget('pay', 'GET', url, status=200)
+        self.assertBudget('pay', 'POST', url, {'amount': '50'}, status=302)
+
+    def test_transfer(self):
+        url = reverse('transfer_money')
+        self.assertBudget('transfer_money', 'GET', url, status=200)
+        response = self.assertBudget(
+            'transfer_money', 'POST', url,
+            {'amount': '100', 'target_account_no': self.accounts[2].account_no}, status=302,
+        )
+        self.assertEqual(response.url, reverse('transaction_report'))
+
+    def test_payroll(self):
+        url = reverse('payroll_transfer')
+        self.assertBudget('payroll_transfer', 'GET', url, status=200)
+        payroll = SimpleUploadedFile('payroll.csv', (
+            'account_no,amount\n' + ''.join(f'{account.account_no},12.50\n' for account in self.accounts[2:12])
+        ).encode())
+        self.assertBudget('payroll_transfer', 'POST', url, {'payroll_file': payroll}, status=302)
+
+    def test_standing_orders(self):
+        url = reverse('standing_orders')
+        self.assertBudget('standing_orders', 'GET', url, status=200)
+        self.assertBudget('standing_orders', 'POST', url, {
+            'target_account_no': self.accounts[2].account_no, 'amount': '25', 'recurrence': MONTHLY,
+            'next_run_at': '2030-01-31T09:00',
+        }, status=302)
+        order = StandingOrder.objects.get(account_no=self.account.account_no)
+        self.assertEqual(order.target_account_no, str(self.accounts[2].account_no))
+        self.assertBudget(
+            'cancel_standing_order', 'POST', reverse('cancel_standing_order', args=[order.pk]), status=302
+        )
+        self.assertFalse(StandingOrder.objects.get(pk=order.pk).active)
+
+    def test_analytics(self):
+        self.client.force_login(self.staff)
+        cache.clear()
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(ANALYTICS_SNAPSHOT_PATH=Path(directory) / 'snapshot.npz'):
+                self.assertBudget('bank_analytics', 'GET', reverse('bank_analytics'), status=200)
+
+    def test_balance_feed(self):
+        # the sync test client is WSGI, where the feed declines to stream
+        self.assertBudget('balance_feed', 'GET', reverse('balance_feed'), status=204)
+
+    def test_admin_changelists(self):
+        self.assertChangelistBudgets(['transactions'])
+
+
+class AnalyticsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.accounts = [create_account(201100 + number) for number in range(1, 4)]
+        now = timezone.now()
+        rows = [
+            (0, DEPOSIT, '1500.00', 0, False), (0, WITHDRAWAL, '500.25', 0, False), (1, DEPOSIT, '200.10', 1, False),
+            (1, LOAN, '1000.00', 1, True), (2, LOAN, '300.00', 2, False), (2, DEPOSIT, '99.99', 2, False),
+            (2, DEPOSIT, '7000.00', 40, False), (0, TRANSFER, '10.00', 3, False),
+        ]
+        for index, transaction_type, amount, days_ago, approved in rows:
+            row = Transaction.objects.create(
+                account=cls.accounts[index], amount=Decimal(amount), transaction_type=transaction_type,
+                balance_after_transaction=0, loan_approve=approved,
+            )
+            Transaction.objects.filter(pk=row.pk).update(timestamp=now - timedelta(days=days_ago))
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'snapshot.npz'
+        settings_override = override_settings(ANALYTICS_SNAPSHOT_PATH=self.path, ANALYTICS_CACHE_TTL=300)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.snapshot = analytics.build_snapshot(chunk_size=3)
+
+    def test_distributions_match_the_orm(self):
+        for transaction_type in (DEPOSIT, WITHDRAWAL):
+            expected = Transaction.objects.filter(transaction_type=transaction_type).aggregate(
+                count=Count('id'), total=Sum('amount'), max=Max('amount'),
+            )
+            distribution = analytics.amount_distribution(self.snapshot, transaction_type)
+            self.assertEqual(distribution['count'], expected['count'])
+            self.assertEqual(distribution['total'], float(expected['total']))
+            self.assertEqual(distribution['max'], float(expected['max']))
+
+    def test_loan_exposure_matches_the_orm(self):
+        loans = Transaction.objects.filter(transaction_type=LOAN)
+        approved = loans.filter(loan_approve=True).aggregate(count=Count('id'), total=Sum('amount'))
+        pending = loans.filter(loan_approve=False).aggregate(count=Count('id'), total=Sum('amount'))
+        self.assertEqual(analytics.loan_exposure(self.snapshot), {
+            'approved_count': approved['count'], 'approved_total': float(approved['total']),
+            'pending_count': pending['count'], 'pending_total': float(pending['total']),
+            'borrowers': loans.filter(loan_approve=True).values('account').distinct().count(),
+        })
+
+    def test_daily_volume_matches_the_orm(self):
+        first_day = timezone.now().date() - timedelta(days=analytics.DAILY_WINDOW - 1)
+        expected = {
+            (row['day'], row['transaction_type']): (row['count'], float(row['volume']))
+            for row in Transaction.objects.annotate(day=TruncDate('timestamp', tzinfo=datetime_timezone.utc))
+            .filter(day__gte=first_day).values('day', 'transaction_type')
+            .annotate(count=Count('id'), volume=Sum('amount'))
+        }
+        actual = {
+            (day['date'], code): (row['count'], row['volume'])
+            for day in analytics.daily_volume(self.snapshot)
+            for code, row in zip((code for code, _ in TRANSACTION_TYPE), day['types'])
+            if row['count']
+        }
+        self.assertEqual(actual, expected)
+
+    def test_top_accounts_match_the_orm(self):
+        expected = [
+            {'account_no': row['account__account_no'], 'count': row['count'], 'volume': float(row['volume'])}
+            for row in Transaction.objects.values('account__account_no')
+            .annotate(count=Count('id'), volume=Sum('amount')).order_by('-volume')
+        ]
+        self.assertEqual(analytics.top_accounts(self.snapshot), expected)
+
+    def test_snapshot_is_built_only_when_missing(self):
+        self.assertEqual(analytics.get_bank_analytics()['transaction_count'], 8)
+        self.assertEqual(os.listdir(self.path.parent), [self.path.name])
+        create_account(201104).transactions.create(
+            amount=Decimal(50), transaction_type=DEPOSIT, balance_after_transaction=50,
+        )
+        cache.clear()
+        stale = self.path.stat().st_mtime - 3600
+        os.utime(self.path, (stale, stale))
+        # the top accounts' numbers, no ledger scan
+        with self.assertNumQueries(1):
+            result = analytics.get_bank_analytics()
+        self.assertEqual((result['transaction_count'], result['stale']), (8, False))
+
+        cache.clear()
+        with override_settings(ANALYTICS_SNAPSHOT_MAX_AGE=1800):
+            result = analytics.get_bank_analytics()
+        # served as it is, and flagged on the dashboard
+        self.assertEqual((result['transaction_count'], result['stale']), (8, True))
+        self.assertEqual(self.path.stat().st_mtime, stale)
+
+        analytics.save_snapshot(analytics.build_snapshot())
+        self.assertEqual(analytics.get_bank_analytics()['transaction_count'], 9)
+        self.assertEqual(os.listdir(self.path.parent), [self.path.name])
+
+
+class PayrollTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.payer = create_account(200201, balance=1000)
+        cls.recipients = [create_account(200202 + number) for number in range(3)]
+
+    def setUp(self):
+        self.client.force_login(self.payer.user)
+
+    def pay(self, csv_text):
+        payroll = SimpleUploadedFile('payroll.csv', csv_text.encode())
+        return self.client.post(reverse('payroll_transfer'), {'payroll_file': payroll})
+
+    def test_pays_every_line_from_one_debit(self):
+        response = self.pay('account_no,amount\n' + ''.join(
+            f'{account.account_no},12.50\n' for account in self.recipients
+        ))
+        self.assertRedirects(response, reverse('transaction_report'))
+        self.assertEqual(UserBankAccount.objects.get(pk=self.payer.pk).balance, Decimal('962.50'))
+        for recipient in self.recipients:
+            self.assertEqual(UserBankAccount.objects.get(pk=recipient.pk).balance, Decimal('12.50'))
+        self.assertEqual(Transaction.objects.filter(account=self.payer).get().amount, Decimal('-37.50'))
+
+    def test_rejects_unknown_accounts_and_overdrafts(self):
+        recipient = self.recipients[0].account_no
+        for csv_text, error in [
+            ('999999,10\n', 'Account numbers not found: 999999'),
+            (f'{recipient},1000.01\n', 'Insufficient balance'),
+            (f'{recipient},-5\n', 'Line 1: the amount must be positive'),
+            (f'{self.payer.account_no},5\n', 'You cannot pay your own account.'),
+            (f'{recipient},NaN\n', 'Line 1: &#x27;NaN&#x27; is not an amount.'),
+            (f'{recipient},10\n{recipient},sNaN\n', 'Line 2: &#x27;sNaN&#x27; is not an amount.'),
+            (f'{recipient},inf\n', 'Line 1: &#x27;inf&#x27; is not an amount.'),
+            (f'{recipient},-Infinity\n', 'Line 1: &#x27;-Infinity&#x27; is not an amount.'),
+        ]:
+            self.assertContains(self.pay(csv_text), error)
+        self.assertEqual(UserBankAccount.objects.get(pk=self.payer.pk).balance, Decimal(1000))
+        self.assertFalse(Transaction.objects.exists())
+
+
+class PostingQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = create_account(200801, balance=100)
+        cls.other = create_account(200802)
+
+    def ledger_balance(self, account):
+        return Transaction.objects.filter(account=account).aggregate(total=Sum(ledger_delta()))['total']
+
+    def test_concurrent_submissions_are_committed_as_one_batch(self):
+        posting_queue = PostingQueue(max_batch_size=10, max_wait_ms=500)
+        batches = []
+
+        def commit(batch):
+            batches.append(len(batch))
+            for posting in batch:
+                posting.future.set_result(posting.amount)
+
+        posting_queue.commit = commit
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            results = list(pool.map(
+                lambda amount: posting_queue.submit(self.account.pk, Decimal(amount), DEPOSIT), range(1, 6)
+            ))
+        self.assertEqual(results, [Decimal(amount) for amount in range(1, 6)])
+        self.assertEqual(batches, [5])
+
+    def test_a_rejected_posting_does_not_fail_its_batch(self):
+        batch = [
+            Posting(self.account.pk, Decimal(50), DEPOSIT),
+            Posting(self.account.pk, Decimal(500), WITHDRAWAL),
+            Posting(self.other.pk, Decimal(10), DEPOSIT),
+            Posting(self.account.pk, Decimal(120), WITHDRAWAL),
+            Posting(0, Decimal(10), DEPOSIT),
+        ]
+        PostingQueue().commit(batch)
+
+        self.assertIn('Insufficient balance', str(batch[1].future.exception()))
+        self.assertEqual(str(batch[4].future.exception()), 'Account not found.')
+        rows = [batch[index].future.result() for index in (0, 2, 3)]
+        self.assertEqual(
+            [row.balance_after_transaction for row in rows], [Decimal(150), Decimal(10), Decimal(30)]
+        )
+        for account, balance in [(self.account, Decimal(30)), (self.other, Decimal(10))]:
+            self.assertEqual(UserBankAccount.objects.get(pk=account.pk).balance, balance)
+            # the fixture balance predates the ledger rows
+            self.assertEqual(self.ledger_balance(account) + account.balance, balance)
+
+    def test_unconfirmed_postings_are_reported_as_pending(self):
+        posting_queue = PostingQueue(timeout=0.05)
+        posting_queue.commit = lambda batch: None
+        with self.assertRaises(PostingPending):
+            posting_queue.submit(self.account.pk, Decimal(10), DEPOSIT)
+
+        self.client.force_login(self.account.user)
+        # the queue is bypassed inside the test transaction, fail the posting in the view instead
+        with mock.patch('transactions.views.post_transaction', side_effect=PostingPending):
+            response = self.client.post(reverse('deposit_money'), {'amount': '600', 'transaction_type': DEPOSIT})
+        self.assertRedirects(response, reverse('transaction_report'), fetch_redirect_response=False)
+        self.assertIn('still being processed', str(list(get_messages(response.wsgi_request))[0]))
+
+
+class CurrencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        ExchangeRate.objects.create(currency='EUR', rate=Decimal('1.08'))
+        cls.account = create_account(200601, balance=1000)
+        cls.euro_account = create_account(200602, currency='EUR')
+        cls.taka_account = create_account(200603, currency='BDT')
+
+    def setUp(self):
+        fx.refresh()
+        self.client.force_login(self.account.user)
+
+    def test_conversion_rounds_to_the_cent(self):
+        self.assertEqual(fx.convert(Decimal(10), 'EUR', 'USD'), Decimal('10.80'))
+        self.assertEqual(fx.convert(Decimal(10), 'USD', 'EUR'), Decimal('9.26'))
+        self.assertEqual(fx.convert(Decimal('0.01'), 'USD', 'EUR'), Decimal('0.01'))
+        self.assertEqual(fx.convert(Decimal('10.005'), 'USD', 'USD'), Decimal('10.005'))
+        with self.assertRaises(fx.UnknownCurrency):
+            fx.convert(Decimal(10), 'USD', 'BDT')
+        self.assertEqual(
+            fx.get_rates().convert_many([10, 10, Decimal('2.5')], ['EUR', 'USD', 'EUR'], 'USD').tolist(),
+            [10.8, 10.0, 2.7],
+        )
+
+    @override_settings(FX_SNAPSHOT_TTL=60)
+    def test_snapshot_reloads_after_its_ttl(self):
+        snapshot = fx.get_rates()
+        # a bulk update sends no signal, as if another process changed the rate
+        ExchangeRate.objects.filter(currency='EUR').update(rate=Decimal(2))
+        self.assertIs(fx.get_rates(), snapshot)
+        with mock.patch('transactions.fx.time.monotonic', return_value=snapshot.loaded_at + 61):
+            reloaded = fx.get_rates()
+        self.assertEqual(reloaded.version, snapshot.version + 1)
+        self.assertEqual(reloaded.rates['EUR'], Decimal(2))
+
+        # saving a rate refreshes this process right away
+        ExchangeRate.objects.create(currency='GBP', rate=Decimal('1.27'))
+        self.assertEqual(fx.get_rates().rates['GBP'], Decimal('1.27'))
+
+    def test_transfer_credits_the_converted_amount(self):
+        response = self.client.post(
+            reverse('transfer_money'), {'target_account_no': self.euro_account.account_no, 'amount': '100'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(UserBankAccount.objects.get(pk=self.account.pk).balance, Decimal(900))
+        self.assertEqual(UserBankAccount.objects.get(pk=self.euro_account.pk).balance, Decimal('92.59'))
+        credit = Transaction.objects.get(account=self.euro_account)
+        self.assertEqual((credit.amount, credit.balance_after_transaction), (Decimal('92.59'), Decimal('92.59')))
+        self.assertEqual(Transaction.objects.get(account=self.account).amount, Decimal(-100))
+
+    def test_only_currencies_with_a_rate_are_offered(self):
+        self.assertEqual(
+            [code for code, _ in UserRegistrationForm().fields['currency'].choices], ['USD', 'EUR']
+        )
+
+    def test_transfers_without_a_rate_are_form_errors(self):
+        data = {'target_account_no': self.taka_account.account_no, 'amount': '10'}
+        response = self.client.post(reverse('transfer_money'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], None, 'Transfers from USD to BDT are not available.')
+
+        payroll = SimpleUploadedFile('payroll.csv', f'{self.taka_account.account_no},10\n'.encode())
+        response = self.client.post(reverse('payroll_transfer'), {'payroll_file': payroll})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], 'payroll_file', 'No exchange rate for BDT')
+        self.assertEqual(UserBankAccount.objects.get(pk=self.account.pk).balance, Decimal(1000))
+
+
+class DigestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscribers = [create_account(200001 + number, notifications=DIGEST) for number in range(3)]
+        cls.instant = create_account(200010)
+        for account in cls.subscribers + [cls.instant]:
+            for amount in (500, 200):
+                post_transaction(account, Decimal(amount), DEPOSIT)
+
+    def test_digest_subscribers_get_no_instant_email(self):
+        self.client.force_login(self.subscribers[1].user)
+        self.client.post(reverse('deposit_money'), {'amount': '500'})
+        self.assertEqual(mail.outbox, [])
+
+    def test_day_is_grouped_in_two_queries_and_sent_in_batches(self):
+        with self.assertNumQueries(2):
+            digests = collect_digests(timezone.localdate())
+        self.assertEqual([digest.account.pk for digest in digests], [account.pk for account in self.subscribers])
+        self.assertEqual(len(digests[0].transactions), 2)
+        self.assertEqual(digests[0].totals(), {'money_in': Decimal(700), 'money_out': Decimal(0)})
+
+        self.assertEqual(send_digests(digests, batch_size=2), 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, [self.subscribers[0].user.email])
+        self.assertIn(f'Closing balance {digests[0].closing_balance}', mail.outbox[0].alternatives[0][0])
+
+
+class LiveFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = create_account(200101, balance=1000)
+
+    async def test_stream_pushes_committed_postings(self):
+        await self.async_client.aforce_login(self.account.user)
+        response = await self.async_client.get(reverse('balance_feed'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertIn(f'"balance": "{self.account.balance:.2f}"'.encode(), await anext(stream))
+
+        channel = live.account_channel(self.account.pk)
+        self.assertEqual(live.get_broker().subscriber_count(channel), 1)
+
+        def deposit():
+            # the posting commits on the database thread, the stream runs on the event loop
+            with self.captureOnCommitCallbacks(execute=True):
+                return post_transaction(self.account, Decimal(500), DEPOSIT)
+
+        row = await sync_to_async(deposit)()
+        event = await anext(stream)
+        self.assertTrue(event.startswith(b'event: transaction\n'))
+        self.assertIn(f'"balance_after": "{row.balance_after_transaction}"'.encode(), event)
+
+        await response.streaming_content.aclose()
+
+
+class StandingOrderSchedulerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.target = create_account(200301)
+        cls.payers = [create_account(200302 + number, balance=100) for number in range(10)]
+        cls.due_at = timezone.now() - timedelta(minutes=1)
+        cls.orders = StandingOrder.objects.bulk_create([
+            StandingOrder(
+                account_no=payer.account_no, target_account_no=cls.target.account_no,
+                amount=Decimal(10), recurrence=WEEKLY, next_run_at=cls.due_at,
+            )
+            for payer in cls.payers
+        ])
+
+    def test_workers_claim_disjoint_batches(self):
+        first = claim_due_orders('worker-1', batch_size=6)
+        second = claim_due_orders('worker-2', batch_size=6)
+        self.assertEqual(len(first), 6)
+        self.assertEqual(len(second), 4)
+        self.assertFalse({order.pk for order in first} & {order.pk for order in second})
+        self.assertEqual(claim_due_orders('worker-3'), [])
+
+        # an expired lease is claimed again, and its old holder can no longer post
+        later = timezone.now() + timedelta(seconds=301)
+        reclaimed = claim_due_orders('worker-3', now=later)
+        self.assertEqual(len(reclaimed), 10)
+        self.assertEqual(execute_order(first[0], 'worker-1', now=later), 'lost')
+
+    def test_every_due_order_is_posted_once(self):
+        self.assertEqual(run_due_orders(batch_size=3), {'posted': 10, 'rejected': 0, 'pending': 0, 'failed': 0, 'lost': 0})
+        self.assertEqual(run_due_orders(batch_size=3), {'posted': 0, 'rejected': 0, 'pending': 0, 'failed': 0, 'lost': 0})
+
+        self.assertEqual(UserBankAccount.objects.get(pk=self.target.pk).balance, Decimal(100))
+        for payer in self.payers:
+            self.assertEqual(UserBankAccount.objects.get(pk=payer.pk).balance, Decimal(90))
+        for order in StandingOrder.objects.all():
+            self.assertEqual(order.next_run_at, self.due_at + timedelta(weeks=1))
+            self.assertEqual(order.claimed_by, '')
+
+    def test_transfers_are_logged_on_the_order_before_money_moves(self):
+        order = claim_due_orders('worker-1', batch_size=1)[0]
+        with mock.patch('transactions.standing_orders.run_transfer', side_effect=RuntimeError('worker died')):
+            with self.assertRaises(RuntimeError):
+                execute_order(order, 'worker-1')
+        order.refresh_from_db()
+        self.assertEqual(order.next_run_at, self.due_at + timedelta(weeks=1))
+        transfer = ShardTransfer.objects.get(reference=order.transfer_reference)
+        self.assertEqual(transfer.status, PENDING)
+
+        # the period is not posted again; recovery aborts the transfer nothing debited
+        self.assertEqual(run_due_orders(), {'posted': 9, 'rejected': 0, 'pending': 0, 'failed': 0, 'lost': 0})
+        self.assertFalse(recover_transfer(transfer))
+        self.assertEqual(UserBankAccount.objects.get(pk=self.target.pk).balance, Decimal(90))
+
+    def test_short_balance_skips_the_period(self):
+        StandingOrder.objects.filter(pk=self.orders[0].pk).update(amount=Decimal(101))
+        self.assertEqual(run_due_orders(), {'posted': 9, 'rejected': 1, 'pending': 0, 'failed': 0, 'lost': 0})
+        order = StandingOrder.objects.get(pk=self.orders[0].pk)
+        self.assertIn('Insufficient balance', order.last_error)
+        self.assertEqual(order.next_run_at, self.due_at + timedelta(weeks=1))
+
+    def test_failing_orders_do_not_stop_the_batch(self):
+        failures = {
+            self.payers[0].account_no: DatabaseError('ledger_1 is unavailable'),
+            self.payers[1].account_no: UserBankAccount.DoesNotExist(),
+            self.payers[2].account_no: PostingPending(),
+        }
+
+        def run_or_fail(transfer):
+            if transfer.source_account_no in failures:
+                raise failures[transfer.source_account_no]
+            return run_transfer(transfer)
+
+        with mock.patch('transactions.standing_orders.run_transfer', side_effect=run_or_fail):
+            with self.assertLogs('transactions.standing_orders', 'ERROR'):
+                counts = run_due_orders(batch_size=10)
+        self.assertEqual(counts, {'posted': 7, 'rejected': 1, 'pending': 1, 'failed': 1, 'lost': 0})
+        self.assertEqual(UserBankAccount.objects.get(pk=self.target.pk).balance, Decimal(70))
+
+        errors = dict(StandingOrder.objects.values_list('account_no', 'last_error'))
+        self.assertEqual(errors[self.payers[0].account_no], 'ledger_1 is unavailable')
+        self.assertEqual(errors[self.payers[1].account_no], 'Account not found.')
+        self.assertEqual(errors[self.payers[2].account_no], 'The posting is still being processed.')
+        # every claim is released and every order moved to its next period
+        self.assertFalse(StandingOrder.objects.exclude(claimed_by='').exists())
+        self.assertFalse(StandingOrder.objects.filter(next_run_at=self.due_at).exists())
+
+    def test_missed_periods_are_skipped(self):
+        StandingOrder.objects.update(next_run_at=self.due_at - timedelta(weeks=5))
+        self.assertEqual(run_due_orders(), {'posted': 10, 'rejected': 0, 'pending': 0, 'failed': 0, 'lost': 0})
+        self.assertEqual(UserBankAccount.objects.get(pk=self.target.pk).balance, Decimal(100))
+        for order in StandingOrder.objects.all():
+            self.assertEqual(order.next_run_at, self.due_at + timedelta(weeks=1))
+
+    def test_monthly_orders_keep_their_anchor_day(self):
+        order = StandingOrder(recurrence=MONTHLY, next_run_at=timezone.make_aware(datetime(2026, 1, 31, 9)))
+        order.anchor_day = 31
+        runs = []
+        for _ in range(3):
+            order.next_run_at = next_run(order, order.next_run_at)
+            runs.append(order.next_run_at.date())
+        self.assertEqual(runs, [date(2026, 2, 28), date(2026, 3, 31), date(2026, 4, 30)])
+
+    def test_first_payment_cannot_be_in_the_past(self):
+        data = {'target_account_no': self.target.account_no, 'amount': '10', 'recurrence': WEEKLY}
+        for days, valid in [(-1, False), (1, True)]:
+            form = StandingOrderForm(
+                {**data, 'next_run_at': timezone.localtime() + timedelta(days=days)}, account=self.payers[0]
+            )
+            self.assertEqual(form.is_valid(), valid, form.errors)
+
+
+class BalanceCheckpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = create_account(200401)
+        cls.start = timezone.make_aware(datetime(2026, 3, 1, 9))
+        cls.rows = []
+        for hour, kind, amount in [(8 * i, DEPOSIT, 100) for i in range(12)] + [
+            (8 * i + 1, WITHDRAWAL, 30) for i in range(1, 12, 2)
+        ] + [(20, LOAN, 1000), (50, TRANSFER, -25), (50, DEPOSIT, 5)]:
+            row = Transaction.objects.create(
+                account=cls.account, amount=Decimal(amount), transaction_type=kind, balance_after_transaction=0,
+            )
+            Transaction.objects.filter(pk=row.pk).update(timestamp=cls.start + timedelta(hours=hour))
+            cls.rows.append(Transaction.objects.get(pk=row.pk))
+
+    def expected(self, ts):
+        deltas = {WITHDRAWAL: -1}
+        return sum(
+            (
+                row.amount * deltas.get(row.transaction_type, 1) for row in self.rows
+                if row.timestamp < ts and (row.transaction_type != LOAN or row.loan_approve)
+            ),
+            Decimal(0),
+        )
+
+    def assertBalancesMatch(self):
+        for hours in range(-2, 100, 3):
+            ts = self.start + timedelta(hours=hours)
+            with self.assertNumQueries(2):
+                self.assertEqual(account_balance_at(self.account, ts), self.expected(ts), ts)
+
+    def test_checkpoints_keep_point_in_time_balances(self):
+        self.assertBalancesMatch()
+        until = self.start + timedelta(days=10)
+        written = write_checkpoints(until=until, every=3)
+        self.assertGreater(written, 3)
+        self.assertBalancesMatch()
+        # a later run only looks at rows after the latest checkpoint
+        self.assertEqual(write_checkpoints(until=until, every=3), 0)
+
+        loan = next(row for row in self.rows if row.transaction_type == LOAN)
+        approve_loan(loan)
+        loan.refresh_from_db()
+        self.rows = [loan if row.pk == loan.pk else row for row in self.rows]
+        self.assertFalse(BalanceCheckpoint.objects.filter(account=self.account, as_of__gt=loan.timestamp).exists())
+        self.assertBalancesMatch()
+        self.assertGreater(write_checkpoints(until=until, every=3), 0)
+        self.assertBalancesMatch()
+
+    def test_report_shows_opening_and_closing_balance(self):
+        self.client.force_login(self.account.user)
+        write_checkpoints(until=self.start + timedelta(days=10), every=3)
+        response = self.client.get(reverse('transaction_report'), {'start_date': '2026-03-02', 'end_date': '2026-03-02'})
+        day = timezone.make_aware(datetime(2026, 3, 2))
+        self.assertEqual(response.context['opening_balance'], self.expected(day))
+        self.assertEqual(response.context['current_balance'], self.expected(day + timedelta(days=1)))
+        self.assertContains(response, 'Opening Balance')
+        self.assertNotContains(response, 'data-live-total')
+
+
+@override_settings(LOAN_ANNUAL_INTEREST_RATE=0.12, LOAN_TERM_MONTHS=12)
+class LoanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = create_account(200901, balance=5000)
+
+    def request_loan(self, amount='1000', approve=True):
+        loan = Transaction.objects.create(
+            account=self.account, amount=Decimal(amount), transaction_type=LOAN,
+            balance_after_transaction=self.account.balance,
+        )
+        return approve_loan(loan) if approve else loan
+
+    def test_schedule_repays_the_principal_with_level_payments(self):
+        principal, interest = amortization_schedule('1000', 0.12, 12)
+        self.assertEqual(principal.sum(), 100000)
+        # one month of 12% a year on the whole loan
+        self.assertEqual(interest[0], 1000)
+        self.assertEqual(set((principal + interest)[:-1]), {8885})
+        self.assertLessEqual(abs(principal[-1] + interest[-1] - 8885), 1)
+        self.assertTrue((interest[1:] < interest[:-1]).all())
+
+    def test_interest_free_schedule_splits_the_principal(self):
+        principal, interest = amortization_schedule('100', 0, 3)
+        self.assertEqual(principal.tolist(), [3333, 3333, 3334])
+        self.assertEqual(interest.tolist(), [0, 0, 0])
+
+    def test_term_is_capped_at_one_installment_per_cent(self):
+        principal, interest = amortization_schedule('0.05', 0, 12)
+        self.assertEqual(principal.tolist(), [1, 1, 1, 1, 1])
+        self.assertEqual(interest.sum(), 0)
+
+    def test_approval_writes_the_schedule(self):
+        loan = self.request_loan()
+        installments = LoanInstallment.objects.filter(loan=loan)
+        self.assertEqual(installments.count(), 12)
+        self.assertEqual(installments.aggregate(total=Sum('principal'))['total'], Decimal('1000.00'))
+
+    def test_viewing_a_legacy_loan_does_not_write_a_schedule(self):
+        loan = self.request_loan(approve=False)
+        Transaction.objects.filter(pk=loan.pk).update(loan_approve=True)
+        self.client.force_login(self.account.user)
+        response = self.client.get(reverse('pay', args=[loan.pk]))
+        self.assertContains(response, 'Repayable in one installment')
+        self.assertFalse(LoanInstallment.objects.filter(loan=loan).exists())
+
+        loan.refresh_from_db()
+        pay_loan(loan)
+        self.assertEqual(list(LoanInstallment.objects.filter(loan=loan).values_list('status', flat=True)), [PAID])
+
+    def test_partial_payment_goes_to_the_oldest_installment(self):
+        loan = self.request_loan()
+        payment = pay_loan(loan, '50')
+        self.assertEqual(payment.amount, Decimal(50))
+        first, second = LoanInstallment.objects.filter(loan=loan).order_by('number')[:2]
+        self.assertEqual((first.amount_paid, first.status), (Decimal(50), SCHEDULED))
+        self.assertEqual(second.amount_paid, Decimal(0))
+        self.assertEqual(UserBankAccount.objects.get(pk=self.account.pk).balance, Decimal(5950))
+
+    def test_over_payment_is_capped_at_the_outstanding_amount(self):
+        loan = self.request_loan()
+        outstanding = sum(installment.amount_due for installment in LoanInstallment.objects.filter(loan=loan))
+        payment = pay_loan(loan, '100000')
+        self.assertEqual(payment.amount, outstanding)
+        self.assertFalse(LoanInstallment.objects.filter(loan=loan).exclude(status=PAID).exists())
+        self.assertEqual(UserBankAccount.objects.get(pk=self.account.pk).balance, 6000 - outstanding)
+        self.assertIsNone(pay_loan(loan, '10'))
+
+
+class TransactionAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = create_account(200701, balance=1000)
+        cls.staff = User.objects.create(username='staff', is_staff=True, is_superuser=True)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def save(self, row=None, **data):
+        url = (
+            reverse('admin:transactions_transaction_change', args=[row.pk]) if row
+            else reverse('admin:transactions_transaction_add')
+        )
+        data = {'account': self.account.pk, 'balance_after_transaction': '0', **data}
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+
+    def balance(self):
+        return UserBankAccount.objects.get(pk=self.account.pk).balance
+
+    def test_rows_move_the_balance_when_added_only(self):
+        self.save(amount='200', transaction_type=WITHDRAWAL)
+        self.assertEqual(self.balance(), Decimal(800))
+        row = Transaction.objects.get(account=self.account)
+        self.assertEqual(row.balance_after_transaction, Decimal(800))
+
+        self.save(row, amount='250', transaction_type=WITHDRAWAL, balance_after_transaction='800')
+        self.assertEqual(self.balance(), Decimal(800))
+        self.assertEqual(Transaction.objects.get(pk=row.pk).amount, Decimal(250))
+        self.assertEqual(mail.outbox, [])
+
+    def test_only_loan_approval_credits_and_emails(self):
+        self.save(amount='500', transaction_type=LOAN)
+        loan = Transaction.objects.get(account=self.account)
+        self.assertEqual(self.balance(), Decimal(1000))
+
+        self.save(loan, amount='500', transaction_type=LOAN, loan_approve='on')
+        self.save(loan, amount='500', transaction_type=LOAN, loan_approve='on', balance_after_transaction='1500')
+        self.assertEqual(self.balance(), Decimal(1500))
+        self.assertEqual([message.subject for message in mail.outbox], ['Loan Approval'])
+
+
+class IdempotencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = create_account(200501, balance=1000)
+        cls.target = create_account(200502)
+
+    def setUp(self):
+        idempotency.get_cache().clear()
+        self.client.force_login(self.account.user)
+
+    def deposit(self, amount, key='retry-1'):
+        return self.client.post(reverse('deposit_money'), {'amount': amount}, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_returns_the_stored_result_once_posted(self):
+        rows = Transaction.objects.filter(account=self.account).count()
+        first = self.deposit(100)
+        self.assertEqual(first.status_code, 302)
+
+        # a retry on this process, then one on a process that never saw the key
+        for cached, queries in [(True, 2), (False, 3)]:
+            if not cached:
+                idempotency.get_cache().clear()
+            with self.assertNumQueries(queries):
+                replay = self.deposit(100)
+            self.assertEqual((replay.status_code, replay['Location']), (302, first['Location']))
+            self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), rows + 1)
+
+        self.assertEqual(self.deposit(250).status_code, 422)
+
+    def test_form_fields_and_transfers(self):
+        page = self.client.get(reverse('transfer_money'))
+        key = page.content.decode().split('name="idempotency_key" value="')[1][:32]
+        data = {'target_account_no': self.target.account_no, 'amount': '10', 'idempotency_key': key}
+        for _ in range(2):
+            self.assertEqual(self.client.post(reverse('transfer_money'), data).status_code, 302)
+        self.assertEqual(UserBankAccount.objects.get(pk=self.target.pk).balance, Decimal(10))
+
+    def test_rejected_request_frees_the_key(self):
+        response = self.client.post(reverse('withdraw_money'), {'amount': 10 ** 7}, HTTP_IDEMPOTENCY_KEY='w-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(IdempotencyKey.objects.filter(key='w-1').exists())
+        response = self.client.post(reverse('withdraw_money'), {'amount': 500}, HTTP_IDEMPOTENCY_KEY='w-1')
+        self.assertEqual(response.status_code, 302)
+
+    def test_in_progress_and_expired_keys(self):
+        now = timezone.now()
+        request = RequestFactory().post(reverse('deposit_money'), {'amount': 100})
+        claim = IdempotencyKey.objects.create(
+            user=self.account.user, key='retry-1', fingerprint=idempotency.request_fingerprint(request),
+            expires_at=now + timedelta(minutes=1),
+        )
+        self.assertEqual(self.deposit(100).status_code, 409)
+
+        IdempotencyKey.objects.filter(pk=claim.pk).update(expires_at=now - timedelta(seconds=1))
+        self.assertEqual(self.deposit(100).status_code, 302)
+        IdempotencyKey.objects.update(expires_at=now - timedelta(seconds=1))
+        self.assertEqual(idempotency.sweep(batch_size=1), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_claims_are_leased_until_answered(self):
+        now = timezone.now()
+        claim = idempotency._claim(self.account.user.pk, 'lease-1', 'fingerprint', now)
+        self.assertEqual(claim.expires_at, now + timedelta(seconds=120))
+        idempotency._store(claim, 302, '/done/')
+        self.assertGreater(IdempotencyKey.objects.get(pk=claim.pk).expires_at, now + timedelta(hours=23))
+
+    def claim_form_key(self, key):
+        request = RequestFactory().post(reverse('deposit_money'), {'amount': 100, 'idempotency_key': key})
+        return IdempotencyKey.objects.create(
+            user=self.account.user, key=key, fingerprint=idempotency.request_fingerprint(request),
+            expires_at=timezone.now() + timedelta(minutes=1),
+        )
+
+    @override_settings(IDEMPOTENCY={'FORM_WAIT_SECONDS': 0.2})
+    def test_double_click_redirects_while_the_first_runs(self):
+        self.claim_form_key('form-1')
+        response = self.client.post(reverse('deposit_money'), {'amount': 100, 'idempotency_key': 'form-1'})
+        self.assertRedirects(response, reverse('transaction_report'), fetch_redirect_response=False)
+        self.assertIn('still being processed', str(list(get_messages(response.wsgi_request))[0]))
+        self.assertFalse(Transaction.objects.filter(account=self.account).exists())
+
+    def test_double_click_replays_the_first_answer(self):
+        claim = self.claim_form_key('form-2')
+        with mock.patch('core.idempotency.time.sleep', side_effect=lambda _: idempotency._store(claim, 302, '/done/')):
+            response = self.client.post(reverse('deposit_money'), {'amount': 100, 'idempotency_key': 'form-2'})
+        self.assertEqual((response.status_code, response['Location']), (302, '/done/'))
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertFalse(Transaction.objects.filter(account=self.account).exists())
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import DepositMoneyView, WithdrawMoneyView, TransactionReportView, LoanRequestView, LoanListView, PayLoanView, TransferMoneyView
+from .views import DepositMoneyView, WithdrawMoneyView, TransactionReportView, LoanRequestView, LoanListView, PayLoanView, TransferMoneyView, PayrollTransferView, StandingOrderView, CancelStandingOrderView, AnalyticsDashboardView, balance_feed
 
 urlpatterns = [
     path("deposit/", DepositMoneyView.as_view(), name="deposit_money"),
@@ -8,5 +8,10 @@ urlpatterns = [
     path("loan_request/", LoanRequestView.as_view(), name="loan_request"),
     path("loans/", LoanListView.as_view(), name="loan_list"),
     path("loans/<int:loan_id>/", PayLoanView.as_view(), name="pay"),
-    path("transfer/", TransferMoneyView.as_view(), name="transfer_money")
+    path("transfer/", TransferMoneyView.as_view(), name="transfer_money"),
+    path("payroll/", PayrollTransferView.as_view(), name="payroll_transfer"),
+    path("standing-orders/", StandingOrderView.as_view(), name="standing_orders"),
+    path("standing-orders/<int:order_id>/cancel/", CancelStandingOrderView.as_view(), name="cancel_standing_order"),
+    path("analytics/", AnalyticsDashboardView.as_view(), name="bank_analytics"),
+    path("live/", balance_feed, name="balance_feed"),
 ]
\ No newline at end of file
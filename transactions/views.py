@@ -1,39 +1,65 @@
+import logging
+
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.views.generic import CreateView, ListView, View
-from .models import Transaction
-from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.http import HttpResponseRedirect
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.views.generic import CreateView, FormView, ListView, TemplateView, View
+from .models import Transaction, StandingOrder
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy
-from .constants import DEPOSIT, LOAN, LOAN_PAID, WITHDRAWAL, TRANSFER
+from .constants import DEPOSIT, LOAN, WITHDRAWAL
+from accounts.constants import INSTANT
 from django.contrib import messages
 from .forms import(
     DepositForm,
     withdrawForm, 
     LoanRequestForm,
     TransferForm,
+    LoanPaymentForm,
+    PayrollForm,
+    StandingOrderForm,
 )
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from datetime import datetime
-from django.db.models import Sum
-
+from django.db.models import Count, DecimalField, F, Q, Sum
+from .posting import post_payroll, post_transaction, post_transfer, PostingPending, PostingRejected
+from . import live
+from accounts.models import UserBankAccount
+from .fx import UnknownCurrency, format_money, get_rates
+from .loans import OPEN_STATUSES, pay_loan
+from .balances import account_balance_at
+from .digest import day_window
+from core.idempotency import IdempotentPostMixin
+
+logger = logging.getLogger(__name__)
+
+
+def send_transaction_email(user, amount, subject, template, recipient_email=None, recipient_name=None,
+                           recipient_amount=None, recipient_currency=None):
+    # imported here so workers only load the mail stack once they send
+    from django.core.mail import EmailMultiAlternatives
+
+    currency = user.account.currency
+    # digest subscribers hear about it in the next daily digest instead
+    if user.account.notifications == INSTANT:
+        message = render_to_string(template, {
+            'user': user,
+            'amount': amount,
+            'currency': currency,
+        })
 
-def send_transaction_email(user, amount, subject, template, recipient_email=None, recipient_name=None):
-    message = render_to_string(template, {
-        'user': user,
-        'amount': amount,
-    })
-    
-   
-    send_email = EmailMultiAlternatives(subject, '', to=[user.email])
-    send_email.attach_alternative(message, "text/html")
-    send_email.send()
+        send_email = EmailMultiAlternatives(subject, '', to=[user.email])
+        send_email.attach_alternative(message, "text/html")
+        send_email.send()
 
     if recipient_email:
         recipient_message = render_to_string('transactions/recipient_email.html', {
             'user': user,
             'recipient_name': recipient_name,
-            'amount': amount,
+            'amount': amount if recipient_amount is None else recipient_amount,
+            'currency': recipient_currency or currency,
         })
 
         recipient_subject = "You've received a transfer"
@@ -42,6 +68,57 @@ def send_transaction_email(user, amount, subject, template, recipient_email=None
         send_recipient_email.send()
 
 
+RECIPIENT_EMAIL_BATCH_SIZE = 100
+_recipient_mailer = None
+
+
+def queue_recipient_emails(user, credits):
+    """Tell the recipients of ``credits`` about their money in the background.
+
+    Owners are loaded with one query; the emails are rendered and sent by a
+    single mail thread over one connection, so a payroll returns as soon as
+    it is posted.
+    """
+    global _recipient_mailer
+    from django.contrib.auth.models import User
+
+    owners = User.objects.in_bulk({credit.account.user_id for credit in credits})
+    emails = []
+    for credit in credits:
+        owner = owners.get(credit.account.user_id)
+        if owner is not None and owner.email and credit.account.notifications == INSTANT:
+            emails.append((owner, credit.amount, credit.account.currency))
+    if not emails:
+        return None
+    if _recipient_mailer is None:
+        from concurrent.futures import ThreadPoolExecutor
+
+        _recipient_mailer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recipient-mailer')
+    return _recipient_mailer.submit(_send_recipient_emails, user, emails)
+
+
+def _send_recipient_emails(user, emails):
+    from django.core.mail import EmailMultiAlternatives, get_connection
+
+    try:
+        with get_connection() as connection:
+            for start in range(0, len(emails), RECIPIENT_EMAIL_BATCH_SIZE):
+                batch = []
+                for recipient, amount, currency in emails[start:start + RECIPIENT_EMAIL_BATCH_SIZE]:
+                    message = render_to_string('transactions/recipient_email.html', {
+                        'user': user,
+                        'recipient_name': recipient.get_full_name(),
+                        'amount': amount,
+                        'currency': currency,
+                    })
+                    email = EmailMultiAlternatives("You've received a transfer", '', to=[recipient.email])
+                    email.attach_alternative(message, "text/html")
+                    batch.append(email)
+                connection.send_messages(batch)
+    except Exception:
+        logger.exception('Could not send %s transfer emails from %s', len(emails), user)
+
+
 class TransactionCreateMixin(LoginRequiredMixin, CreateView):
     template_name = 'transactions/transaction_form.html'
     model = Transaction
@@ -62,9 +139,31 @@ class TransactionCreateMixin(LoginRequiredMixin, CreateView):
         })
         return context
 
+    def post(self, request, *args, **kwargs):
+        try:
+            return super().post(request, *args, **kwargs)
+        except PostingPending:
+            # it may still be applied, so a retry could post it twice
+            messages.warning(
+                request,
+                'Your transaction is still being processed. Check your transaction report before trying again.'
+            )
+            return redirect(self.success_url)
+
+    def post_to_ledger(self, form, transaction_type):
+        # the posting writes the ledger row itself, so the form is not saved
+        try:
+            self.object = post_transaction(
+                self.request.user.account, form.cleaned_data.get('amount'), transaction_type
+            )
+        except PostingRejected as exc:
+            form.add_error('amount', str(exc))
+            return None
+        return self.object
+
     
     
-class DepositMoneyView(TransactionCreateMixin):
+class DepositMoneyView(IdempotentPostMixin, TransactionCreateMixin):
     form_class = DepositForm 
     title = 'Deposit'
     
@@ -74,20 +173,17 @@ class DepositMoneyView(TransactionCreateMixin):
     
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
-        account = self.request.user.account
-        account.balance += amount
-        account.save(
-            update_fields=['balance']
-        )
+        if self.post_to_ledger(form, DEPOSIT) is None:
+            return self.form_invalid(form)
         messages.success(
             self.request,
-            f'{"{:,.2f}".format(float(amount))}$ was deposited to your account successfully'
+            f'{format_money(amount, self.request.user.account.currency)} was deposited to your account successfully'
         )
         send_transaction_email(self.request.user, amount, "Deposit Message", 'transactions/deposit_email.html')
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 
-class WithdrawMoneyView(TransactionCreateMixin):
+class WithdrawMoneyView(IdempotentPostMixin, TransactionCreateMixin):
     form_class = withdrawForm
     title = 'Withdraw Money'
     
@@ -97,15 +193,15 @@ class WithdrawMoneyView(TransactionCreateMixin):
     
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
-        self.request.user.account.balance -= form.cleaned_data.get('amount')
-        self.request.user.account.save(update_fields=['balance'])
-        
+        if self.post_to_ledger(form, WITHDRAWAL) is None:
+            return self.form_invalid(form)
+
         messages.success(
             self.request,
-            f'Successfully withdrawn {"{:,.2f}".format(float(amount))}$ from your account'
+            f'Successfully withdrawn {format_money(amount, self.request.user.account.currency)} from your account'
         )
         send_transaction_email(self.request.user, amount, "Withdraw Message", 'transactions/withdraw_email.html')
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 class LoanRequestView(TransactionCreateMixin):
     form_class = LoanRequestForm
@@ -117,8 +213,9 @@ class LoanRequestView(TransactionCreateMixin):
 
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
-        current_loan_count = Transaction.objects.filter(
-            account=self.request.user.account,transaction_type=3).count()
+        account = self.request.user.account
+        current_loan_count = Transaction.objects.using(account._state.db).filter(
+            account=account,transaction_type=3).count()
         print(current_loan_count)
         if current_loan_count >= 3:
             return HttpResponse("You have cross the loan limits")
@@ -126,7 +223,7 @@ class LoanRequestView(TransactionCreateMixin):
         
         messages.success(
             self.request,
-            f'Loan request for {"{:,.2f}".format(float(amount))}$ submitted successfully'
+            f'Loan request for {format_money(amount, self.request.user.account.currency)} submitted successfully'
         )
         send_transaction_email(self.request.user, amount, "Loan Request Message", 'transactions/loanRequest_email.html')
         return super().form_valid(form)
@@ -135,11 +232,13 @@ class LoanRequestView(TransactionCreateMixin):
 class TransactionReportView(LoginRequiredMixin, ListView):
     template_name = 'transactions/transaction_report.html'
     model = Transaction
-    balance = 0 
-    
+    opening_balance = None
+    closing_balance = None
+
     def get_queryset(self):
-        queryset = super().get_queryset().filter(
-            account=self.request.user.account
+        account = self.request.user.account
+        queryset = super().get_queryset().using(account._state.db).filter(
+            account=account
         )
         start_date_str = self.request.GET.get('start_date')
         end_date_str = self.request.GET.get('end_date')
@@ -149,50 +248,103 @@ class TransactionReportView(LoginRequiredMixin, ListView):
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
             
             queryset = queryset.filter(timestamp__date__gte=start_date, timestamp__date__lte=end_date)
-            self.balance = Transaction.objects.filter(
-                timestamp__date__gte=start_date, timestamp__date__lte=end_date
-            ).aggregate(Sum('amount'))['amount__sum']
+            # from the nearest balance checkpoints, however long the history
+            self.opening_balance = account_balance_at(account, day_window(start_date)[0])
+            self.closing_balance = account_balance_at(account, day_window(end_date)[1])
         else:
-            self.balance = self.request.user.account.balance
+            self.closing_balance = account.balance
        
         return queryset.distinct() 
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        account = self.request.user.account
+        display_currency = self.request.GET.get('currency') or account.currency
+        rates = get_rates()
+        if display_currency not in rates.rates:
+            display_currency = account.currency
+
+        transactions = list(context['object_list'])
+        opening_balance, closing_balance = self.opening_balance, self.closing_balance
+        if display_currency == account.currency:
+            amounts = [transaction.amount for transaction in transactions]
+            balances = [transaction.balance_after_transaction for transaction in transactions]
+        else:
+            currencies = [account.currency] * len(transactions)
+            amounts = rates.convert_many([t.amount for t in transactions], currencies, display_currency)
+            balances = rates.convert_many(
+                [t.balance_after_transaction for t in transactions], currencies, display_currency
+            )
+            closing_balance = rates.convert(closing_balance, account.currency, display_currency)
+            if opening_balance is not None:
+                opening_balance = rates.convert(opening_balance, account.currency, display_currency)
+        for transaction, amount, balance in zip(transactions, amounts, balances):
+            transaction.display_amount = amount
+            transaction.display_balance = balance
+
         context.update({
-            'account': self.request.user.account
+            'account': account,
+            'object_list': transactions,
+            'display_currency': display_currency,
+            'currencies': sorted(rates.rates),
+            'opening_balance': opening_balance,
+            'current_balance': closing_balance,
         })
 
         return context
 
 class PayLoanView(LoginRequiredMixin, View):
-    def get(self, request, loan_id):
-        loan = get_object_or_404(Transaction, id=loan_id)
-        if loan.transaction_type == LOAN and loan.loan_approve:
-            user_account = loan.account
+    template_name = 'transactions/loan_schedule.html'
 
-            if loan.amount <= user_account.balance:
-                user_account.balance -= loan.amount
-                user_account.save()
-                loan.loan_approve = False
-                loan.transaction_type = LOAN_PAID
-                loan.save() 
+    def get_loan(self, request, loan_id):
+        account = request.user.account
+        return get_object_or_404(
+            Transaction.objects.using(account._state.db).select_related('account'),
+            id=loan_id, account=account, transaction_type=LOAN,
+        )
 
-                messages.success(
-                    self.request,
-                    f'Loan of {"{:,.2f}".format(float(loan.amount))}$ paid successfully'
-                )
-            else:
+    def render_schedule(self, request, loan, form):
+        # approve_loan writes the schedule, a GET never does
+        context = {
+            'title': f'Loan {loan.id}',
+            'loan': loan,
+            'installments': loan.installments.all(),
+            'form': form,
+        }
+        return render(request, self.template_name, context)
+
+    def get(self, request, loan_id):
+        loan = self.get_loan(request, loan_id)
+        return self.render_schedule(request, loan, LoanPaymentForm())
+
+    def post(self, request, loan_id):
+        loan = self.get_loan(request, loan_id)
+        form = LoanPaymentForm(request.POST)
+        if not form.is_valid():
+            return self.render_schedule(request, loan, form)
+
+        payment = None
+        if loan.loan_approve:
+            try:
+                payment = pay_loan(loan, form.cleaned_data.get('amount'))
+            except PostingRejected:
                 messages.error(
                     self.request,
                     f'Insufficient balance to pay the loan'
                 )
-        else:
+                return redirect('pay', loan_id=loan.id)
+
+        if payment is None:
             messages.error(
                 self.request,
                 'Loan is either already paid or not valid'
             )
-        return redirect('loan_list')
+        else:
+            messages.success(
+                self.request,
+                f'Loan payment of {format_money(payment.amount, self.request.user.account.currency)} paid successfully'
+            )
+        return redirect('pay', loan_id=loan.id)
 
 class LoanListView(LoginRequiredMixin, ListView):
     model = Transaction
@@ -201,13 +353,20 @@ class LoanListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         user_account = self.request.user.account
-        return Transaction.objects.filter(
+        return Transaction.objects.using(user_account._state.db).filter(
             account=user_account,
             transaction_type=LOAN,
+        ).annotate(
+            installment_count=Count('installments'),
+            outstanding=Sum(
+                F('installments__amount_due') - F('installments__amount_paid'),
+                filter=Q(installments__status__in=OPEN_STATUSES),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
         )
 
 
-class TransferMoneyView(LoginRequiredMixin, View):
+class TransferMoneyView(IdempotentPostMixin, LoginRequiredMixin, View):
     template_name = 'transactions/transfer_form.html'
     success_url = reverse_lazy('transaction_report')
     
@@ -227,49 +386,31 @@ class TransferMoneyView(LoginRequiredMixin, View):
             amount = form.cleaned_data.get('amount')
             target_account = form.cleaned_data.get('target_account_no')
 
-            if request.user.account.balance >= amount:
-                request.user.account.balance -= amount
-                request.user.account.save(update_fields=['balance'])
-
-                target_account.balance += amount
-                target_account.save(update_fields=['balance'])
-
-                #sender transaction update
-                sender_transaction = form.save(commit=False)
-                sender_transaction.account = request.user.account
-                sender_transaction.transaction_type = TRANSFER
-                sender_transaction.amount = -amount
-                sender_transaction.balance_after_transaction = request.user.account.balance
-                sender_transaction.save()
-
-                #recipient transaction update
-                recipient_transaction = Transaction.objects.create(
-                    account=target_account,
-                    transaction_type=TRANSFER,
-                    amount=amount, 
-                    balance_after_transaction=target_account.balance, 
-                    timestamp=sender_transaction.timestamp 
-                )
-
+            account = request.user.account
+            try:
+                sender_transaction, recipient_transaction = post_transfer(account, target_account, amount)
+            except PostingRejected:
+                messages.error(request, 'Insufficient balance for the transfer.')
+            else:
                 #email send
                 send_transaction_email(
                     request.user, 
                     amount, 
                     "Transfer Confirmation", 
                     'transactions/transfer_email.html', 
-                    recipient_email=target_account.user.email, 
-                    recipient_name=target_account.user.get_full_name()
+                    recipient_email=target_account.user.email if target_account.notifications == INSTANT else None,
+                    recipient_name=target_account.user.get_full_name(),
+                    recipient_amount=recipient_transaction.amount,
+                    recipient_currency=target_account.currency,
                 )
 
                 # Show a success message
                 messages.success(
                     request,
-                    f'Successfully transferred {"{:,.2f}".format(float(amount))}$ to account {target_account.account_no}'
+                    f'Successfully transferred {format_money(amount, account.currency)} to account {target_account.account_no}'
                 )
 
                 return redirect(self.success_url)
-            else:
-                messages.error(request, 'Insufficient balance for the transfer.')
 
         context = {
             'form': form,
@@ -278,4 +419,113 @@ class TransferMoneyView(LoginRequiredMixin, View):
         return render(request, self.template_name, context)
 
 
-# Updated code
\ No newline at end of file
+class AnalyticsDashboardView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    template_name = 'transactions/analytics_dashboard.html'
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get_context_data(self, **kwargs):
+        # NumPy is only needed here, keep it out of worker startup
+        from .analytics import get_bank_analytics
+
+        context = super().get_context_data(**kwargs)
+        context.update({
+            'title': 'Bank Analytics',
+            'analytics': get_bank_analytics(),
+        })
+        return context
+
+
+# Updated code
+
+
+class PayrollTransferView(LoginRequiredMixin, FormView):
+    template_name = 'transactions/payroll_form.html'
+    form_class = PayrollForm
+    success_url = reverse_lazy('transaction_report')
+    extra_context = {'title': 'Pay Salaries'}
+
+    def form_valid(self, form):
+        lines = form.cleaned_data['payroll_file']
+        account = self.request.user.account
+        try:
+            credits = post_payroll(account, lines)
+        except (PostingRejected, UnknownCurrency) as exc:
+            form.add_error('payroll_file', str(exc))
+            return self.form_invalid(form)
+
+        total = sum(line.amount for line in lines)
+        send_transaction_email(self.request.user, total, "Payroll Confirmation", 'transactions/transfer_email.html')
+        queue_recipient_emails(self.request.user, credits)
+        messages.success(
+            self.request,
+            f'Paid {format_money(total, account.currency)} to {len(lines)} accounts'
+        )
+        return HttpResponseRedirect(self.get_success_url())
+
+
+class StandingOrderView(LoginRequiredMixin, View):
+    template_name = 'transactions/standing_orders.html'
+
+    def render_page(self, request, form):
+        orders = StandingOrder.objects.filter(account_no=request.user.account.account_no, active=True)
+        return render(request, self.template_name, {
+            'form': form,
+            'orders': orders,
+            'title': 'Standing Orders',
+        })
+
+    def get(self, request, *args, **kwargs):
+        return self.render_page(request, StandingOrderForm(account=request.user.account))
+
+    def post(self, request, *args, **kwargs):
+        form = StandingOrderForm(request.POST, account=request.user.account)
+        if not form.is_valid():
+            return self.render_page(request, form)
+        order = form.save()
+        messages.success(
+            request,
+            f'{order.get_recurrence_display()} transfer of {format_money(order.amount, request.user.account.currency)} '
+            f'to account {order.target_account_no} scheduled'
+        )
+        return redirect('standing_orders')
+
+
+class CancelStandingOrderView(LoginRequiredMixin, View):
+    def post(self, request, order_id, *args, **kwargs):
+        order = get_object_or_404(
+            StandingOrder, pk=order_id, account_no=request.user.account.account_no, active=True
+        )
+        order.active = False
+        order.save(update_fields=['active'])
+        messages.success(request, f'Standing order to account {order.target_account_no} cancelled')
+        return redirect('standing_orders')
+
+
+async def balance_feed(request):
+    """Server-sent events with the customer's balance and new transactions.
+
+    Streams only under ASGI; under WSGI it answers 204, which tells the
+    browser's EventSource not to reconnect.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    try:
+        account = await sync_to_async(getattr)(user, 'account')
+    except UserBankAccount.DoesNotExist:
+        return HttpResponse(status=204)
+
+    async def read_balance():
+        balance = await UserBankAccount.objects.using(account._state.db).filter(
+            pk=account.pk).values_list('balance', flat=True).aget()
+        return balance, account.currency
+
+    response = StreamingHttpResponse(live.stream(account.pk, read_balance), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # keep nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response